@@ -8,6 +8,11 @@ setup(
     ],
     install_requires=[
     	'pandas'
-    ]
+    ],
+    entry_points={
+        'console_scripts': [
+            'utils-prefetch-tiles = utils.tileprefetch:main',
+        ],
+    },
 )
 
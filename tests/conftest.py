@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import io
+import re
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from PIL import Image
+
+
+def tile_png(x, y, zoom):
+    """The PNG the stand-in server returns for a tile: a solid colour
+    derived from its coordinates."""
+    buf = io.BytesIO()
+    Image.new('RGB', (256, 256), ((x * 37) % 256, (y * 53) % 256, zoom * 10)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class TileServer(object):
+    """A local stand-in tile server.
+
+    `/tiles/{z}/{x}/{y}.png` serves a tile after `delay` seconds,
+    `/flaky/...` answers 503 to the first `failures` requests of each tile,
+    and anything else is a 404.  Requests per path and the most requests
+    in flight at once are recorded.
+    """
+    def __init__(self):
+        self.delay = 0.0
+        self.failures = 0
+        self.requests = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests[self.path] += 1
+                    count = server.requests[self.path]
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.delay)
+                    match = re.match(r'/(tiles|flaky)/(\d+)/(\d+)/(\d+)\.png$', self.path)
+                    if match is None:
+                        self.send_response(404)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    if match.group(1) == 'flaky' and count <= server.failures:
+                        self.send_response(503)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    zoom, x, y = map(int, match.groups()[1:])
+                    data = tile_png(x, y, zoom)
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        self.source = self.url + '/tiles/{z}/{x}/{y}.png'
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def tile_server():
+    server = TileServer()
+    yield server
+    server.close()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import gc
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+from utils.ForkedData import ForkedData, unFork
+
+
+def _total(data):
+    return float(data.value.sum())
+
+
+@pytest.mark.parametrize('backend', ['shm', 'mmap'])
+def test_view_outlives_its_forked_data(backend):
+    fd = ForkedData(np.arange(4.), backend=backend)
+    view = fd.value
+    del fd
+    gc.collect()
+    assert view.tolist() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_shm_segment_is_unlinked_after_release():
+    fd = ForkedData({'a': np.arange(3), 'b': np.ones((2, 2))}, backend='shm')
+    name = fd.name
+    values = fd.value
+    del fd
+    gc.collect()
+    assert not os.path.exists(os.path.join('/dev/shm', name))
+    assert values['a'].tolist() == [0, 1, 2] and values['b'].sum() == 4
+
+
+@pytest.mark.parametrize('backend', ['shm', 'mmap'])
+def test_workers_read_shared_arrays(backend):
+    fd = ForkedData(np.arange(1000.), backend=backend)
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        assert list(pool.map(_total, [fd] * 4)) == [499500.0] * 4
+    assert pickle.loads(pickle.dumps(fd)).value.sum() == 499500.0
+
+
+def _keys_and_sums(data):
+    return {key: float(value.sum()) for key, value in data.value.items()}
+
+
+@pytest.mark.parametrize('backend', ['shm', 'mmap'])
+def test_dict_of_arrays_round_trips_read_only(backend):
+    arrays = {'ints': np.arange(7, dtype=np.int16), 'grid': np.ones((3, 5), dtype='<f4'),
+              'flags': np.array([True, False, True]), 'empty': np.zeros(0)}
+    fd = ForkedData(arrays, backend=backend)
+    value = fd.value
+    assert set(value) == set(arrays)
+    for key, arr in arrays.items():
+        assert value[key].dtype == arr.dtype and value[key].shape == arr.shape
+        np.testing.assert_array_equal(value[key], arr)
+        assert value[key].ctypes.data % 64 == 0 or arr.size == 0
+        assert not value[key].flags.writeable
+    with pytest.raises(ValueError):
+        value['grid'][0, 0] = 2
+
+
+@pytest.mark.parametrize('backend', ['shm', 'mmap'])
+def test_shared_backends_reject_non_arrays(backend):
+    with pytest.raises(TypeError):
+        ForkedData([1, 2, 3], backend=backend)
+    with pytest.raises(TypeError):
+        ForkedData(np.array([{}, None]), backend=backend)
+    with pytest.raises(ValueError):
+        ForkedData(np.arange(3), backend='nope')
+
+
+def test_mmap_file_is_removed_after_release():
+    fd = ForkedData(np.arange(10), backend='mmap')
+    path = os.path.join(tempfile.gettempdir(), 'forkeddata-{}.bin'.format(fd.name))
+    assert os.path.exists(path)
+    del fd
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_shm_reaches_workers_of_any_start_method(method):
+    fd = ForkedData({'a': np.arange(10.), 'b': np.full(4, 2.)}, backend='shm')
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context(method)) as pool:
+        assert list(pool.map(_keys_and_sums, [fd] * 3)) == [{'a': 45.0, 'b': 8.0}] * 3
+    # Workers only detach, the master still owns the segment
+    assert os.path.exists(os.path.join('/dev/shm', fd.name))
+
+
+def test_fork_backend_is_inherited_by_forked_pools():
+    fd = ForkedData(np.arange(100.))
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+        assert pool.map(_total, [fd] * 3) == [4950.0] * 3
+    assert unFork(fd) is fd.value and unFork(3) == 3
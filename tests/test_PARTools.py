@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import operator
+import os
+import time
+import numpy as np
+import pytest
+from utils.PARTools import (ggroupBy, _partition_of, _merge_partition, gparallel, gparallel_stream,
+                           _auto_chunksize, _ChunkTuner, giparallel, TaskGraph, _shared_dir,
+                           greduce)
+
+
+def mod7(v):
+    return v % 7
+
+
+@pytest.mark.parametrize('spill', [False, True])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_partitioned_group_by_keeps_all_input(tmp_path, n_jobs, spill):
+    data = list(range(500))
+    serial = ggroupBy(data, mod7)
+    grouped = ggroupBy(data, mod7, n_jobs=n_jobs, chunksize=5, spill_dir=str(tmp_path) if spill else None)
+    assert sum(len(v) for _, v in grouped.items()) == len(data)
+    assert dict(grouped.items()) == dict(serial)
+    if spill:
+        grouped.close()
+
+
+def test_merge_partition_leaves_pieces_alone():
+    pieces = [{'a': [1]}, {'a': [2], 'b': [3]}]
+    grouped, n_groups = _merge_partition(0, pieces, None)
+    assert grouped == {'a': [1, 2], 'b': [3]} and n_groups == 2
+    assert pieces == [{'a': [1]}, {'a': [2], 'b': [3]}]
+
+
+def test_partition_of_is_stable_and_rejects_identity_hashed_keys():
+    assert _partition_of(1, 16) == _partition_of(1.0, 16) == _partition_of(True, 16)
+    assert _partition_of(frozenset(['x', 'y', 'z']), 16) == _partition_of(frozenset(['z', 'y', 'x']), 16)
+    assert _partition_of(None, 16) == 0
+    with pytest.raises(TypeError):
+        _partition_of(object(), 16)
+
+
+def square(v, offset=0):
+    return v * v + offset
+
+
+def sleep_then_echo(v):
+    time.sleep(v)
+    return v
+
+
+@pytest.mark.parametrize('chunksize', [1, 7, 'auto'])
+def test_gparallel_chunks_keep_order(chunksize):
+    data = list(range(103))
+    assert gparallel(square, data, n_jobs=2, chunksize=chunksize, offset=1) == [v * v + 1 for v in data]
+
+
+def test_auto_chunksize_targets_task_time():
+    assert _auto_chunksize(None, 1000, 4) == 63
+    assert _auto_chunksize(0.01, 1000, 4) == 10
+    assert _auto_chunksize(1e-9, 10 ** 9, 4) == 10000
+
+
+@pytest.mark.parametrize('chunksize', [1, 5, 'auto'])
+def test_gparallel_stream_yields_every_result_in_order(chunksize):
+    with gparallel_stream(square, (v for v in range(200)), n_jobs=2, chunksize=chunksize, pbar=False) as results:
+        assert list(results) == [v * v for v in range(200)]
+
+
+def test_gparallel_stream_unordered_yields_fast_results_first():
+    delays = [0.6, 0.0, 0.0, 0.0]
+    with gparallel_stream(sleep_then_echo, delays, n_jobs=2, chunksize=1, ordered=False, pbar=False) as results:
+        out = list(results)
+    assert sorted(out) == sorted(delays) and out[-1] == 0.6
+
+
+def test_gparallel_stream_reads_input_lazily():
+    consumed = []
+
+    def source():
+        for v in range(1000):
+            consumed.append(v)
+            yield v
+
+    with gparallel_stream(square, source(), n_jobs=2, chunksize=1, max_inflight=3, pbar=False) as results:
+        assert next(results) == 0
+        assert len(consumed) <= 4
+        assert [next(results) for _ in range(9)] == [v * v for v in range(1, 10)]
+        assert len(consumed) <= 13
+
+
+def test_chunk_tuner_adapts_to_measured_time():
+    tuner = _ChunkTuner('auto', target=0.1)
+    tuner.update(10, 0.1)
+    assert tuner.size == 10
+    for _ in range(50):
+        tuner.update(100, 0.01)
+    assert 90 <= tuner.size <= 1000
+    fixed = _ChunkTuner(5)
+    fixed.update(10, 10.0)
+    assert fixed.size == 5
+
+
+def test_giparallel_is_lazy_and_owns_its_pool():
+    consumed = []
+
+    def source():
+        for v in range(10 ** 6):
+            consumed.append(v)
+            yield v
+
+    results = giparallel(square, source(), nThreads=2, chunksize=2, max_inflight=2)
+    assert not consumed and not multiprocessing.active_children()
+    assert [next(results) for _ in range(3)] == [0, 1, 4]
+    assert len(consumed) <= 8 and len(multiprocessing.active_children()) == 2
+    results.close()
+    assert not multiprocessing.active_children()
+    with pytest.raises(StopIteration):
+        next(results)
+
+
+def test_giparallel_shuts_pool_down_when_exhausted_or_left_early():
+    results = giparallel(square, range(50), nThreads=2, offset=1)
+    assert list(results) == [v * v + 1 for v in range(50)]
+    assert results._pool is None and not multiprocessing.active_children()
+    with giparallel(square, range(50), nThreads=2) as results:
+        for v in results:
+            if v > 10:
+                break
+    assert not multiprocessing.active_children()
+
+
+def load(i):
+    time.sleep(0.05)
+    return np.full(300000, float(i))
+
+
+def transform(arr, scale=1.0):
+    return arr * scale
+
+
+def summarize(parts):
+    return {'total': float(sum(part.sum() for part in parts['arrays'])), 'n': len(parts['arrays'])}
+
+
+def fail(value):
+    raise KeyError(value)
+
+
+def _shared_files():
+    return set(f for f in os.listdir(_shared_dir()) if f.startswith('taskgraph-'))
+
+
+def _pipeline(n_items):
+    graph = TaskGraph()
+    loaded = graph.map(load, range(n_items))
+    scaled = [graph.add(transform, node, scale=2.0) for node in loaded]
+    total = graph.add(summarize, {'arrays': scaled})
+    return graph, loaded, scaled, total
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_task_graph_runs_pipeline(n_jobs):
+    before = _shared_files()
+    graph, loaded, scaled, total = _pipeline(6)
+    assert len(graph) == 13
+    result = graph.run(total, n_jobs=n_jobs, share_threshold=2**16, pbar=False)
+    assert result == {'total': 2.0 * 300000 * sum(range(6)), 'n': 6}
+    assert _shared_files() == before
+    assert 'load' in graph.report() and len(graph.timings) == 13
+
+
+def test_task_graph_has_no_stage_barrier():
+    graph, loaded, scaled, total = _pipeline(8)
+    graph.run(total, n_jobs=2, pbar=False)
+    timings = graph.timings
+    # The first items are transformed while later ones are still loading
+    assert timings[scaled[0]]['submitted'] < timings[loaded[-1]]['finished']
+    assert len(set(t['worker'] for t in timings.values())) == 2
+
+
+def test_task_graph_outputs_and_shared_arrays():
+    before = _shared_files()
+    graph = TaskGraph()
+    big = graph.add(load, 3)
+    small = graph.add(transform, np.arange(3.), scale=3.0)
+    both = graph.add(transform, big, scale=0.5)
+    results = graph.run([big, both, small], n_jobs=2, share_threshold=2**16, pbar=False)
+    assert results[0].sum() == 900000 and results[1].sum() == 450000
+    assert results[2].tolist() == [0, 3, 6]
+    assert not isinstance(results[0], np.memmap) and results[0].flags.writeable
+    assert _shared_files() == before
+    sinks = graph.run(n_jobs=1, pbar=False)
+    assert set(sinks) == {both, small}
+
+
+def test_task_graph_reports_failed_task_and_cleans_up():
+    before = _shared_files()
+    graph = TaskGraph()
+    arrays = graph.map(load, range(3))
+    graph.add(fail, arrays)
+    with pytest.raises(RuntimeError, match='fail'):
+        graph.run(n_jobs=2, share_threshold=2**16, pbar=False)
+    assert _shared_files() == before
+
+
+@pytest.mark.parametrize('n_items', [1, 9, 10, 11, 31, 64, 70])
+def test_tree_greduce_keeps_order_of_non_commutative_reductions(n_items):
+    items = [[i] for i in range(n_items)]
+    assert greduce(iter(items), operator.add, n_jobs=2, chunksize=10) == list(range(n_items))
+
+
+def test_tree_greduce_commutative_and_logging():
+    logged = []
+    total = greduce(range(10000), operator.add, logFun=lambda output, count: logged.append(count),
+                    loggingRate=2000, n_jobs=2, chunksize=500, commutative=True)
+    assert total == sum(range(10000))
+    assert logged and logged == sorted(logged) and logged[-1] <= 9999
+    assert greduce(range(10000), operator.add) == total
+
+
+def test_tree_greduce_reads_input_lazily_and_rejects_empty_input():
+    consumed = []
+
+    def source():
+        for i in range(5000):
+            consumed.append(i)
+            yield [i]
+
+    seen = []
+
+    def log(output, count):
+        seen.append(len(consumed))
+
+    result = greduce(source(), operator.add, logFun=log, loggingRate=1, n_jobs=2, chunksize=100, max_inflight=2)
+    assert result == list(range(5000))
+    # Only max_inflight chunks were ever read ahead of the first result
+    assert seen[0] <= 300
+    with pytest.raises(TypeError):
+        greduce(iter([]), operator.add, n_jobs=2)
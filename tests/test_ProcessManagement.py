@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import time
+from multiprocessing import Process, Queue
+import pytest
+
+pytest.importorskip('distributed')
+from utils.ProcessManagement import MemoryPolicy, Supervisor, spawn_worker, _wait_ready
+
+
+@pytest.mark.parametrize('level', ['spill', 'pause', 'terminate'])
+def test_memory_policy_levels_can_be_turned_off(level):
+    policy = MemoryPolicy(**{level: False})
+    assert getattr(policy, level) is False
+    assert policy.level(0.99) != level
+
+
+def test_memory_policy_rejects_misordered_levels():
+    with pytest.raises(ValueError):
+        MemoryPolicy(spill=0.9, pause=False, terminate=0.8)
+
+
+@pytest.mark.parametrize('fraction', [0.5, 0.75, 0.95, 1.0])
+def test_memory_policy_from_legacy_pause_fraction(fraction):
+    policy = MemoryPolicy.from_pause_fraction(fraction)
+    assert policy.terminate == fraction
+    assert 0 < policy.target <= policy.spill <= policy.pause <= policy.terminate
+    assert policy.level(fraction + 0.01) == 'terminate'
+
+
+@pytest.fixture(scope='module')
+def scheduler():
+    from distributed import LocalCluster
+    cluster = LocalCluster(n_workers=0, processes=True, scheduler_port=0, dashboard_address=None)
+    yield cluster
+    cluster.close()
+
+
+def _wait_for(condition, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def _n_registered(cluster):
+    return len(cluster.scheduler.workers)
+
+
+def test_supervisor_replaces_killed_worker_and_scales(scheduler, tmp_path):
+    address = scheduler.scheduler_address.split('://')[-1]
+    supervisor = Supervisor(1, address, '200MB', min_workers=1, max_workers=2, poll_interval=0.2,
+                            scale_interval=0.5, high_memory=1.1, low_memory=0.0, local_dir=str(tmp_path))
+    with supervisor:
+        assert _wait_for(lambda: _n_registered(scheduler) == 1)
+        victim = supervisor.procs[0]
+        victim.terminate()
+        assert _wait_for(lambda: any(e['event'] == 'exited' and e['worker'] == victim.name for e in supervisor.events))
+        assert _wait_for(lambda: len(supervisor.workers) == 1 and victim.name not in supervisor.workers)
+        assert _wait_for(lambda: _n_registered(scheduler) == 1)
+
+        # Plenty of headroom: grow to max_workers
+        supervisor.low_memory, supervisor.high_cpu = 1.1, 1.1
+        assert _wait_for(lambda: len(supervisor.workers) == 2)
+        assert _wait_for(lambda: _n_registered(scheduler) == 2)
+        # Memory pressure: shrink back to min_workers
+        supervisor.low_memory, supervisor.high_memory = 0.0, 0.0
+        assert _wait_for(lambda: len(supervisor.workers) == 1)
+    events = [e['event'] for e in supervisor.events]
+    assert 'scale_up' in events and 'scale_down' in events
+    assert _wait_for(lambda: _n_registered(scheduler) == 0)
+
+
+def test_unsupervised_workers_stop_reporting_after_ready(scheduler, tmp_path):
+    address = scheduler.scheduler_address.split('://')[-1]
+    events = Queue()
+    proc = Process(target=spawn_worker, name='lonely', args=('lonely', address, '200MB'),
+                   kwargs={'events': events, 'local_dir': str(tmp_path),
+                           'memory_policy': MemoryPolicy(metrics_interval=0.1)})
+    proc.start()
+    try:
+        assert 'lonely' in _wait_ready([proc], events, 60)
+        time.sleep(5)
+        assert events.empty()
+    finally:
+        proc.terminate()
+        proc.join(10)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import mmap
+import numpy as np
+import pytest
+from utils.common import (saveArrays, loadArrays, saveJSON, loadJSON, saveJSONLines, iterJSONLines,
+                          openText)
+
+
+def _arrays():
+    rng = np.random.RandomState(0)
+    return {'big': rng.rand(300, 200), 'ints': np.arange(50000, dtype=np.int32),
+            'fortran': np.asfortranarray(rng.rand(100, 90)), 'small': np.arange(3),
+            'nested': [np.ones(20000, dtype=np.uint8), ('label', {'x': np.zeros((128, 128), np.float32)})],
+            'strided': rng.rand(200, 200)[::2, ::3]}
+
+
+def _check_equal(a, b):
+    assert type(a) is type(b)
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            _check_equal(a[key], b[key])
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            _check_equal(x, y)
+    elif isinstance(a, np.ndarray):
+        assert a.dtype == b.dtype and a.shape == b.shape
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert a == b
+
+
+def _owner(arr):
+    """The object at the bottom of an array's chain of bases."""
+    while arr is not None:
+        owner = arr
+        arr = arr.obj if isinstance(arr, memoryview) else getattr(arr, 'base', None)
+    return owner
+
+
+@pytest.mark.parametrize('mmap_mode', ['r', 'c', None])
+def test_save_arrays_round_trips(tmp_path, mmap_mode):
+    data = _arrays()
+    fname = str(tmp_path / 'arrays.bin')
+    saveArrays(fname, data)
+    _check_equal(loadArrays(fname, mmap_mode=mmap_mode), data)
+
+
+def test_large_arrays_are_mapped_aligned_and_read_only(tmp_path):
+    fname = str(tmp_path / 'arrays.bin')
+    saveArrays(fname, _arrays())
+    loaded = loadArrays(fname)
+    for key in ('big', 'ints', 'fortran'):
+        assert isinstance(_owner(loaded[key]), mmap.mmap)
+        assert loaded[key].ctypes.data % 64 == 0
+        assert not loaded[key].flags.writeable
+    assert loaded['fortran'].flags.f_contiguous
+    # Small arrays stay in the pickle
+    assert not isinstance(_owner(loaded['small']), mmap.mmap)
+
+
+def test_copy_on_write_leaves_file_unchanged(tmp_path):
+    fname = str(tmp_path / 'arrays.bin')
+    saveArrays(fname, {'big': np.zeros(100000)})
+    loaded = loadArrays(fname, mmap_mode='c')
+    loaded['big'][:10] = 1
+    assert loadArrays(fname)['big'][:10].sum() == 0
+
+
+def test_load_arrays_rejects_other_files(tmp_path):
+    fname = tmp_path / 'other.bin'
+    fname.write_bytes(b'not written by saveArrays')
+    with pytest.raises(ValueError):
+        loadArrays(str(fname))
+
+
+def _zstd_available():
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard
+        except ImportError:
+            return False
+    return True
+
+
+COMPRESSIONS = [('.jsonl', None, b'{'), ('.jsonl.gz', 'gzip', b'\x1f\x8b'), ('.jsonl.bz2', 'bz2', b'BZh'),
+                ('.jsonl.xz', 'xz', b'\xfd7zXZ'),
+                pytest.param('.jsonl.zst', 'zstd', b'\x28\xb5\x2f\xfd',
+                             marks=pytest.mark.skipif(not _zstd_available(), reason='no zstd module'))]
+
+
+@pytest.mark.parametrize('suffix, compression, magic', COMPRESSIONS)
+def test_json_lines_round_trip_with_inferred_compression(tmp_path, suffix, compression, magic):
+    fname = str(tmp_path / ('records' + suffix))
+    records = [{'id': i, 'name': u'café {}'.format(i), 'values': [i, i / 2.0, None]} for i in range(2500)]
+    assert saveJSONLines(fname, iter(records), batch_size=1000) == 2500
+    with open(fname, 'rb') as fp:
+        assert fp.read(len(magic)) == magic
+    assert list(iterJSONLines(fname)) == records
+    assert list(iterJSONLines(fname, compression=compression)) == records
+    assert saveJSONLines(fname, records[:3], append=True) == 3
+    assert list(iterJSONLines(fname)) == records + records[:3]
+
+
+def test_iter_json_lines_is_lazy_and_skips_blank_lines(tmp_path):
+    fname = str(tmp_path / 'records.jsonl.gz')
+    with openText(fname, 'w') as fp:
+        fp.write(u'{"a": 1}\n\n  \n{"a": 2}\nnot json\n')
+    records = iterJSONLines(fname)
+    assert next(records) == {'a': 1} and next(records) == {'a': 2}
+    with pytest.raises(ValueError):
+        next(records)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_save_json_compressed(tmp_path, compact):
+    fname = str(tmp_path / 'doc.json.xz')
+    doc = {'b': [1, 2, {'c': None}], 'a': u'ü'}
+    saveJSON(fname, doc, compact=compact)
+    assert loadJSON(fname) == doc
+    with open(fname, 'rb') as fp:
+        assert fp.read(6) == b'\xfd7zXZ\x00'
+    with openText(fname) as fp:
+        text = fp.read()
+    assert ('\n' in text) != compact
+    with pytest.raises(ValueError):
+        saveJSON(fname, doc, compression='rar')
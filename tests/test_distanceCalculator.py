@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from utils.distanceCalculator import haversine_np, haversine_pairwise
+
+
+def _points(n, seed):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(-180, 180, n), np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+
+
+def _brute_force(lon1, lat1, lon2, lat2):
+    return haversine_np(lon1[:, None], lat1[:, None], lon2[None, :], lat2[None, :])
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+@pytest.mark.parametrize('block_size', [7, 256])
+def test_pairwise_matches_broadcast_haversine(block_size, n_jobs):
+    lon1, lat1 = _points(300, 0)
+    lon2, lat2 = _points(45, 1)
+    dist = haversine_pairwise(lon1, lat1, lon2, lat2, block_size=block_size, n_jobs=n_jobs)
+    assert dist.shape == (300, 45) and dist.dtype == np.float64
+    np.testing.assert_allclose(dist, _brute_force(lon1, lat1, lon2, lat2), rtol=1e-9, atol=1e-6)
+
+
+def test_pairwise_handles_identical_and_antipodal_points():
+    lon, lat = np.array([0., 10., 180., -45.]), np.array([0., 20., 0., 89.9])
+    dist = haversine_pairwise(lon, lat, lon, lat)
+    assert np.allclose(np.diag(dist), 0, atol=1e-4)
+    antipodal = haversine_pairwise([0.], [0.], [180.], [0.])
+    assert np.isfinite(antipodal).all() and abs(antipodal[0, 0] - np.pi * 6367) < 1e-6
+
+
+def test_pairwise_float32_and_out(tmp_path):
+    lon1, lat1 = _points(100, 2)
+    lon2, lat2 = lon1 + 0.01, lat1 + 0.01
+    expected = _brute_force(lon1, lat1, lon2, lat2)
+    out = np.lib.format.open_memmap(str(tmp_path / 'dist.npy'), mode='w+', dtype=np.float32, shape=(100, 100))
+    assert haversine_pairwise(lon1, lat1, lon2, lat2, out=out, dtype=np.float32, block_size=32) is out
+    near = expected < 3000
+    np.testing.assert_allclose(out[near], expected[near], atol=2e-3)
+    np.testing.assert_allclose(out, expected, atol=1.5)
+    with pytest.raises(ValueError):
+        haversine_pairwise(lon1, lat1, lon2, lat2, out=np.empty((100, 99)))
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_pairwise_threshold_returns_sparse_triples(n_jobs):
+    lon1, lat1 = _points(200, 3)
+    lon2, lat2 = _points(150, 4)
+    expected = _brute_force(lon1, lat1, lon2, lat2)
+    rows, cols, dist = haversine_pairwise(lon1, lat1, lon2, lat2, threshold=2000, block_size=64, n_jobs=n_jobs)
+    order = np.lexsort((cols, rows))
+    expected_rows, expected_cols = np.nonzero(expected <= 2000)
+    np.testing.assert_array_equal(rows[order], expected_rows)
+    np.testing.assert_array_equal(cols[order], expected_cols)
+    np.testing.assert_allclose(dist[order], expected[expected_rows, expected_cols], rtol=1e-9, atol=1e-6)
+    empty = haversine_pairwise([0.], [0.], [90.], [0.], threshold=1)
+    assert [len(part) for part in empty] == [0, 0, 0]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pytest
+from utils.extsort import sort_runs, merge_sorted, external_sort, quantile, rank
+
+
+def _data(n=20000, seed=0):
+    rng = np.random.RandomState(seed)
+    data = np.round(rng.standard_normal(n) * 100)
+    data[rng.randint(0, n, 50)] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+@pytest.mark.parametrize('kind', ['array', 'npy', 'chunks', 'scalars'])
+def test_external_sort_matches_numpy(tmp_path, kind, n_jobs):
+    data = _data()
+    source = {'array': data, 'npy': str(tmp_path / 'in.npy'),
+              'chunks': (data[i:i + 777] for i in range(0, len(data), 777)),
+              'scalars': iter(data.tolist())}[kind]
+    if kind == 'npy':
+        np.save(source, data)
+    out = external_sort(source, str(tmp_path / 'out.npy'), run_size=3000, n_jobs=n_jobs,
+                        tmp_dir=str(tmp_path), block_size=500)
+    np.testing.assert_array_equal(out, np.sort(data))
+    # Only the output is left behind
+    assert sorted(os.listdir(str(tmp_path))) == sorted(['out.npy'] + (['in.npy'] if kind == 'npy' else []))
+
+
+def test_merge_sorted_handles_duplicates_and_empty_runs():
+    rng = np.random.RandomState(1)
+    arrays = [np.sort(rng.randint(0, 20, n)) for n in (0, 1, 50, 333, 1000)]
+    blocks = list(merge_sorted(arrays, block_size=16))
+    assert all(len(b) for b in blocks)
+    np.testing.assert_array_equal(np.concatenate(blocks), np.sort(np.concatenate(arrays)))
+    assert list(merge_sorted([])) == []
+
+
+def test_order_statistics_are_exact(tmp_path):
+    data = _data(30000, seed=2)
+    clean = data[~np.isnan(data)]
+    with sort_runs(data, run_size=4096, tmp_dir=str(tmp_path)) as runs:
+        assert (runs.n, runs.n_nan, len(runs.runs)) == (len(clean), np.isnan(data).sum(), 8)
+        values = [-500, -0.5, 0, 3, 1e9]
+        np.testing.assert_array_equal(runs.rank(values), [(clean <= v).sum() for v in values])
+        np.testing.assert_allclose(runs.cdf(0), (clean <= 0).mean())
+        ordered = np.sort(clean)
+        for k in (0, 1, 12345, len(clean) - 1):
+            assert runs.select(k) == ordered[k]
+        with pytest.raises(IndexError):
+            runs.select(len(clean))
+        ranks = np.arange(0, len(clean), 97)[::-1]
+        np.testing.assert_array_equal(runs.at_ranks(ranks), ordered[ranks])
+        q = np.linspace(0, 1, 41)
+        np.testing.assert_allclose(runs.quantile(q), np.nanquantile(data, q))
+        assert runs.quantile(0.5) == np.nanmedian(data)
+        values, counts = np.unique(clean, return_counts=True)
+        assert runs.mode(block_size=64) == (values[np.argmax(counts)], counts.max())
+        x, r = runs.ecdf(100)
+        np.testing.assert_array_equal(x, ordered[r - 1])
+        assert r[0] == 1 and r[-1] == len(clean)
+        directory = runs.directory
+    assert not os.path.exists(directory)
+
+
+def test_mode_counts_values_spanning_blocks_and_nans(tmp_path):
+    data = np.r_[np.zeros(10), np.ones(300), np.full(299, 2.)]
+    with sort_runs(data[::-1].copy(), run_size=100, tmp_dir=str(tmp_path)) as runs:
+        assert runs.mode(block_size=7) == (1.0, 300)
+    with sort_runs(np.r_[np.ones(3), np.full(5, np.nan)], tmp_dir=str(tmp_path)) as runs:
+        value, count = runs.mode()
+        assert np.isnan(value) and count == 5
+
+
+def test_module_shortcuts(tmp_path):
+    data = _data(5000, seed=3)
+    assert quantile(data, 0.25, run_size=1000, tmp_dir=str(tmp_path)) == np.nanquantile(data, 0.25)
+    assert rank(data, [0.0], run_size=1000, tmp_dir=str(tmp_path)).tolist() == [int((data <= 0).sum())]
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import matplotlib.pyplot as plt
+from utils import geoplot
+
+
+def test_plot_without_traces(monkeypatch):
+    lines = geoplot.plot([], [], max_points=100)
+    assert len(lines) == 1 and len(lines[0].get_xdata()) == 0
+    # No traces at all must not divide the point budget by zero
+    monkeypatch.setattr(geoplot, '_as_traces', lambda longitudes, latitudes: [])
+    lines = geoplot.plot([], [], max_points=100)
+    assert len(lines) == 1 and len(lines[0].get_xdata()) == 0
+    plt.close('all')
+
+
+def test_plot_joins_decimated_traces_with_gaps():
+    traces = [np.linspace(0, 10, n) for n in (50, 5000)]
+    lines = geoplot.plot(traces, traces, max_points=200)
+    x = lines[0].get_xdata()
+    assert np.isnan(x).sum() == 1
+    assert len(x) <= 50 + 1 + 200
+    plt.close('all')
+
+
+def test_shrink_rounds_block_means():
+    rng = np.random.RandomState(0)
+    tile = rng.randint(0, 256, (256, 256, 3)).astype(np.uint8)
+    tile[:32, :32] = 255
+    for factor in (2, 3, 16, 17):
+        h, w = 256 // factor, 256 // factor
+        blocks = tile[:h * factor, :w * factor].reshape(h, factor, w, factor, 3).astype(float)
+        expected = np.floor(blocks.mean(axis=(1, 3)) + 0.5).astype(np.uint8)
+        np.testing.assert_array_equal(geoplot._shrink(tile, factor), expected)
+    assert (geoplot._shrink(tile, 16)[:2, :2] == 255).all()
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from utils.mapping import Extent, ExtentArray, _from_3857, _from_3857_np
+
+
+def test_from_3857_np_matches_scalar():
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(-2e7, 2e7, (2, 100))
+    xx, yy = _from_3857_np(x, y)
+    expected = np.array([_from_3857(a, b) for a, b in zip(x, y)])
+    np.testing.assert_allclose(np.column_stack([xx, yy]), expected, rtol=0, atol=1e-15)
+
+
+def test_extent_array_from_3857_matches_extents():
+    bounds = np.array([[-1e6, 2e6, 3e6, -5e5], [0, 1e5, 2e5, 1e5], [5e6, 6e6, -1e6, -2e6]])
+    extents = ExtentArray.from_3857(*bounds.T)
+    assert extents._project_str == "epsg:3857"
+    for i, row in enumerate(bounds):
+        single = Extent.from_3857(*row)
+        np.testing.assert_allclose(extents[i].xrange, single.xrange)
+        np.testing.assert_allclose(extents[i].yrange, single.yrange)
+    # Scalars broadcast against arrays
+    np.testing.assert_allclose(ExtentArray.from_3857(0, [1e5, 2e5], 1e5, 0)._xmax,
+                               [_from_3857(1e5, 0)[0], _from_3857(2e5, 0)[0]])
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pytest
+import matplotlib.pyplot as plt
+from utils.quantilesketch import KLLSketch, sketch_batches
+from utils.common import cdfPlot
+
+
+def _max_rank_error(sketch, data):
+    ordered = np.sort(data)
+    probes = ordered[::max(1, len(data) // 500)]
+    exact = np.searchsorted(ordered, probes, side='right')
+    return np.abs(sketch.rank(probes) - exact).max() / float(len(data))
+
+
+@pytest.mark.parametrize('distribution', ['uniform', 'lognormal', 'sorted', 'few_values'])
+def test_rank_error_is_bounded_and_size_stays_small(distribution):
+    rng = np.random.RandomState(0)
+    data = {'uniform': rng.rand(400000), 'lognormal': rng.lognormal(0, 3, 400000),
+            'sorted': np.arange(400000.), 'few_values': rng.randint(0, 7, 400000).astype(float)}[distribution]
+    sketch = KLLSketch(k=200, seed=1)
+    for batch in np.array_split(data, 97):
+        sketch.update(batch)
+    assert sketch.n == len(data) and sketch.size <= 3 * 200 + 50
+    assert sketch.rank(np.inf) == len(data)
+    assert _max_rank_error(sketch, data) < 3 * 1.7 / 200
+    assert sketch.quantile(0) == data.min() and sketch.quantile(1) == data.max()
+    q = np.array([0.01, 0.25, 0.5, 0.9, 0.999])
+    ordered, values = np.sort(data), sketch.quantile(q)
+    # A repeated value covers a range of ranks
+    low = np.searchsorted(ordered, values, side='left') / float(len(data))
+    high = np.searchsorted(ordered, values, side='right') / float(len(data))
+    assert np.all((low - 0.03 <= q) & (q <= high + 0.03))
+
+
+def test_merged_sketches_summarise_all_parts():
+    rng = np.random.RandomState(2)
+    parts = [rng.normal(loc, 1, 50000) for loc in (-5, 0, 5, 10)]
+    sketches = [KLLSketch(seed=i).update(part) for i, part in enumerate(parts)]
+    merged = sketches[0] + sketches[1]
+    merged.merge(sketches[2]).merge(sketches[3])
+    assert sketches[0].n == 50000 and merged.n == 200000
+    assert merged.rank(np.inf) == 200000 and merged.size <= 650
+    assert _max_rank_error(merged, np.concatenate(parts)) < 3 * 1.7 / 200
+    assert merged.min == min(p.min() for p in parts) and merged.max == max(p.max() for p in parts)
+
+
+def test_nans_serialization_and_empty_sketches():
+    sketch = KLLSketch(k=50).update([np.nan, 1.0, 2.0, np.nan]).update(np.arange(1000.))
+    assert (sketch.n, sketch.n_nan) == (1002, 2)
+    copy = KLLSketch.from_bytes(sketch.to_bytes())
+    assert (copy.k, copy.n, copy.n_nan, copy.min, copy.max) == (50, 1002, 2, 0.0, 999.0)
+    np.testing.assert_array_equal(copy.rank([10, 500]), sketch.rank([10, 500]))
+    assert len(sketch.to_bytes()) < 4000
+    with pytest.raises(ValueError):
+        KLLSketch().quantile(0.5)
+    assert KLLSketch().update([]).n == 0 and KLLSketch().cdf(1.0) == 0
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_sketch_batches(n_jobs):
+    rng = np.random.RandomState(3)
+    batches = [rng.exponential(size=20000) for _ in range(10)]
+    sketch = sketch_batches(iter(batches), n_jobs=n_jobs)
+    assert sketch.n == 200000
+    assert _max_rank_error(sketch, np.concatenate(batches)) < 3 * 1.7 / 200
+
+
+def test_cdf_plot_of_a_sketch_is_bounded():
+    sketch = KLLSketch().update(np.random.RandomState(4).rand(100000))
+    line, = cdfPlot(sketch, max_points=300)
+    x, y = line.get_data()
+    assert len(x) <= 300 and np.all(np.diff(x) >= 0) and np.all(np.diff(y) > 0)
+    assert y[-1] == 1.0 and abs(np.interp(0.5, x, y) - 0.5) < 0.02
+    plt.close('all')
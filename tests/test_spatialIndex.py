@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from utils import spatialIndex
+from utils.spatialIndex import SpatialIndex
+from utils.distanceCalculator import haversine_pairwise
+
+
+def _clustered(n, seed=0):
+    rs = np.random.RandomState(seed)
+    return 36.8 + rs.normal(scale=0.01, size=n), -1.3 + rs.normal(scale=0.01, size=n)
+
+
+def _brute_force(lon, lat, qlon, qlat, k):
+    d = haversine_pairwise(qlon, qlat, lon, lat)
+    order = np.argsort(d, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(d, order, axis=1), order
+
+
+@pytest.mark.parametrize('budget', [spatialIndex._PAIR_BUDGET, 1000])
+def test_query_far_from_clustered_points_matches_brute_force(monkeypatch, budget):
+    monkeypatch.setattr(spatialIndex, '_PAIR_BUDGET', budget)
+    lon, lat = _clustered(3000)
+    rs = np.random.RandomState(1)
+    qlon, qlat = rs.uniform(-180, 180, 200), rs.uniform(-80, 80, 200)
+    index = SpatialIndex(lon, lat)
+    distances, indices = index.query(qlon, qlat, k=3, batch_size=64)
+    expected, _ = _brute_force(lon, lat, qlon, qlat, 3)
+    np.testing.assert_allclose(distances, expected, rtol=1e-9)
+    assert (indices >= 0).all()
+
+
+def test_query_radius_near_and_far_matches_brute_force(monkeypatch):
+    monkeypatch.setattr(spatialIndex, '_PAIR_BUDGET', 500)
+    lon, lat = _clustered(2000)
+    qlon = np.r_[lon[:20], 0.0, 120.0]
+    qlat = np.r_[lat[:20], 0.0, 45.0]
+    index = SpatialIndex(lon, lat)
+    for radius in [0.5, 20000.0]:
+        found = index.query_radius(qlon, qlat, radius)
+        d = haversine_pairwise(qlon, qlat, lon, lat)
+        for row, points in zip(d, found):
+            assert sorted(points) == list(np.flatnonzero(row <= radius))
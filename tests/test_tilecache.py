@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+import pytest
+from utils.tilecache import MemoryLRU, DiskTileStore, TileCache, MosaicCache
+from conftest import tile_png
+
+
+def test_memory_lru_evicts_least_recently_used():
+    lru = MemoryLRU(max_bytes=10)
+    lru.put('a', b'xxxx')
+    lru.put('b', b'xxxx')
+    assert lru.get('a') == b'xxxx'
+    lru.put('c', b'xxxx')
+    assert 'b' not in lru and 'a' in lru and 'c' in lru
+    assert (lru.nbytes, lru.evictions) == (8, 1)
+    lru.put('huge', b'x' * 11)
+    assert 'huge' not in lru and len(lru) == 2
+
+
+def test_disk_store_evicts_least_recently_used(tmp_path):
+    store = DiskTileStore(str(tmp_path / 'tiles.sqlite'), max_bytes=None, touch_interval=0)
+    for x in range(40):
+        store.put(('s', 1, x, 0), b'x' * 100)
+        time.sleep(0.001)
+    store.get(('s', 1, 0, 0))
+    store.max_bytes = 2000
+    store.put(('s', 1, 99, 0), b'x' * 100)
+    assert store.nbytes <= 2000 and store.evictions >= 21
+    assert ('s', 1, 0, 0) in store and ('s', 1, 99, 0) in store
+    assert ('s', 1, 1, 0) not in store and ('s', 1, 39, 0) in store
+
+
+def test_disk_store_throttles_access_time_updates(tmp_path):
+    store = DiskTileStore(str(tmp_path / 'tiles.sqlite'), touch_interval=3600)
+    store.put(('s', 1, 0, 0), b'data')
+
+    def atime():
+        return store._connect().execute("SELECT atime FROM tiles").fetchone()[0]
+
+    written = atime()
+    assert store.get(('s', 1, 0, 0)) == b'data'
+    assert atime() == written
+    store._connect().execute("UPDATE tiles SET atime=atime - 7200")
+    store.get(('s', 1, 0, 0))
+    assert atime() >= written
+
+
+def test_tile_cache_refetches_corrupt_disk_entries(tmp_path):
+    store = DiskTileStore(str(tmp_path / 'tiles.sqlite'))
+    store.put(('s', 3, 1, 2), b'not a png')
+    calls = []
+
+    def fetch(tile_source, x, y, zoom):
+        calls.append((x, y, zoom))
+        return tile_png(x, y, zoom)
+
+    cache = TileCache(disk=store)
+    tile = cache.get('s', 1, 2, 3, fetch)
+    assert tile.shape == (256, 256, 3) and tuple(tile[0, 0]) == (37, 106, 30)
+    assert calls == [(1, 2, 3)] and cache.stats()['corrupt'] == 1
+    assert store.get(('s', 3, 1, 2)) == tile_png(1, 2, 3)
+    # Once repaired, a fresh cache reads it from disk
+    fresh = TileCache(disk=store)
+    fresh.get('s', 1, 2, 3, fetch)
+    assert len(calls) == 1 and fresh.stats()['disk_hits'] == 1
+    with pytest.raises(RuntimeError):
+        TileCache(disk=None).get('s', 0, 0, 1, lambda *args: b'still not a png')
+
+
+def test_tile_cache_memory_tier_is_bounded():
+    cache = TileCache(memory_bytes=3 * 256 * 256 * 3, disk=None)
+    for x in range(5):
+        cache.get('s', x, 0, 1, lambda tile_source, x, y, zoom: tile_png(x, y, zoom))
+    stats = cache.stats()
+    assert (stats['memory_tiles'], stats['memory_evictions'], stats['misses']) == (3, 2, 5)
+
+
+def test_mosaic_cache_finds_largest_overlap():
+    cache = MosaicCache(max_pixels=2 * 1024 * 1024)
+    cache.put('s', 5, (0, 1, 0, 1), np.zeros((512, 512, 3), np.uint8))
+    cache.put('s', 5, (2, 5, 0, 3), np.zeros((1024, 1024, 3), np.uint8))
+    box, overlap, _ = cache.best_overlap('s', 5, (1, 3, 0, 1))
+    assert box == (2, 5, 0, 3) and overlap == (2, 3, 0, 1)
+    assert cache.best_overlap('s', 6, (1, 3, 0, 1)) is None
+    cache.put('s', 5, (0, 3, 0, 3), np.zeros((1024, 1024, 3), np.uint8))
+    assert cache.stats()['evictions'] == 1 and cache.get('s', 5, (0, 1, 0, 1)) is None
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import io
+import time
+import numpy as np
+import pytest
+from PIL import Image
+from utils import geoplot
+from utils.tilecache import TileCache, MosaicCache
+from utils.tilefetch import TileFetcher
+from conftest import tile_png
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = TileFetcher(max_workers=16, per_host=16, retries=3, backoff=0.05, timeout=10)
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch_many_downloads_concurrently(tile_server, fetcher):
+    tile_server.delay = 0.2
+    tiles = [(tile_server.source, x, y, 5) for x in range(4) for y in range(4)]
+    start = time.time()
+    results = list(fetcher.fetch_many(tiles))
+    elapsed = time.time() - start
+    assert sorted(tile for tile, _, _ in results) == sorted(tiles)
+    for (_, x, y, zoom), data, error in results:
+        assert error is None and data == tile_png(x, y, zoom)
+    assert elapsed < 16 * 0.2 / 4
+    assert tile_server.max_in_flight > 4
+
+
+def test_per_host_limit_caps_requests_in_flight(tile_server):
+    tile_server.delay = 0.1
+    fetcher = TileFetcher(max_workers=16, per_host=3)
+    try:
+        results = list(fetcher.fetch_many((tile_server.source, x, 0, 5) for x in range(12)))
+    finally:
+        fetcher.close()
+    assert all(error is None for _, _, error in results)
+    assert tile_server.max_in_flight == 3
+
+
+def test_retries_5xx_with_backoff(tile_server, fetcher):
+    tile_server.failures = 2
+    source = tile_server.url + '/flaky/{z}/{x}/{y}.png'
+    start = time.time()
+    assert fetcher.fetch(source, 1, 2, 3) == tile_png(1, 2, 3)
+    # Two retries, waiting at least half of 0.05 and then of 0.1 seconds
+    assert time.time() - start >= 0.075
+    assert tile_server.requests['/flaky/3/1/2.png'] == 3
+
+
+def test_gives_up_after_retries_and_does_not_retry_4xx(tile_server):
+    tile_server.failures = 10
+    fetcher = TileFetcher(retries=2, backoff=0.01)
+    try:
+        with pytest.raises(IOError):
+            fetcher.fetch(tile_server.url + '/flaky/{z}/{x}/{y}.png', 0, 0, 1)
+        assert tile_server.requests['/flaky/1/0/0.png'] == 3
+        with pytest.raises(IOError):
+            fetcher.fetch(tile_server.url + '/missing/{z}/{x}/{y}.png', 0, 0, 1)
+        assert tile_server.requests['/missing/1/0/0.png'] == 1
+    finally:
+        fetcher.close()
+
+
+def test_as_one_image_matches_sequential_stitching(tile_server, fetcher, tmp_path, monkeypatch):
+    monkeypatch.setattr(geoplot, 'tile_cache', TileCache(disk=str(tmp_path / 'tiles.sqlite')))
+    monkeypatch.setattr(geoplot, 'mosaic_cache', MosaicCache())
+    monkeypatch.setattr(geoplot, 'tile_fetcher', fetcher)
+    tile_server.delay = 0.02
+    xmin, xmax, ymin, ymax, zoom = 10, 14, 20, 23, 6
+    mosaic = geoplot.as_one_image(tile_server.source, xmax, xmin, ymax, ymin, zoom)
+    rows = []
+    for y in range(ymin, ymax + 1):
+        row = [np.asarray(Image.open(io.BytesIO(tile_png(x, y, zoom))).convert('RGB'))
+               for x in range(xmin, xmax + 1)]
+        rows.append(np.concatenate(row, axis=1))
+    np.testing.assert_array_equal(mosaic, np.concatenate(rows, axis=0))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from utils.tilecache import DiskTileStore
+from utils.tilefetch import TileFetcher
+from utils.tileprefetch import prefetch, estimate_bytes
+from conftest import tile_png
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = TileFetcher(max_workers=4, per_host=4)
+    yield fetcher
+    fetcher.close()
+
+
+def _tiles(n):
+    return {5: np.array([(x, 0) for x in range(n)])}
+
+
+def test_prefetch_fills_store_and_skips_cached_tiles(tile_server, fetcher, tmp_path):
+    store = DiskTileStore(str(tmp_path / 'tiles.sqlite'), max_bytes=None)
+    stats = prefetch(tile_server.source, _tiles(6), store=store, fetcher=fetcher, pbar=False)
+    assert (stats['fetched'], stats['cached'], stats['failed']) == (6, 0, 0)
+    assert store.get((tile_server.source, 5, 3, 0)) == tile_png(3, 0, 5)
+    stats = prefetch(tile_server.source, _tiles(8), store=store, fetcher=fetcher, pbar=False)
+    assert (stats['fetched'], stats['cached']) == (2, 6)
+    assert sum(tile_server.requests.values()) == 8
+
+
+def test_prefetch_refuses_runs_that_would_evict_their_own_tiles(tile_server, fetcher, tmp_path):
+    size = len(tile_png(0, 0, 5))
+    store = DiskTileStore(str(tmp_path / 'tiles.sqlite'), max_bytes=None)
+    prefetch(tile_server.source, _tiles(2), store=store, fetcher=fetcher, pbar=False)
+    store.max_bytes = 10 * size
+    assert estimate_bytes(_tiles(20), store) == 10 * store.nbytes
+    with pytest.raises(ValueError):
+        prefetch(tile_server.source, _tiles(20), store=store, fetcher=fetcher, pbar=False)
+    assert len(store) == 2 and sum(tile_server.requests.values()) == 2
+    stats = prefetch(tile_server.source, _tiles(20), store=store, fetcher=fetcher, pbar=False, allow_eviction=True)
+    assert stats['fetched'] == 18 and store.evictions > 0
+
+
+def test_prefetch_stops_when_estimate_was_too_low(tile_server, fetcher, tmp_path, monkeypatch):
+    monkeypatch.setattr('utils.tileprefetch.TYPICAL_TILE_BYTES', 1)
+    size = len(tile_png(0, 0, 5))
+    store = DiskTileStore(str(tmp_path / 'tiles.sqlite'), max_bytes=3 * size)
+    with pytest.raises(ValueError):
+        prefetch(tile_server.source, _tiles(10), store=store, fetcher=fetcher, pbar=False)
+    assert store.evictions == 0 and 0 < len(store) <= 3
@@ -1,12 +1,143 @@
 # -*- coding: utf-8 -*-
-import string, itertools, random, os
+import string, itertools, random, os, tempfile, ctypes
+import numpy as np
 _data_name_cands = ('data' + ''.join(random.sample(string.ascii_lowercase, 10)) for _ in itertools.count())
 
+_ALIGNMENT = 64
+_segments = {}
+
 
 def unFork(obj):
     return obj.value if type(obj) is ForkedData else obj
 
 
+class _SharedMemoryBuffer(object):
+    '''
+    A SharedMemory block seen by numpy through __array_interface__, so that
+    it is the .base of every array made from it. numpy does not hold a buffer
+    export on SharedMemory.buf, so closing the block would unmap it under
+    live views; instead the block stays open while any view references this
+    object, and SharedMemory.__del__ closes it after the last one is gone.
+    '''
+    def __init__(self, handle):
+        self.handle = handle
+        first = ctypes.c_char.from_buffer(handle.buf)
+        address = ctypes.addressof(first)
+        del first
+        self.__array_interface__ = {'data': (address, False), 'shape': (len(handle.buf),),
+                                    'typestr': '|u1', 'version': 3}
+
+
+class _Segment(object):
+    '''
+    A block of shared memory (or a memory mapped file) holding the arrays of
+    one ForkedData, reference counted per process. The process that created
+    it unlinks it once its last reference is gone; other processes only unmap.
+    '''
+    def __init__(self, name, backend, layout, owner_pid, nbytes=None):
+        self.name, self.backend, self.layout = name, backend, layout
+        self.pid = os.getpid()
+        self.owner = self.pid == owner_pid
+        self.count = 0
+        if backend == 'shm':
+            from multiprocessing import shared_memory
+            if self.owner:
+                self.handle = shared_memory.SharedMemory(name=name, create=True, size=max(nbytes, 1))
+            else:
+                self.handle = shared_memory.SharedMemory(name=name)
+                _untrack(self.handle)
+            buf = np.asarray(_SharedMemoryBuffer(self.handle))
+        else:
+            mode = 'w+' if self.owner else 'r'
+            self.handle = np.memmap(_mmap_path(name), dtype=np.uint8, mode=mode, shape=(max(nbytes, 1),) if self.owner else None)
+            buf = self.handle
+        self.buffer = buf
+        self._value = None
+
+    def write(self, arrays):
+        for (key, dtype, shape, offset), arr in zip(self.layout, arrays):
+            view = np.ndarray(shape, dtype=dtype, buffer=self.buffer, offset=offset)
+            view[...] = arr
+        if self.backend == 'mmap':
+            self.handle.flush()
+
+    @property
+    def value(self):
+        if self._value is None:
+            views = []
+            for key, dtype, shape, offset in self.layout:
+                view = np.ndarray(shape, dtype=dtype, buffer=self.buffer, offset=offset)
+                view.flags.writeable = False
+                views.append((key, view))
+            self._value = views[0][1] if views and views[0][0] is None else dict(views)
+        return self._value
+
+    def release(self):
+        self.count -= 1
+        if self.count > 0:
+            return
+        del _segments[self.name]
+        self._value = None
+        self.buffer = None
+        if self.backend == 'shm':
+            # Not closed here: views handed out by .value may outlive the
+            # segment, and keep the mapping (see _SharedMemoryBuffer)
+            if self.owner:
+                self.handle.unlink()
+            self.handle = None
+        else:
+            self.handle = None
+            if self.owner:
+                os.remove(_mmap_path(self.name))
+
+
+def _acquire(name, backend, layout, owner_pid):
+    '''Reference the segment called name from this process, attaching to it
+    if needed. Registry entries inherited across a fork are replaced.'''
+    segment = _segments.get(name)
+    if segment is None or segment.pid != os.getpid():
+        segment = _segments[name] = _Segment(name, backend, layout, owner_pid)
+    segment.count += 1
+    return segment
+
+
+def _mmap_path(name):
+    return os.path.join(tempfile.gettempdir(), 'forkeddata-{}.bin'.format(name))
+
+
+def _untrack(shm):
+    # Attaching registers the segment with the resource tracker. Children
+    # started by multiprocessing share their parent's tracker, where the
+    # master's unlink clears it; any other process has a tracker of its own
+    # that would unlink the segment when it exits. Only the owner unlinks.
+    import multiprocessing
+    if multiprocessing.parent_process() is not None:
+        return
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def _layout(val):
+    if isinstance(val, np.ndarray):
+        items = [(None, val)]
+    elif isinstance(val, dict) and all(isinstance(v, np.ndarray) for v in val.values()):
+        items = list(val.items())
+    else:
+        raise TypeError('Shared ForkedData backends hold a numpy array or a dict of numpy arrays')
+    layout, arrays, offset = [], [], 0
+    for key, arr in items:
+        if arr.dtype.hasobject:
+            raise TypeError('Cannot share object arrays: {}'.format(key))
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        layout.append((key, arr.dtype.str, arr.shape, offset))
+        arrays.append(arr)
+        offset += arr.nbytes
+    return layout, arrays, offset
+
+
 class ForkedData(object):
     '''
 
@@ -25,19 +156,67 @@ class ForkedData(object):
         - The Master calls poolmap with data as an argument.
         - Child gets the real value through data.value, and uses it read-only.
 
+    Backends:
+        - 'fork' (default): the value is a module global inherited by forked
+        children, as described above.
+        - 'shm': a numpy array, or dict of numpy arrays, is copied once into
+        multiprocessing.shared_memory. Pickling the ForkedData only sends the
+        segment name and array layout, so it works with spawn/forkserver,
+        with pools created before the data, and with concurrent.futures.
+        Workers reattach by name and get read-only views.
+        - 'mmap': as 'shm', but backed by a file in the temp directory.
+
+        Shared segments are reference counted per process: the master unlinks
+        them when its last ForkedData for them is deleted.
+
     '''
-    def __init__(self, val):
+    backend = 'fork'
+
+    def __init__(self, val, backend='fork'):
         g = globals()
-        self.name = next(n for n in _data_name_cands if n not in g)
-        g[self.name] = val
+        self.name = next(n for n in _data_name_cands if n not in g and n not in _segments)
         self.master_pid = os.getpid()
+        self.backend = backend
+        if backend == 'fork':
+            g[self.name] = val
+        elif backend in ('shm', 'mmap'):
+            self.name = '{}{}'.format(self.name, self.master_pid)
+            self.layout, arrays, nbytes = _layout(val)
+            segment = _Segment(self.name, backend, self.layout, self.master_pid, nbytes)
+            segment.write(arrays)
+            _segments[self.name] = segment
+            segment.count += 1
+            self._counted_pid = os.getpid()
+        else:
+            raise ValueError('Unknown ForkedData backend: {}'.format(backend))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_counted_pid', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.backend != 'fork':
+            _acquire(self.name, self.backend, self.layout, self.master_pid)
+            self._counted_pid = os.getpid()
 
 
     @property
     def value(self):
-        return globals()[self.name]
+        if self.backend == 'fork':
+            return globals()[self.name]
+        if getattr(self, '_counted_pid', None) != os.getpid():
+            # Inherited through a fork rather than pickled: attach from this
+            # process and count this instance as one of its references.
+            _acquire(self.name, self.backend, self.layout, self.master_pid)
+            self._counted_pid = os.getpid()
+        return _segments[self.name].value
 
 
     def __del__(self):
-        if os.getpid() == self.master_pid:
-            del globals()[self.name]
\ No newline at end of file
+        if self.backend == 'fork':
+            if os.getpid() == self.master_pid:
+                del globals()[self.name]
+        elif getattr(self, '_counted_pid', None) == os.getpid():
+            _segments[self.name].release()
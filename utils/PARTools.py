@@ -3,15 +3,62 @@ from __future__ import print_function, absolute_import
 from six import wraps
 from six.moves import map
 from functools import partial
-import multiprocessing
-from contextlib import closing
 from collections import defaultdict
 import concurrent.futures
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from itertools import islice
 from tqdm import tqdm
 from functools import reduce
+import time
+import os
+import heapq
+import tempfile
+import shutil
+import zlib
+import numbers
+import numpy as np
+from six.moves import cPickle as pickle
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
-def gparallel(function, array, n_jobs=16, front_num=3, **kwargs):
+MAX_CHUNKSIZE = 10000
+
+def _apply_chunk(function, chunk, kwargs):
+    # Runs in the worker: apply function to a chunk of elements and time it
+    start = time.perf_counter()
+    out = [function(a, **kwargs) for a in chunk]
+    return out, time.perf_counter() - start
+
+def _auto_chunksize(seconds_per_item, n_items, n_jobs, target=0.1):
+    # Aim for tasks of about `target` seconds, but keep at least 4 chunks per
+    # worker so the load still balances
+    most = max(1, -(-n_items // (4 * n_jobs)))
+    if not seconds_per_item:
+        return most
+    return int(max(1, min(most, MAX_CHUNKSIZE, target / seconds_per_item)))
+
+class _ChunkTuner(object):
+    # Adapts the chunk size of a stream from the per-item time measured in the
+    # workers, so each task takes about `target` seconds
+    def __init__(self, chunksize='auto', target=0.1):
+        self.auto = chunksize == 'auto'
+        self.size = 1 if self.auto else chunksize
+        self.target = target
+        self.seconds_per_item = None
+
+    def update(self, n_items, seconds):
+        if not self.auto or n_items == 0:
+            return
+        per_item = seconds / n_items
+        if self.seconds_per_item is None:
+            self.seconds_per_item = per_item
+        else:
+            self.seconds_per_item = 0.8 * self.seconds_per_item + 0.2 * per_item
+        self.size = int(max(1, min(MAX_CHUNKSIZE, self.target / max(self.seconds_per_item, 1e-9))))
+
+def gparallel(function, array, n_jobs=16, front_num=3, chunksize=1, **kwargs):
     """
         A parallel version of the map function with a progress bar. 
 
@@ -23,40 +70,405 @@ def gparallel(function, array, n_jobs=16, front_num=3, **kwargs):
                 keyword arguments to function 
             front_num (int, default=3): The number of iterations to run serially before kicking off the parallel job. 
                 Useful for catching bugs
+            chunksize (int or 'auto', default=1): The number of elements sent to a worker per task. Larger chunks 
+                cut the per-task IPC overhead for many small tasks. 'auto' picks a size from the time per element 
+                measured on the serial front_num iterations.
         Returns:
             [function(array[0]), function(array[1]), ...]
     """
     #We run the first few iterations serially to catch bugs
+    start = time.perf_counter()
     if front_num > 0:
         front = [function(a, **kwargs) for a in array[:front_num]]
     else:
         front = []
+    seconds_per_item = (time.perf_counter() - start) / len(front) if front else None
     #If we set n_jobs to 1, just run a list comprehension. This is useful for benchmarking and debugging.
     if n_jobs==1:
         return front + [function(a, **kwargs) for a in tqdm(array[front_num:])]
+    rest = array[front_num:]
+    if chunksize == 'auto':
+        chunksize = _auto_chunksize(seconds_per_item, len(rest), n_jobs)
     #Assemble the workers
     with ProcessPoolExecutor(max_workers=n_jobs) as pool:
-        #Pass the elements of array into function
-        futures = [pool.submit(function, a, **kwargs) for a in array[front_num:]]
+        #Pass the elements of array into function, chunksize at a time
+        futures = [pool.submit(_apply_chunk, function, rest[i:i + chunksize], kwargs)
+                   for i in range(0, len(rest), chunksize)]
         tqdm_kwargs = {
-            'total': len(futures),
+            'total': len(rest),
             'unit': 'it',
             'unit_scale': True,
             'leave': True
         }
         #Print out the progress as tasks complete
-        for f in tqdm(as_completed(futures), **tqdm_kwargs):
-            pass
-    #out = []
-    out = [future.result() for future in tqdm(futures)]
+        with tqdm(**tqdm_kwargs) as pbar:
+            for f in as_completed(futures):
+                pbar.update(len(f.result()[0]))
     #Get the results from the futures. 
-    #for i, future in tqdm(enumerate(futures)):
-    #    try:
-    #        out.append(future.result())
-    #    except Exception as e:
-    #        out.append(e)
+    out = [result for future in futures for result in future.result()[0]]
     return front + out
 
+def gparallel_stream(function, iterable, n_jobs=16, chunksize='auto', ordered=True, max_inflight=None, pbar=True, **kwargs):
+    """
+        A streaming version of gparallel. Elements are read lazily from iterable and sent to the workers in chunks, 
+        and results are yielded as they finish, so neither the inputs nor the outputs are all held in memory.
+
+        Args:
+            function (function): A python function to apply to the elements of iterable
+            iterable (iterable): Any iterable, including generators
+            n_jobs (int, default=16): The number of cores to use
+            chunksize (int or 'auto', default='auto'): The number of elements sent to a worker per task. 'auto' 
+                starts at 1 and adapts to the time per element measured in the workers.
+            ordered (boolean, default=True): Yield results in input order. Otherwise they are yielded as soon as 
+                their chunk finishes.
+            max_inflight (int, default=2*n_jobs): The most chunks read but not yet yielded. Bounds memory use.
+            pbar (boolean, default=True): Show a progress bar
+        Returns:
+            A ParallelIterator over function(element) for each element of iterable
+    """
+    return ParallelIterator(function, iterable, n_jobs=n_jobs, chunksize=chunksize, ordered=ordered,
+                            max_inflight=max_inflight, pbar=pbar, **kwargs)
+
+class ParallelIterator(object):
+    """
+        Iterator over function(element) for each element of iterable, computed by a pool of worker processes.
+
+        The pool is started on the first call to next() and stays alive while the iterator is consumed. It is 
+        shut down, cancelling any queued chunks, as soon as the iterator is exhausted, close() is called, or a 
+        with block around it exits. Elements are read from iterable only when there is room for another chunk, 
+        so slow consumers exert backpressure on the input. See gparallel_stream for the arguments.
+    """
+    def __init__(self, function, iterable, n_jobs=16, chunksize='auto', ordered=True, max_inflight=None, pbar=False, **kwargs):
+        self.function = function
+        self.kwargs = kwargs
+        self.n_jobs = n_jobs
+        self.ordered = ordered
+        self.max_inflight = 2 * n_jobs if max_inflight is None else max_inflight
+        self._iterable = iterable
+        self._tuner = _ChunkTuner(chunksize)
+        self._tqdm_kwargs = {
+            'total': len(iterable) if hasattr(iterable, '__len__') else None,
+            'unit': 'it',
+            'unit_scale': True,
+            'leave': True,
+            'disable': not pbar
+        }
+        self._pool = None
+        self._bar = None
+        self._results = self._generate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._results)
+
+    next = __next__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def chunksize(self):
+        """The size of the next chunk to be submitted."""
+        return self._tuner.size
+
+    def close(self):
+        """Stop iterating and shut the worker pool down."""
+        self._results.close()
+        self._shutdown()
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self._bar is not None:
+            self._bar.close()
+            self._bar = None
+
+    def _generate(self):
+        iterator = iter(self._iterable)
+        self._pool = ProcessPoolExecutor(max_workers=self.n_jobs)
+        self._bar = tqdm(**self._tqdm_kwargs)
+        pending = {}
+        finished = {}
+        next_chunk, next_yield, exhausted = 0, 0, False
+        try:
+            while True:
+                #Keep the workers busy, but never hold more than max_inflight chunks
+                while not exhausted and len(pending) + len(finished) < self.max_inflight:
+                    chunk = list(islice(iterator, self._tuner.size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    pending[self._pool.submit(_apply_chunk, self.function, chunk, self.kwargs)] = next_chunk
+                    next_chunk += 1
+                if not pending and not finished:
+                    return
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        idx = pending.pop(future)
+                        results, seconds = future.result()
+                        self._tuner.update(len(results), seconds)
+                        self._bar.update(len(results))
+                        if self.ordered:
+                            finished[idx] = results
+                        else:
+                            for result in results:
+                                yield result
+                while next_yield in finished:
+                    for result in finished.pop(next_yield):
+                        yield result
+                    next_yield += 1
+        finally:
+            self._shutdown()
+
+class Node(object):
+    """
+        Handle on a task of a TaskGraph. Pass it as an argument to later tasks to make them depend on its result.
+    """
+    __slots__ = ('key', 'name')
+
+    def __init__(self, key, name):
+        self.key = key
+        self.name = name
+
+    def __repr__(self):
+        return 'Node({}, {})'.format(self.key, self.name)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and other.key == self.key
+
+class _SharedArray(object):
+    # A task result kept in a memory mapped .npy file (on /dev/shm where available) rather than pickled back
+    # and forth; consumers map it read-only
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, mmap_mode='r'):
+        return np.load(self.path, mmap_mode=mmap_mode)
+
+def _shared_dir():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+def _substitute(obj, replace):
+    # Apply replace to every Node / _SharedArray found in obj, looking inside lists, tuples and dicts
+    if isinstance(obj, (Node, _SharedArray)):
+        return replace(obj)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_substitute(o, replace) for o in obj)
+    if isinstance(obj, dict):
+        return {k: _substitute(v, replace) for k, v in obj.items()}
+    return obj
+
+def _find_nodes(obj):
+    found = []
+    _substitute(obj, lambda node: found.append(node) or node)
+    return found
+
+def _run_node(function, args, kwargs, share_threshold):
+    # Runs in the worker: map shared inputs, call function, and share a large array result
+    args, kwargs = _substitute((args, kwargs), lambda shared: shared.load())
+    start = time.perf_counter()
+    out = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    if (share_threshold is not None and isinstance(out, np.ndarray) and not out.dtype.hasobject
+            and out.nbytes >= share_threshold):
+        fd, path = tempfile.mkstemp(prefix='taskgraph-', suffix='.npy', dir=_shared_dir())
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, out)
+        out = _SharedArray(path)
+    return out, seconds, os.getpid()
+
+class TaskGraph(object):
+    """
+        A lightweight DAG of tasks run on a ProcessPoolExecutor.
+
+        Each task is submitted as soon as the tasks it depends on have finished, so a multi-stage job built per 
+        item (load -> transform -> group -> reduce) flows through without a barrier between stages: the first 
+        items are transformed while later ones still load. Among ready tasks the deepest run first, finishing 
+        items and freeing their intermediates early.
+
+        Large NumPy array results are written once to a memory mapped file (in /dev/shm where available) and 
+        mapped read-only by the tasks that use them, instead of being pickled through the parent. Files are 
+        removed as soon as their last consumer has finished.
+
+        Usage:
+            graph = TaskGraph()
+            loaded = graph.map(load, paths)
+            cleaned = [graph.add(transform, node) for node in loaded]
+            total = graph.add(combine, cleaned)
+            result = graph.run(total, n_jobs=8)
+            print(graph.report())
+    """
+    def __init__(self):
+        self._tasks = {}
+        self._deps = {}
+        self.timings = {}
+
+    def add(self, function, *args, **kwargs):
+        """
+            Add the task function(*args, **kwargs). Any Node among the arguments, also inside lists, tuples and 
+            dicts, is replaced by its result, and the task waits for it.
+
+            Returns:
+                A Node
+        """
+        node = Node(len(self._tasks), getattr(function, '__name__', repr(function)))
+        self._tasks[node] = (function, args, kwargs)
+        self._deps[node] = set(_find_nodes((args, kwargs)))
+        return node
+
+    def map(self, function, iterable, **kwargs):
+        """
+            Add function(element, **kwargs) for each element (value or Node) of iterable.
+
+            Returns:
+                A list of Nodes
+        """
+        return [self.add(function, element, **kwargs) for element in iterable]
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def _depths(self):
+        depth = {}
+        for node in sorted(self._tasks, key=lambda n: n.key):
+            # Dependencies are always added before their dependents
+            depth[node] = 1 + max([depth[d] for d in self._deps[node]] or [-1])
+        return depth
+
+    def run(self, outputs=None, n_jobs=16, max_inflight=None, share_threshold=2**20, pbar=True):
+        """
+            Run the graph.
+
+            Args:
+                outputs (Node or list of Nodes, default=None): The results wanted. None returns those of every task
+                    that no other task depends on.
+                n_jobs (int, default=16): The number of worker processes. 1 runs every task in this process, 
+                    which is useful for debugging.
+                max_inflight (int, default=2*n_jobs): The most tasks submitted at once
+                share_threshold (int, default=1MB): Array results at least this many bytes are shared through 
+                    memory mapped files. None always pickles.
+                pbar (boolean, default=True): Show a progress bar
+            Returns:
+                The result of outputs if it is a Node, a list of results if it is a list, else a dict of Node to
+                result. Per task timings are in .timings and summarised by .report().
+        """
+        if outputs is None:
+            wanted = set(self._tasks) - set(d for deps in self._deps.values() for d in deps)
+        elif isinstance(outputs, Node):
+            wanted = {outputs}
+        else:
+            wanted = set(outputs)
+        consumers = defaultdict(int)
+        for deps in self._deps.values():
+            for d in deps:
+                consumers[d] += 1
+        waiting = {node: len(deps) for node, deps in self._deps.items()}
+        dependents = defaultdict(list)
+        for node, deps in self._deps.items():
+            for d in deps:
+                dependents[d].append(node)
+        depth = self._depths()
+        ready = [(-depth[n], n.key, n) for n, count in waiting.items() if count == 0]
+        heapq.heapify(ready)
+        results = {}
+        self.timings = {}
+        max_inflight = 2 * n_jobs if max_inflight is None else max_inflight
+        pool = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+        pending = {}
+        bar = tqdm(total=len(self._tasks), unit='task', disable=not pbar)
+        start = time.perf_counter()
+
+        def resolve(node):
+            return results[node]
+
+        def finish(node, out, seconds, pid, submitted):
+            results[node] = out
+            self.timings[node] = {'name': node.name, 'seconds': seconds, 'worker': pid,
+                                  'submitted': submitted - start, 'finished': time.perf_counter() - start}
+            bar.update(1)
+            for d in self._deps[node]:
+                consumers[d] -= 1
+                if consumers[d] == 0 and d not in wanted:
+                    _release(results.pop(d))
+            for child in dependents[node]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    heapq.heappush(ready, (-depth[child], child.key, child))
+
+        try:
+            while ready or pending:
+                while ready and len(pending) < max_inflight:
+                    node = heapq.heappop(ready)[2]
+                    function, args, kwargs = self._tasks[node]
+                    args, kwargs = _substitute((args, kwargs), resolve)
+                    submitted = time.perf_counter()
+                    if pool is None:
+                        finish(node, *(_run_node(function, args, kwargs, None) + (submitted,)))
+                    else:
+                        pending[pool.submit(_run_node, function, args, kwargs, share_threshold)] = (node, submitted)
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        node, submitted = pending.pop(future)
+                        try:
+                            out, seconds, pid = future.result()
+                        except Exception as e:
+                            raise RuntimeError('Task {} failed: {!r}'.format(node, e)) from e
+                        finish(node, out, seconds, pid, submitted)
+            output = {node: _materialize(results.pop(node)) for node in wanted}
+        finally:
+            bar.close()
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            for out in results.values():
+                _release(out)
+        if isinstance(outputs, Node):
+            return output[outputs]
+        if outputs is not None:
+            return [output[node] for node in outputs]
+        return output
+
+    def report(self):
+        """
+            Summary of the task timings of the last run, per function: count, total, mean and max seconds.
+        """
+        by_name = defaultdict(list)
+        for t in self.timings.values():
+            by_name[t['name']].append(t['seconds'])
+        wall = max([t['finished'] for t in self.timings.values()] or [0])
+        lines = ['{} tasks in {:.3f}s wall'.format(len(self.timings), wall)]
+        for name, secs in sorted(by_name.items(), key=lambda item: -sum(item[1])):
+            lines.append('  {:<24} n={:<6d} total {:8.3f}s  mean {:8.4f}s  max {:8.4f}s'.format(
+                name, len(secs), sum(secs), sum(secs) / len(secs), max(secs)))
+        return '\n'.join(lines)
+
+def _materialize(out):
+    if isinstance(out, _SharedArray):
+        value = out.load(mmap_mode=None)
+        _release(out)
+        return value
+    return out
+
+def _release(out):
+    if isinstance(out, _SharedArray):
+        try:
+            os.remove(out.path)
+        except OSError:
+            pass
+
 def gmap(function, *iterables, pbar=True, total=None, **kwargs):
     newFunc = partial(function, **kwargs)
     if pbar:
@@ -80,51 +492,397 @@ def gimap(function, *iterables, **kwargs):
     return map(newFunc, *iterables)
 
 
-def giparallel(function, iterable,nThreads=5, chunksize=None, **kwargs):
+def giparallel(function, iterable, nThreads=5, chunksize=None, ordered=True, max_inflight=None, **kwargs):
+    """
+        A lazy parallel version of the imap function.
 
-    newFunc = partial(function, **kwargs)
-    # Figure out what the total size of the iterable is
+        Args:
+            function (function): A python function to apply to the elements of iterable
+            iterable (iterable): Any iterable, including generators. It is read lazily as results are consumed.
+            nThreads (int, default=5): The number of worker processes
+            chunksize (int, default=None): The number of elements sent to a worker per task. None adapts the 
+                chunk size to the measured time per element.
+            ordered (boolean, default=True): Yield results in input order, otherwise as they finish
+            max_inflight (int, default=2*nThreads): The most chunks read but not yet yielded
+        Returns:
+            A ParallelIterator. Its pool lives until it is exhausted or closed; use it in a with block to tear 
+            the pool down deterministically when stopping early.
+    """
+    return ParallelIterator(function, iterable, n_jobs=nThreads, chunksize='auto' if chunksize is None else chunksize,
+                            ordered=ordered, max_inflight=max_inflight, pbar=False, **kwargs)
     
+
+def ggroupBy(data, key, n_jobs=1, chunksize=10000, n_partitions=None, spill_dir=None):
+    """
+        Group the elements of data by key.
+
+        - If data and key are both NumPy arrays, the groups are found with one stable argsort and returned as 
+        contiguous slices of the reordered data (see ArrayGroups); no Python lists are built.
+        - Otherwise, with n_jobs > 1 or a spill_dir, data is read lazily in chunks and each chunk is split by 
+        hash of key into n_partitions in a worker process. Each partition is then merged into groups by one 
+        worker. Without spill_dir the partitions are sent back and the parent ends up holding every group, 
+        as in the serial case; only the partitioning and merging work is spread out.
+        - With spill_dir, partition pieces and merged groups are written to disk instead of being sent back, 
+        and a SpilledGroups mapping that loads one partition at a time is returned. Then no process holds 
+        more than one partition of the keys at a time: out-of-core grouping for inputs larger than memory.
+
+        Args:
+            data (iterable): The elements to group
+            key (function or array-like): A function of an element, or one key per element
+            n_jobs (int, default=1): The number of worker processes
+            chunksize (int, default=10000): The number of elements per partitioning task
+            n_partitions (int, default=4*n_jobs): The number of hash partitions
+            spill_dir (str, default=None): Directory to spill partitions to
+        Returns:
+            An ArrayGroups for array inputs, a SpilledGroups with spill_dir, else a dict of key to the list of 
+            elements with that key, in input order.
+    """
+    if isinstance(data, np.ndarray) and isinstance(key, np.ndarray):
+        return ArrayGroups(key, data)
+    if n_jobs == 1 and spill_dir is None:
+        grouped = defaultdict(list)
+        if hasattr(key, '__len__'):
+            for k,v in zip(key, data):
+                grouped[k].append(v)
+        else:
+            for v in data:
+                grouped[key(v)].append(v)
+        return grouped
+    return _partitioned_group_by(data, key, n_jobs, chunksize, n_partitions or 4 * n_jobs, spill_dir)
+
+class ArrayGroups(Mapping):
+    """
+        Elements of an array grouped by an array of keys, stored as one reordered copy of the array in which 
+        every group is a contiguous slice. Indexing by a key returns a view of that slice.
+
+        Attributes:
+            unique: The distinct keys, sorted (rows of a 2-D key array group together)
+            values: The elements reordered so groups are contiguous, in input order within a group
+            order: The permutation of the input that gives values
+            starts, counts: Where each group starts in values, and its size
+    """
+    def __init__(self, keys, values):
+        keys = np.asarray(keys)
+        values = np.asarray(values)
+        if len(keys) != len(values):
+            raise ValueError('Got {} keys for {} values'.format(len(keys), len(values)))
+        if keys.ndim == 1:
+            self.order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[self.order]
+            self.starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+            self.unique = sorted_keys[self.starts]
+        else:
+            self.unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            self.order = np.argsort(inverse, kind='stable')
+            self.starts = np.r_[0, np.cumsum(np.bincount(inverse, minlength=len(self.unique)))[:-1]].astype(np.int64)
+        self.counts = np.diff(np.r_[self.starts, len(keys)])
+        self.values = np.take(values, self.order, axis=0)
+        self._index = None
+
+    def _position(self, key):
+        if self.unique.ndim == 1:
+            i = np.searchsorted(self.unique, key)
+            if i < len(self.unique) and self.unique[i] == key:
+                return i
+            raise KeyError(key)
+        if self._index is None:
+            self._index = {tuple(row): i for i, row in enumerate(self.unique.tolist())}
+        return self._index[tuple(np.asarray(key).tolist())]
+
+    def __getitem__(self, key):
+        i = self._position(key)
+        return self.values[self.starts[i]:self.starts[i] + self.counts[i]]
+
+    def __iter__(self):
+        if self.unique.ndim == 1:
+            return iter(self.unique.tolist())
+        return (tuple(row) for row in self.unique.tolist())
+
+    def __len__(self):
+        return len(self.unique)
+
+    def slices(self):
+        """A slice of values per group, in the order of unique."""
+        return [slice(s, s + c) for s, c in zip(self.starts.tolist(), self.counts.tolist())]
+
+    def reduce(self, ufunc=np.add):
+        """Reduce every group with a NumPy ufunc at once, e.g. np.add for per-group sums."""
+        if not len(self.unique):
+            return self.values[:0]
+        return ufunc.reduceat(self.values, self.starts, axis=0)
+
+def _partition_of(key, n_partitions):
+    # A partition that is the same in every process. hash() is only used for numbers, whose hashes are not
+    # salted and agree across equal values of different types (1 == 1.0 == True); str hashes are salted per
+    # interpreter and most other objects hash by identity
+    if key is None:
+        return 0
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    if isinstance(key, bytes):
+        return zlib.crc32(key) % n_partitions
+    if isinstance(key, (numbers.Number, np.bool_)):
+        return hash(key) % n_partitions
+    if isinstance(key, tuple):
+        h = len(key)
+        for k in key:
+            h = (h * 1000003 + _partition_of(k, 2**31)) & 0xffffffff
+        return h % n_partitions
+    if isinstance(key, frozenset):
+        # Independent of iteration order, which depends on the salted hashes
+        return sum(_partition_of(k, 2**31) for k in key) % n_partitions
+    raise TypeError('Partitioned ggroupBy needs keys that are None, str, bytes, numbers, or tuples or frozensets '
+                    'of those, so every process puts them in the same partition; got {!r}'.format(type(key)))
+
+def _dump(obj, path):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _partition_chunk(chunk, key, paired, n_partitions, spill_to):
+    # Runs in the worker: split a chunk into per partition groups, spilling them if asked to
+    parts = [defaultdict(list) for _ in range(n_partitions)]
+    for element in chunk:
+        k, v = element if paired else (key(element), element)
+        parts[_partition_of(k, n_partitions)][k].append(v)
+    if spill_to is None:
+        return [dict(part) if part else None for part in parts]
+    paths = []
+    for p, part in enumerate(parts):
+        if part:
+            fd, path = tempfile.mkstemp(prefix='part{}-'.format(p), suffix='.pkl', dir=spill_to)
+            os.close(fd)
+            _dump(dict(part), path)
+            paths.append(path)
+        else:
+            paths.append(None)
+    return paths
+
+def _merge_partition(p, pieces, spill_to):
+    # Runs in the worker: merge the pieces of one partition, in input order
+    grouped = {}
+    for piece in pieces:
+        if spill_to is not None:
+            path, piece = piece, _load(piece)
+            os.remove(path)
+        for k, vs in piece.items():
+            if k in grouped:
+                grouped[k].extend(vs)
+            else:
+                grouped[k] = list(vs)
+    if spill_to is None:
+        return grouped, len(grouped)
+    path = os.path.join(spill_to, 'groups{}.pkl'.format(p))
+    _dump(grouped, path)
+    return path, len(grouped)
+
+def _partitioned_group_by(data, key, n_jobs, chunksize, n_partitions, spill_dir):
+    paired = hasattr(key, '__len__')
+    iterator = iter(zip(key, data)) if paired else iter(data)
+    key = None if paired else key
+    spill_to = None if spill_dir is None else tempfile.mkdtemp(prefix='ggroupBy-', dir=spill_dir)
+    pieces = [[] for _ in range(n_partitions)]
+    pool = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
     try:
-        myTotal = len(iterable)
-    except TypeError:
-        myTotal = None
-    #if hasattr(iterable, '__len__'):
-        
-        
-    # Figure out what the chunksize needs to be
-    if chunksize is None:
-        if myTotal is None:
-            myChunksize=1
+        # Stage 1: partition chunks, keeping their results in input order
+        pending, finished = {}, {}
+        next_chunk, next_collect = 0, 0
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < 2 * n_jobs:
+                chunk = list(islice(iterator, chunksize))
+                if not chunk:
+                    exhausted = True
+                    break
+                args = (chunk, key, paired, n_partitions, spill_to)
+                if pool is None:
+                    finished[next_chunk] = _partition_chunk(*args)
+                else:
+                    pending[pool.submit(_partition_chunk, *args)] = next_chunk
+                next_chunk += 1
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[pending.pop(future)] = future.result()
+            while next_collect in finished:
+                for p, piece in enumerate(finished.pop(next_collect)):
+                    if piece is not None:
+                        pieces[p].append(piece)
+                next_collect += 1
+            if exhausted and not pending:
+                break
+        # Stage 2: merge each partition
+        if pool is None:
+            merged = [_merge_partition(p, pieces[p], spill_to) for p in range(n_partitions)]
         else:
-            myChunksize = myTotal // 10 
-    else:
-        myChunksize = chunksize
-    
-    with closing(multiprocessing.Pool(processes=nThreads, maxtasksperchild=1000)) as pool:
-        output = pool.imap(newFunc, iterable, chunksize=myChunksize)
-        return output
-    #with concurrent.futures.ProcessPoolExecutor(max_workers=nThreads) as executor:
-    #    return executor.map(newFunc, iterable, chunksize=myChunksize)
-    
+            merged = list(pool.map(_merge_partition, range(n_partitions), pieces, [spill_to] * n_partitions))
+    except BaseException:
+        if spill_to is not None:
+            shutil.rmtree(spill_to, ignore_errors=True)
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    if spill_to is not None:
+        return SpilledGroups(spill_to, [path for path, _ in merged], sum(n for _, n in merged))
+    grouped = {}
+    for part, _ in merged:
+        grouped.update(part)
+    return grouped
 
-def ggroupBy(data, key):
-    grouped = defaultdict(list)
-    if hasattr(key, '__len__'):
-        for k,v in zip(key, data):
-            grouped[k].append(v)
-    else:
-        for v in data:
-            grouped[key(v)].append(v)
+class SpilledGroups(Mapping):
+    """
+        The result of an out-of-core ggroupBy: groups stored on disk in hash partitions, of which one at a time 
+        is loaded. Iterating visits the partitions in turn. Call close(), or use a with block, to delete the 
+        files.
+    """
+    def __init__(self, directory, paths, n_groups):
+        self.directory = directory
+        self.paths = paths
+        self._len = n_groups
+        self._loaded = (None, None)
+
+    def _partition(self, p):
+        if self._loaded[0] != p:
+            self._loaded = (p, _load(self.paths[p]))
+        return self._loaded[1]
+
+    def __getitem__(self, key):
+        return self._partition(_partition_of(key, len(self.paths)))[key]
+
+    def __iter__(self):
+        for p in range(len(self.paths)):
+            for k in list(self._partition(p)):
+                yield k
+
+    def items(self):
+        for p in range(len(self.paths)):
+            for item in list(self._partition(p).items()):
+                yield item
+
+    def __len__(self):
+        return self._len
+
+    def close(self):
+        self._loaded = (None, None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-def greduce(iterable, reduceFun, logFun, loggingRate=None):
+def _reduce_chunk(function, chunk):
+    # Runs in the worker: reduce one chunk of the input
+    return reduce(function, chunk), len(chunk) - 1
+
+def _combine(function, a, b):
+    return function(a, b), 1
+
+def greduce(iterable, reduceFun, logFun=None, loggingRate=None, n_jobs=1, chunksize=1000, commutative=False, max_inflight=None):
+    """
+        reduce(reduceFun, iterable), calling logFun(output, count) every loggingRate reductions.
+
+        With n_jobs > 1 reduceFun must be associative. The input is read lazily in chunks of chunksize elements, 
+        each chunk is reduced in a worker process, and the partial results are combined pairwise, also in the 
+        workers, in a tree of log depth. Partials are combined in input order unless commutative is True, in 
+        which case any two finished partials are combined, which keeps the workers busier.
+
+        Args:
+            iterable (iterable): Any iterable, including generators
+            reduceFun (function): A python function of two arguments
+            logFun (function, default=None): Called as logFun(output, count) to report progress. In parallel 
+                mode it is called in this process after each task, with that task's partial result.
+            loggingRate (int, default=len(iterable)/10 or 1000): Reductions between calls to logFun
+            n_jobs (int, default=1): The number of worker processes. 1 reduces serially in this process.
+            chunksize (int, default=1000): The number of elements reduced per task
+            commutative (boolean, default=False): Whether reduceFun(a, b) == reduceFun(b, a)
+            max_inflight (int, default=2*n_jobs): The most tasks submitted at once. Bounds memory use.
+        Returns:
+            The reduced value
+    """
     if loggingRate is None:
         if hasattr(iterable, '__len__'):
             loggingRate = len(iterable)/10
         else:
             loggingRate = 1000
-    wrappedFun = reduction_wrapper(reduceFun, logFun, loggingRate)
-    return reduce(wrappedFun, iterable)
+    if n_jobs == 1:
+        wrappedFun = reduction_wrapper(reduceFun, logFun, loggingRate)
+        return reduce(wrappedFun, iterable)
+    return _tree_reduce(iterable, reduceFun, logFun, loggingRate, n_jobs, chunksize, commutative,
+                        2 * n_jobs if max_inflight is None else max_inflight)
+
+def _tree_reduce(iterable, function, logFun, loggingRate, n_jobs, chunksize, commutative, max_inflight):
+    iterator = iter(iterable)
+    pending = {}
+    # Ordered: partial results keyed by (level, index) in a binary tree over the chunks; two siblings are
+    # combined into their parent. Commutative: any two partials are combined.
+    partials = {}
+    free = []
+    n_leaves, exhausted = 0, False
+    counter = {'count': 0}
+
+    def level_size(level):
+        return -(-n_leaves // 2 ** level)
+
+    def log(output, n):
+        if logFun is not None and loggingRate:
+            before = counter['count'] // loggingRate
+            counter['count'] += n
+            if counter['count'] // loggingRate > before:
+                logFun(output, counter['count'])
+
+    def place(level, idx, value):
+        if commutative:
+            free.append(value)
+            return
+        partials[(level, idx)] = value
+        sibling = idx ^ 1
+        if (level, sibling) in partials:
+            lo = min(idx, sibling)
+            a, b = partials.pop((level, lo)), partials.pop((level, lo + 1))
+            pending[pool.submit(_combine, function, a, b)] = (level + 1, lo // 2)
+        elif exhausted and sibling >= level_size(level) and level_size(level) > 1:
+            # The last node of an odd sized level moves up on its own
+            place(level + 1, idx // 2, partials.pop((level, idx)))
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        try:
+            while True:
+                if commutative:
+                    while len(free) >= 2:
+                        pending[pool.submit(_combine, function, free.pop(), free.pop())] = None
+                while not exhausted and len(pending) < max_inflight:
+                    chunk = list(islice(iterator, chunksize))
+                    if not chunk:
+                        exhausted = True
+                        for level, idx in sorted(partials):
+                            if (level, idx) in partials:
+                                place(level, idx, partials.pop((level, idx)))
+                        break
+                    pending[pool.submit(_reduce_chunk, function, chunk)] = (0, n_leaves)
+                    n_leaves += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position = pending.pop(future)
+                    output, n = future.result()
+                    log(output, n)
+                    place(position[0] if position else 0, position[1] if position else 0, output)
+        finally:
+            for future in pending:
+                future.cancel()
+    remaining = free if commutative else list(partials.values())
+    if n_leaves == 0:
+        raise TypeError('reduce() of empty iterable with no initial value')
+    assert len(remaining) == 1
+    return remaining[0]
 
 def reduction_wrapper(function, logFun, loggingRate):
     counter = {'count': 0}
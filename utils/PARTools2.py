@@ -118,7 +118,8 @@ def ggroupBy(data, key, pbar=False):
         newData = config['pbarFun'](data)
     else:
         newData = data
-    junk = map(lambda x: grouped[key(x)].append(x), newData)
+    for x in newData:
+        grouped[key(x)].append(x)
     return grouped
 
     
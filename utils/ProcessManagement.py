@@ -3,15 +3,27 @@ import psutil
 import itertools
 import logging
 import random
+import json
+import glob
+import inspect
+import threading
+from collections import deque
+import dask
 from distributed import Worker
+from dask.utils import parse_bytes
 import sys
 import time
 from tornado.ioloop import IOLoop
 from tornado import gen
-from multiprocessing import Process
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import Process, Queue
+from six.moves.queue import Empty
 
 LOG_FORMAT = "%(levelname)-5s %(asctime)s %(filename)-20s %(funcName)-25s %(lineno)-5d: %(message)s"
 
+logger = logging.getLogger(__name__)
+
 
 def generate_worker_names(total=None):
 	iterator = itertools.count() if total is None else range(total)
@@ -19,42 +31,321 @@ def generate_worker_names(total=None):
 		yield "worker-{}".format(idx)
 
 
-def spawn_worker(name, scheduler, memory_limit, local_dir="./tmp/", ncores=1, logfile=None, memory_pause_fraction=0.95, **kwargs):
-	memory_pause_fraction = float(memory_pause_fraction)
+class MemoryPolicy(object):
+	"""
+	Graded response of a worker to its memory use, as fractions of its
+	memory_limit (False turns a level off), from mildest to harshest:
+		- target: dask starts moving the least recently used task results to
+		disk, so they are kept rather than recomputed.
+		- spill: dask spills based on the process RSS, which includes memory
+		that is not task results.
+		- pause: the worker stops starting new tasks until memory drops.
+		- terminate: the worker is closed (and replaced by a Supervisor).
+
+	Spilled results go to the worker's local_dir. They are pickled with
+	protocol 5 and out of band buffers by dask, and compressed with
+	compression ('auto' uses lz4 when it is installed, False disables it).
+
+	Every metrics_interval seconds the worker reports its RSS and how much is
+	held in memory and spilled to disk; see spawn_worker and
+	Supervisor.memory.
+	"""
+	LEVELS = ('target', 'spill', 'pause', 'terminate')
+
+	def __init__(self, target=0.6, spill=0.7, pause=0.8, terminate=0.95, compression='auto', metrics_interval=10.0):
+		self.target = target
+		self.spill = spill
+		self.pause = pause
+		self.terminate = terminate
+		self.compression = compression
+		self.metrics_interval = metrics_interval
+		# Levels turned off are left out of the checks
+		fractions = [getattr(self, level) for level in self.LEVELS if getattr(self, level) is not False]
+		if any(not 0 < f for f in fractions) or fractions != sorted(fractions):
+			raise ValueError('Need 0 < target <= spill <= pause <= terminate, got {}'.format(fractions))
+
+	@classmethod
+	def from_pause_fraction(cls, memory_pause_fraction):
+		# The policy for callers that only give the old memory_pause_fraction,
+		# past which the worker was killed: the default levels, scaled down to
+		# stay below it when it is under the default terminate of 0.95
+		terminate = float(memory_pause_fraction)
+		scale = min(1.0, terminate / 0.95)
+		return cls(target=0.6 * scale, spill=0.7 * scale, pause=0.8 * scale, terminate=terminate)
+
+	def __repr__(self):
+		return 'MemoryPolicy({})'.format(', '.join('{}={}'.format(level, getattr(self, level)) for level in self.LEVELS))
+
+	def worker_kwargs(self):
+		return {'memory_target_fraction': self.target,
+				'memory_spill_fraction': self.spill,
+				'memory_pause_fraction': self.pause}
+
+	def dask_config(self):
+		# The fractions are also set here, as recent distributed versions only
+		# read them from the config; terminating is left to spawn_worker
+		return {'distributed.worker.memory.target': self.target,
+				'distributed.worker.memory.spill': self.spill,
+				'distributed.worker.memory.pause': self.pause,
+				'distributed.worker.memory.terminate': False,
+				'distributed.worker.memory.spill-compression': self.compression}
+
+	def level(self, fraction):
+		# The harshest threshold that fraction is over, or None
+		crossed = [level for level in self.LEVELS if getattr(self, level) is not False and fraction > getattr(self, level)]
+		return crossed[-1] if crossed else None
+
+
+def _cpu_list(text):
+	# Parse a kernel cpulist such as "0-3,8-11"
+	cpus = []
+	for part in text.strip().split(','):
+		if '-' in part:
+			lo, hi = part.split('-')
+			cpus.extend(range(int(lo), int(hi) + 1))
+		elif part:
+			cpus.append(int(part))
+	return cpus
+
+
+def _numa_nodes():
+	nodes = []
+	for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+		with open(path) as f:
+			nodes.append(_cpu_list(f.read()))
+	return nodes
+
+
+def _get_affinity():
+	if hasattr(os, 'sched_getaffinity'):
+		return sorted(os.sched_getaffinity(0))
+	return sorted(psutil.Process().cpu_affinity())
+
+
+def _set_affinity(cpus):
+	if hasattr(os, 'sched_setaffinity'):
+		os.sched_setaffinity(0, cpus)
+	else:
+		psutil.Process().cpu_affinity(list(cpus))
+
+
+_environ_lock = threading.Lock()
+
+
+@contextmanager
+def _environ(env):
+	# Temporarily set environment variables, e.g. around starting a process
+	with _environ_lock:
+		old = {key: os.environ.get(key) for key in env}
+		os.environ.update(env)
+		try:
+			yield
+		finally:
+			for key, value in old.items():
+				if value is None:
+					del os.environ[key]
+				else:
+					os.environ[key] = value
+
+
+class Placement(object):
+	"""
+	Where workers run and how many threads their native libraries may use.
+
+		- threads: the thread budget of each worker. It is written to every
+		BLAS / OpenMP / numexpr thread count variable (THREAD_VARS) in the
+		environment the worker starts with, so it is in place before NumPy
+		is imported, and applied again with threadpoolctl if installed.
+		- cpus_per_worker: size of the CPU affinity set of each worker, or
+		None to leave workers unpinned. Sets are cut from cpus (by default
+		every CPU this process may use) without straddling NUMA nodes,
+		alternate between nodes, and each new worker gets the least used set.
+		- start_method: 'spawn' starts workers in a fresh interpreter. With
+		'fork' they inherit the libraries this process has already loaded,
+		whose thread pools only threadpoolctl can still shrink.
+
+	Workers report the placement they actually got (affinity, environment
+	and thread pools); see Supervisor.placement_report.
+	"""
+	THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+				   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS', 'NUMEXPR_MAX_THREADS', 'NUMBA_NUM_THREADS')
+
+	def __init__(self, threads=1, cpus_per_worker=None, cpus=None, start_method='spawn'):
+		self.threads = int(threads)
+		self.cpus_per_worker = cpus_per_worker
+		self.cpus = sorted(cpus) if cpus is not None else _get_affinity()
+		self.start_method = start_method
+		self.blocks = self._blocks() if cpus_per_worker else []
+
+	def __repr__(self):
+		return 'Placement(threads={}, cpus_per_worker={}, blocks={})'.format(self.threads, self.cpus_per_worker, self.blocks)
+
+	def _blocks(self):
+		allowed = set(self.cpus)
+		nodes = [[c for c in node if c in allowed] for node in _numa_nodes()]
+		nodes = [node for node in nodes if node] or [self.cpus]
+		per_node = []
+		for node in nodes:
+			k = min(self.cpus_per_worker, len(node))
+			per_node.append([tuple(node[i:i + k]) for i in range(0, len(node) - k + 1, k)])
+		# Alternate nodes so consecutive workers spread over memory controllers
+		return [block for group in itertools.zip_longest(*per_node) for block in group if block is not None]
+
+	def env(self):
+		return {var: str(self.threads) for var in self.THREAD_VARS}
+
+	def next_cpus(self, in_use=()):
+		"""The affinity set for a new worker, given those of the live ones, or None."""
+		if not self.blocks:
+			return None
+		in_use = [tuple(cpus) for cpus in in_use if cpus is not None]
+		return min(self.blocks, key=in_use.count)
+
+	def apply(self, cpus=None):
+		"""Pin and budget the calling process. Returns the effective placement."""
+		os.environ.update(self.env())
+		if cpus is not None:
+			_set_affinity(cpus)
+		try:
+			from threadpoolctl import threadpool_limits, threadpool_info
+			threadpool_limits(self.threads)
+			pools = [{'api': pool['internal_api'], 'threads': pool['num_threads']} for pool in threadpool_info()]
+		except ImportError:
+			pools = None
+		return {'cpus': _get_affinity(), 'threads': self.threads, 'thread_pools': pools,
+				'env': {var: os.environ.get(var) for var in self.THREAD_VARS}}
+
+
+def _launch(target, name, args, kwargs, placement=None, in_use=()):
+	# Start one worker process. With a placement, it gets the next CPU set and
+	# starts with the thread budget already in its environment.
+	if placement is None:
+		proc = Process(target=target, args=args, kwargs=kwargs, name=name)
+		proc.daemon = True
+		proc.start()
+		return proc, None
+	cpus = placement.next_cpus(in_use)
+	proc = multiprocessing.get_context(placement.start_method).Process(
+		target=target, args=args, kwargs=dict(kwargs, placement=placement, cpus=cpus), name=name)
+	proc.daemon = True
+	with _environ(placement.env()):
+		proc.start()
+	return proc, cpus
+
+
+def _dir_size(path):
+	total = 0
+	for root, _, files in os.walk(path):
+		for f in files:
+			try:
+				total += os.path.getsize(os.path.join(root, f))
+			except OSError:
+				pass
+	return total
+
+
+def _memory_metrics(worker, proc, memory_limit, local_dir):
+	# Works with both the zict.Buffer and the newer SpillBuffer dask uses for worker.data
+	rss = proc.memory_info().rss
+	data = worker.data
+	fast = getattr(data, 'fast', data)
+	slow = getattr(data, 'slow', None)
+	spilled = getattr(data, 'spilled_total', None)
+	return {'rss': rss,
+			'fraction': rss / memory_limit if memory_limit > 0 else 0,
+			'memory_keys': len(fast),
+			'memory_bytes': getattr(fast, 'total_weight', None),
+			'spilled_keys': len(slow) if slow is not None else 0,
+			'spilled_bytes': spilled.disk if spilled is not None else _dir_size(local_dir),
+			'status': str(getattr(worker.status, 'name', worker.status))}
+
+
+def _worker_options(ncores, local_dir, kwargs):
+	# Worker keywords were renamed across distributed versions (ncores ->
+	# nthreads, local_dir -> local_directory). Pass whichever this one takes;
+	# memory fractions it does not take are set through MemoryPolicy.dask_config.
+	params = inspect.signature(Worker.__init__).parameters
+	options = {'nthreads' if 'nthreads' in params else 'ncores': ncores,
+			   'local_directory' if 'local_directory' in params else 'local_dir': local_dir}
+	memory = MemoryPolicy().worker_kwargs()
+	options.update((key, value) for key, value in kwargs.items() if key in params or key not in memory)
+	return options
+
+
+def _closed(worker):
+	# Worker.status is a string in old distributed versions, a Status enum in new ones
+	status = getattr(worker.status, 'name', worker.status)
+	return status in ('closing', 'closed', 'failed')
+
+
+def spawn_worker(name, scheduler, memory_limit, local_dir="./tmp/", ncores=1, logfile=None, memory_pause_fraction=0.95, events=None, memory_policy=None, placement=None, cpus=None, monitored=False, **kwargs):
+	# events: optional multiprocessing.Queue the worker reports 'ready',
+	# 'memory_level', 'memory_killed' and periodic 'memory' metrics to, e.g.
+	# for a Supervisor.
+	# monitored: whether something keeps draining events after the worker is
+	# ready (a Supervisor does). If not, nothing is sent after 'ready': an
+	# unread queue would fill up, and a worker blocks on exit until what it
+	# put on the queue has been read.
+	# memory_policy: a MemoryPolicy, by default the standard one closing the
+	# worker past memory_pause_fraction.
+	# placement, cpus: a Placement and the CPU set it picked for this worker.
+	if memory_policy is None:
+		memory_policy = MemoryPolicy.from_pause_fraction(memory_pause_fraction)
 	proc = psutil.Process(os.getpid())
 
+	def report(event, **details):
+		if events is not None and (monitored or event in ('placement', 'ready')):
+			details.update(event=event, worker=name, pid=os.getpid(), time=time.time())
+			events.put(details)
+
 	if logfile is not None:
 		log = open(logfile, 'a')
 		sys.stdout = log
 		sys.stderr = log
 
-	os.environ['MKL_NUM_THREADS'] = '1'
+	if placement is not None:
+		report('placement', **placement.apply(cpus))
+	else:
+		os.environ['MKL_NUM_THREADS'] = '1'
 
 	loop = IOLoop.current()
 
+	dask.config.set(memory_policy.dask_config())
+
 	n = Worker('tcp://{}'.format(scheduler), silence_logs=logging.WARN, 
-											 ncores=ncores, 
 											 memory_limit=memory_limit, 
 											 name=name, 
-											 local_dir=local_dir, 
-											 memory_spill_fraction=1.0,
-											 memory_target_fraction=1.0,
-											 memory_pause_fraction=1.0,
-											 **kwargs)
+											 **_worker_options(ncores, local_dir, dict(memory_policy.worker_kwargs(), **kwargs)))
 
-	memory_limit = n.memory_limit
+	memory_limit = getattr(n, 'memory_manager', n).memory_limit or 0
 
 	@gen.coroutine
 	def monitor_worker():
 		yield n.start()
-		while n.status != 'closed':
+		report('ready', address=n.address)
+		if events is not None and not monitored:
+			events.cancel_join_thread()
+		level, last_metrics = None, 0
+		while not _closed(n):
 			memory = proc.memory_info().rss
 			frac = memory / memory_limit if memory_limit > 0 else 0
-			if frac > memory_pause_fraction:
-				print('Worker Exceeded Memory Limit: {}/{}'.format(frac, memory_pause_fraction))
+			new_level = memory_policy.level(frac)
+			if new_level != level:
+				# Spilling and pausing are done by dask itself; only report them
+				report('memory_level', level=new_level, previous=level, rss=memory, fraction=frac)
+				level = new_level
+			if level == 'terminate':
+				print('Worker Exceeded Memory Limit: {}/{}'.format(frac, memory_policy.terminate))
+				report('memory_killed', rss=memory, fraction=frac)
 				n.stop()
-				yield n._close(report=False, nanny=False, executor_wait=True, timeout=2)
+				if hasattr(n, '_close'):
+					yield n._close(report=False, nanny=False, executor_wait=True, timeout=2)
+				else:
+					yield n.close(nanny=False, executor_wait=True, timeout=2)
 				raise gen.Return()
+			if time.time() - last_metrics >= memory_policy.metrics_interval:
+				last_metrics = time.time()
+				report('memory', **_memory_metrics(n, proc, memory_limit, local_dir))
 			yield gen.sleep(2)
 
 	try:
@@ -67,17 +358,289 @@ def spawn_worker(name, scheduler, memory_limit, local_dir="./tmp/", ncores=1, lo
 	return True
 
 	
-def start(n_workers=8, localhost='127.0.0.1:8786', memory_limit='4GB'):
-	worker_names = (name for name in generate_worker_names())
-	proc_gen = (Process(target=spawn_worker, args=(name, localhost, memory_limit)) for name in worker_names)
-	procs = [next(proc_gen) for idx in range(n_workers)]
+def start(n_workers=8, localhost='127.0.0.1:8786', memory_limit='4GB', timeout=60, placement=None):
+	# Returns once every worker has registered with the scheduler (or died),
+	# rather than after a fixed sleep. placement: optional Placement, whose
+	# effective result is logged per worker. Workers that are not ready within
+	# timeout are logged as warnings.
+	events = Queue() if placement is None else multiprocessing.get_context(placement.start_method).Queue()
+	procs, in_use = [], []
+	for name in generate_worker_names(n_workers):
+		proc, cpus = _launch(spawn_worker, name, (name, localhost, memory_limit), {'events': events}, placement, in_use)
+		procs.append(proc)
+		in_use.append(cpus)
+
+	def log_placement(event):
+		if event['event'] == 'placement':
+			logger.info('%s', event)
+	ready = _wait_ready(procs, events, timeout, log_placement)
 	for proc in procs:
-		proc.daemon = True
-	[proc.start() for proc in procs]
-	time.sleep(10)
+		if proc.name not in ready:
+			logger.warning('Worker %s (pid %s) did not become ready within %ss%s', proc.name, proc.pid, timeout,
+						   '' if proc.is_alive() else ', exit code {}'.format(proc.exitcode))
 	return procs
 
 
+def _wait_ready(procs, events, timeout, on_event=None):
+	# Wait for a 'ready' event from each process, or for it to exit. Returns
+	# the names of the processes that became ready.
+	waiting = {proc.name: proc for proc in procs}
+	ready = set()
+	deadline = time.time() + timeout
+	while waiting and time.time() < deadline:
+		try:
+			event = events.get(timeout=0.1)
+		except Empty:
+			event = None
+		if event is not None:
+			if on_event is not None:
+				on_event(event)
+			if event['event'] == 'ready' and event['worker'] in waiting:
+				ready.add(event['worker'])
+				del waiting[event['worker']]
+		for name, proc in list(waiting.items()):
+			if not proc.is_alive():
+				del waiting[name]
+	return ready
+
+
 def stop(procs):
 	for proc in procs:
-		proc.terminate()	
\ No newline at end of file
+		proc.terminate()
+
+
+class Supervisor(object):
+	"""
+	Keeps a pool of dask worker processes (see spawn_worker) alive and sized
+	to the host.
+
+	- Workers that die, or kill themselves for exceeding their memory
+	limit, are replaced.
+	- Every scale_interval seconds the pool grows by one worker while host
+	memory use is below low_memory, CPU use below high_cpu and a whole
+	memory_limit is still available; it shrinks by one (newest first) while
+	memory use is above high_memory. It stays within [min_workers,
+	max_workers], which default to n_workers, i.e. a fixed size.
+	- New workers count as started once they have registered with the
+	scheduler, not after a fixed sleep.
+	- Workers respond to memory use as set by a MemoryPolicy passed as
+	memory_policy, and their memory and spill metrics are collected in
+	.memory (see memory_metrics()).
+	- With a Placement, workers are pinned to CPU sets and started with a
+	thread budget (see placement_report()).
+	- Everything else that happens is appended to .events as a dict with at least
+	'time' and 'event' keys, logged, and written as JSON lines to
+	event_log if given.
+
+	Usage:
+		supervisor = Supervisor(n_workers=4, max_workers=16).start()
+		...
+		supervisor.stop()
+	"""
+	def __init__(self, n_workers=8, scheduler='127.0.0.1:8786', memory_limit='4GB', min_workers=None, max_workers=None,
+				 high_memory=0.85, low_memory=0.6, high_cpu=0.9, poll_interval=1.0, scale_interval=10.0,
+				 ready_timeout=60.0, event_log=None, max_events=10000, placement=None, target=spawn_worker, **worker_kwargs):
+		self.n_workers = n_workers
+		self.scheduler = scheduler
+		self.memory_limit = memory_limit
+		self.min_workers = n_workers if min_workers is None else min_workers
+		self.max_workers = n_workers if max_workers is None else max_workers
+		self.high_memory = high_memory
+		self.low_memory = low_memory
+		self.high_cpu = high_cpu
+		self.poll_interval = poll_interval
+		self.scale_interval = scale_interval
+		self.ready_timeout = ready_timeout
+		self.event_log = event_log
+		self.placement = placement
+		self.target = target
+		self.worker_kwargs = worker_kwargs
+		self.events = deque(maxlen=max_events)
+		self.workers = {}
+		self.memory = {}
+		self.placements = {}
+		self._cpus = {}
+		self._names = generate_worker_names()
+		self._queue = Queue() if placement is None else multiprocessing.get_context(placement.start_method).Queue()
+		self._lock = threading.RLock()
+		self._thread = None
+		self._stopping = threading.Event()
+		self._last_scale = 0.0
+		self._memory_killed = set()
+		self._ready = set()
+
+	def _log(self, event, **details):
+		details.setdefault('time', time.time())
+		details['event'] = event
+		self.events.append(details)
+		logger.info('%s', details)
+		if self.event_log is not None:
+			with open(self.event_log, 'a') as f:
+				f.write(json.dumps(details, default=str) + '\n')
+
+	def _on_worker_event(self, event):
+		if event['event'] == 'memory':
+			# Periodic metrics are kept, not logged
+			self.memory[event['worker']] = event
+			return
+		if event['event'] == 'ready':
+			self._ready.add(event['worker'])
+		elif event['event'] == 'memory_killed':
+			self._memory_killed.add(event['worker'])
+		elif event['event'] == 'placement':
+			self.placements[event['worker']] = event
+		details = dict(event)
+		self._log(details.pop('event'), **details)
+
+	def _drain(self):
+		while True:
+			try:
+				event = self._queue.get_nowait()
+			except Empty:
+				return
+			self._on_worker_event(event)
+
+	def _spawn(self, count, reason):
+		# Launch workers and add them to the table, under the lock. Callers
+		# wait for them with _await_ready once the lock is released.
+		procs = []
+		for _ in range(count):
+			name = next(self._names)
+			proc, cpus = _launch(self.target, name, (name, self.scheduler, self.memory_limit),
+								 dict(self.worker_kwargs, events=self._queue, monitored=True), self.placement, self._cpus.values())
+			self.workers[name] = proc
+			self._cpus[name] = cpus
+			procs.append(proc)
+			self._log('spawned', worker=name, pid=proc.pid, reason=reason, cpus=cpus)
+		return procs
+
+	def _await_ready(self, procs):
+		# Wait, without holding the lock, for each process to report ready or
+		# exit. Events are drained in short locked steps; 'ready' events are
+		# recorded by whichever thread drains them (e.g. memory_metrics).
+		deadline = time.time() + self.ready_timeout
+		waiting = list(procs)
+		while waiting:
+			with self._lock:
+				self._drain()
+				waiting = [proc for proc in waiting if proc.name not in self._ready and proc.is_alive()]
+			if not waiting or time.time() >= deadline:
+				break
+			time.sleep(0.1)
+		with self._lock:
+			for proc in waiting:
+				self._log('not_ready', worker=proc.name, pid=proc.pid, timeout=self.ready_timeout)
+			self._ready.difference_update(proc.name for proc in procs)
+
+	def _retire(self, name, reason):
+		proc = self.workers.pop(name)
+		self.memory.pop(name, None)
+		self.placements.pop(name, None)
+		self._cpus.pop(name, None)
+		self._ready.discard(name)
+		proc.terminate()
+		proc.join(5)
+		self._log('retired', worker=name, pid=proc.pid, reason=reason)
+
+	def start(self):
+		"""Spawn n_workers, wait until they are ready and supervise them from a background thread."""
+		# The first cpu_percent(interval=None) call has nothing to compare with and returns 0.0
+		psutil.cpu_percent(interval=None)
+		with self._lock:
+			self._stopping.clear()
+			procs = self._spawn(self.n_workers, 'start')
+		self._await_ready(procs)
+		self._last_scale = time.time()
+		self._thread = threading.Thread(target=self._run, name='Supervisor')
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def _run(self):
+		while not self._stopping.wait(self.poll_interval):
+			try:
+				self.poll()
+			except Exception as e:
+				self._log('error', error=repr(e))
+
+	def poll(self):
+		"""One supervision round: collect worker events, replace dead workers and autoscale."""
+		spawned = []
+		with self._lock:
+			if self._stopping.is_set():
+				return
+			self._drain()
+			dead = [name for name, proc in self.workers.items() if not proc.is_alive()]
+			for name in dead:
+				proc = self.workers.pop(name)
+				reason = 'memory_killed' if name in self._memory_killed else 'died'
+				self._memory_killed.discard(name)
+				self.memory.pop(name, None)
+				self.placements.pop(name, None)
+				self._cpus.pop(name, None)
+				self._ready.discard(name)
+				self._log('exited', worker=name, pid=proc.pid, exitcode=proc.exitcode, reason=reason)
+			if dead:
+				spawned += self._spawn(len(dead), 'replace')
+			if time.time() - self._last_scale >= self.scale_interval:
+				self._last_scale = time.time()
+				spawned += self._autoscale()
+		self._await_ready(spawned)
+
+	def _autoscale(self):
+		# Returns the workers spawned, if any
+		memory = psutil.virtual_memory()
+		used = memory.percent / 100.0
+		cpu = psutil.cpu_percent(interval=None) / 100.0
+		n = len(self.workers)
+		if n < self.min_workers:
+			return self._spawn(self.min_workers - n, 'min_workers')
+		elif used > self.high_memory and n > self.min_workers:
+			newest = list(self.workers)[-1]
+			self._log('scale_down', workers=n - 1, memory=used, cpu=cpu)
+			self._retire(newest, 'memory_pressure')
+			return []
+		elif (n < self.max_workers and used < self.low_memory and cpu < self.high_cpu
+			  and memory.available >= parse_bytes(self.memory_limit)):
+			self._log('scale_up', workers=n + 1, memory=used, cpu=cpu)
+			return self._spawn(1, 'headroom')
+		return []
+
+	def stop(self):
+		"""Stop supervising and terminate every worker."""
+		self._stopping.set()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		with self._lock:
+			for name in list(self.workers):
+				self._retire(name, 'stop')
+			self._drain()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc_info):
+		self.stop()
+
+	def memory_metrics(self):
+		"""The latest memory and spill metrics reported by each live worker (see MemoryPolicy)."""
+		with self._lock:
+			self._drain()
+			return {name: self.memory[name] for name in self.workers if name in self.memory}
+
+	def placement_report(self):
+		"""The effective placement each live worker reported: its CPUs, thread budget, env and thread pools."""
+		with self._lock:
+			self._drain()
+			return {name: self.placements[name] for name in self.workers if name in self.placements}
+
+	@property
+	def procs(self):
+		"""The live worker processes, as returned by start()."""
+		return list(self.workers.values())
+
+
+def supervise(n_workers=8, localhost='127.0.0.1:8786', memory_limit='4GB', **kwargs):
+	"""Start a Supervisor; see its docstring for the scaling and logging options."""
+	return Supervisor(n_workers, localhost, memory_limit, **kwargs).start()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+batchrender
+~~~~~~~~~~~
+
+Headless rendering of many map thumbnails, e.g. one per trajectory.
+
+:func:`geoplot.plotMap` draws into the current pyplot figure and wires up
+interactive callbacks, which is what a notebook wants but makes it slow for
+thousands of images.  A :class:`BatchRenderer` instead draws with the Agg
+canvas directly (no pyplot, no GUI backend) onto one figure per process,
+which is reused for every image: the background image and the trace lines
+are updated in place rather than re-created.
+
+Work is spread over processes with :func:`PARTools.gparallel_stream`.  The
+tiles come from :data:`geoplot.tile_cache`, whose disk tier is shared by all
+the workers, so each tile is downloaded once per batch at most (see also
+:mod:`tileprefetch`).  Time spent in each stage (`fetch`, `stitch`, `draw`,
+`encode`) is measured in the workers and summed in :attr:`BatchRenderer.timings`.
+"""
+from __future__ import print_function, absolute_import
+import io as _io
+import os
+import time
+import numpy as np
+import PIL.Image as _Image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from . import geoplot
+from .mapping import Extent, to_web_mercator_np, optimal_zoom, _as_traces
+from .PARTools import gparallel_stream
+
+STAGES = ('fetch', 'stitch', 'draw', 'encode')
+
+# Renderers with a live figure, one per configuration in each process
+_renderers = {}
+
+
+def _fit_aspect(extent, aspect):
+    """Grow `extent` (in the unit square) about its centre to the given
+    width / height ratio, so nothing requested is cropped."""
+    xmin, xmax, ymin, ymax = extent.xmin, extent.xmax, extent.ymin, extent.ymax
+    width, height = xmax - xmin, ymax - ymin
+    if width < height * aspect:
+        pad = (height * aspect - width) / 2
+        xmin, xmax = xmin - pad, xmax + pad
+    else:
+        pad = (width / aspect - height) / 2
+        ymin, ymax = max(ymin - pad, 0.0), min(ymax + pad, 1.0)
+    return Extent(xmin, xmax, ymin, ymax)
+
+
+def _traces(overlays):
+    """Normalise overlays to a list of `(longitudes, latitudes, style)`."""
+    if overlays is None:
+        return []
+    if isinstance(overlays, np.ndarray) and overlays.ndim == 2 and overlays.shape[1] == 2:
+        overlays = [overlays]
+    traces = []
+    for trace in overlays:
+        if isinstance(trace, np.ndarray) and trace.ndim == 2:
+            traces.append((trace[:, 0], trace[:, 1], {}))
+        elif len(trace) == 3:
+            traces.append(tuple(trace))
+        else:
+            traces.append((trace[0], trace[1], {}))
+    return traces
+
+
+class BatchRenderer(object):
+    """Render `(extent, overlays)` jobs to PNG images.
+
+    :param tile_source: Tile URL template, as for :func:`geoplot.plotMap`.
+    :param size: `(width, height)` of the images in pixels.
+    :param dpi: Resolution of the figure; only matters for line widths.
+    :param zoom: Tile zoom level, or `None` to pick one per image with
+      :func:`mapping.optimal_zoom`.
+    :param max_pixels: Pixel budget of a mosaic, see
+      :func:`geoplot.as_one_image`.  Over budget mosaics are downsampled.
+    :param line_style: Default keyword arguments of the trace lines, which
+      a trace can override with a style dict of its own.
+    :param compress_level: zlib level of the PNGs; low levels encode much
+      faster for slightly larger files.
+    """
+    def __init__(self, tile_source, size=(256, 256), dpi=100, zoom=None, max_pixels=None,
+                 line_style=None, compress_level=1):
+        self.tile_source = tile_source
+        self.size = tuple(size)
+        self.dpi = dpi
+        self.zoom = zoom
+        self.max_pixels = max_pixels
+        self.line_style = dict({'color': 'r', 'linewidth': 1.5}, **(line_style or {}))
+        self.compress_level = compress_level
+        self.timings = dict.fromkeys(STAGES, 0.0)
+        self.count = 0
+        self._figure = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_figure'] = None
+        return state
+
+    def _key(self):
+        return (self.tile_source, self.size, self.dpi, self.zoom, self.max_pixels,
+                tuple(sorted(self.line_style.items())), self.compress_level)
+
+    def _setup(self):
+        if self._figure is not None:
+            return
+        width, height = self.size
+        self._figure = Figure(figsize=(width / float(self.dpi), height / float(self.dpi)), dpi=self.dpi)
+        self._canvas = FigureCanvasAgg(self._figure)
+        self._axes = self._figure.add_axes([0, 0, 1, 1])
+        self._axes.set_axis_off()
+        self._image = self._axes.imshow(np.zeros((1, 1, 3), dtype=np.uint8), interpolation='lanczos', aspect='auto')
+        self._lines = []
+
+    def _update_lines(self, extent, traces):
+        # Six points per pixel column of each run keeps every excursion
+        budget = 6 * self.size[0]
+        for i, (longitudes, latitudes, style) in enumerate(traces):
+            longitudes, latitudes = _as_traces(longitudes, latitudes)[0]
+            if len(longitudes) > budget:
+                keep = geoplot.decimate(longitudes, latitudes, budget)
+                longitudes, latitudes = longitudes[keep], latitudes[keep]
+            x, y = to_web_mercator_np(longitudes, latitudes)
+            x, y = extent.project(x, y)
+            if i == len(self._lines):
+                self._lines.append(self._axes.plot([], [])[0])
+            line = self._lines[i]
+            line.set_data(x, y)
+            line.update(dict(self.line_style, **style))
+            line.set_visible(True)
+        for line in self._lines[len(traces):]:
+            line.set_visible(False)
+
+    def render(self, extent, overlays=None, output=None):
+        """Render one image in this process.
+
+        :param extent: An :class:`mapping.Extent`, or
+          `[min_lon, max_lon, min_lat, max_lat]`.  It is grown to the aspect
+          ratio of the image.
+        :param overlays: Traces drawn over the map: a list of
+          `(longitudes, latitudes)` or `(longitudes, latitudes, style)`
+          tuples, or of `(N, 2)` lon/lat arrays.
+        :param output: Path to write the PNG to, or `None` to return it.
+
+        :return: `(output or png_bytes, timings)` where `timings` holds the
+          seconds spent in each stage of this image.
+        """
+        self._setup()
+        timings = dict.fromkeys(STAGES, 0.0)
+        if isinstance(extent, Extent):
+            extent = extent.to_project_web_mercator()
+        else:
+            extent = Extent.from_lonlat(*extent)
+        width, height = self.size
+        extent = _fit_aspect(extent, width / float(height))
+        zoom = self.zoom
+        if zoom is None:
+            zoom = optimal_zoom(extent, width, height)
+        scale = 2 ** zoom
+        xtilemin, xtilemax, ytilemin, ytilemax = extent.tile_range(zoom)
+        mosaic = geoplot.as_one_image(self.tile_source, xtilemax, xtilemin, ytilemax, ytilemin, zoom,
+                                      max_pixels=self.max_pixels, downsample=True, timings=timings)
+
+        start = time.perf_counter()
+        self._image.set_data(mosaic)
+        self._image.set_extent((xtilemin / float(scale), (xtilemax + 1) / float(scale),
+                                (ytilemax + 1) / float(scale), ytilemin / float(scale)))
+        self._axes.set(xlim=extent.xrange, ylim=extent.yrange)
+        self._update_lines(extent, _traces(overlays))
+        self._canvas.draw()
+        pixels = np.asarray(self._canvas.buffer_rgba())
+        timings['draw'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image = _Image.fromarray(pixels[..., :3])
+        if output is None:
+            buf = _io.BytesIO()
+            image.save(buf, format='PNG', compress_level=self.compress_level)
+            result = buf.getvalue()
+        else:
+            image.save(output, format='PNG', compress_level=self.compress_level)
+            result = output
+        timings['encode'] = time.perf_counter() - start
+        self._record(timings)
+        return result, timings
+
+    def _record(self, timings):
+        self.count += 1
+        for stage in STAGES:
+            self.timings[stage] += timings.get(stage, 0.0)
+
+    def render_many(self, jobs, output=None, n_jobs=4, chunksize='auto', pbar=True):
+        """Render many images, in worker processes if `n_jobs > 1`.
+
+        :param jobs: Iterable of `(extent, overlays)`, read lazily.
+        :param output: Path template with an `{index}` field, e.g.
+          `'thumbs/{index:06d}.png'`, or `None` to return the PNG bytes.
+        :param n_jobs: Number of worker processes.
+
+        :return: Generator of `(index, output or png_bytes)` in job order.
+          Stage times are added to :attr:`timings` as images complete.
+        """
+        if output is not None:
+            dirname = os.path.dirname(output.format(index=0))
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        if n_jobs == 1:
+            for index, (extent, overlays) in enumerate(jobs):
+                yield index, self.render(extent, overlays, None if output is None else output.format(index=index))[0]
+            return
+        tasks = ((index, job, output) for index, job in enumerate(jobs))
+        with gparallel_stream(_render_task, tasks, n_jobs=n_jobs, chunksize=chunksize, pbar=pbar, renderer=self) as results:
+            for index, result, timings in results:
+                self._record(timings)
+                yield index, result
+
+    def report(self):
+        """Summary of the time spent in each stage so far."""
+        total = sum(self.timings.values())
+        lines = ['{} images, {:.2f}s rendering'.format(self.count, total)]
+        for stage in STAGES:
+            secs = self.timings[stage]
+            lines.append('  {:<7} {:8.3f}s  {:7.2f} ms/image  {:5.1f}%'.format(
+                stage, secs, 1000 * secs / max(self.count, 1), 100 * secs / total if total else 0.0))
+        return '\n'.join(lines)
+
+
+def _render_task(task, renderer):
+    # Runs in the worker: draw on this process's figure for the configuration
+    index, (extent, overlays), output = task
+    renderer = _renderers.setdefault((os.getpid(),) + renderer._key(), renderer)
+    result, timings = renderer.render(extent, overlays, None if output is None else output.format(index=index))
+    return index, result, timings
+
+
+def render_batch(jobs, tile_source, output=None, n_jobs=4, chunksize='auto', pbar=True, **kwargs):
+    """Render `(extent, overlays)` jobs with a new :class:`BatchRenderer`
+    and print the per-stage timings.
+
+    :param kwargs: Passed on to :class:`BatchRenderer`.
+
+    :return: List of the outputs (paths, or PNG bytes) in job order.
+    """
+    renderer = BatchRenderer(tile_source, **kwargs)
+    results = [result for _, result in renderer.render_many(jobs, output, n_jobs, chunksize, pbar)]
+    print(renderer.report())
+    return results
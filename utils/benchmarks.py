@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+benchmarks
+~~~~~~~~~~
+
+Timings of the vectorised code paths against the scalar / brute force ones
+they replace.  Run everything with::
+
+    python -m utils.benchmarks
+"""
+from __future__ import print_function, absolute_import
+import timeit
+import numpy as np
+from six.moves import map
+
+
+def _best(stmt, repeat=3):
+    """Best wall time, in seconds, of `repeat` calls of `stmt`."""
+    return min(timeit.repeat(stmt, number=1, repeat=repeat))
+
+
+def _report(name, n, timings):
+    base = timings[0][1]
+    for label, secs in timings:
+        print('{:<28} n={:<10d} {:<10} {:9.4f}s  x{:.1f}'.format(name, n, label, secs, base / secs))
+
+
+def benchmark_projection(n=10**6, repeat=3):
+    """:func:`mapping.to_web_mercator` through `map` versus
+    :func:`mapping.to_web_mercator_np`, and the same for the inverse."""
+    from .mapping import to_web_mercator, to_web_mercator_np, to_lonlat, to_lonlat_np
+    rs = np.random.RandomState(0)
+    lon = rs.uniform(-180, 180, n)
+    lat = rs.uniform(-85, 85, n)
+    out = np.empty((2, n))
+    x, y = to_web_mercator_np(lon, lat)
+    _report('to_web_mercator', n, [
+        ('scalar', _best(lambda: list(map(to_web_mercator, lon, lat)), repeat)),
+        ('numpy', _best(lambda: to_web_mercator_np(lon, lat), repeat)),
+        ('numpy out=', _best(lambda: to_web_mercator_np(lon, lat, out=out), repeat)),
+    ])
+    _report('to_lonlat', n, [
+        ('scalar', _best(lambda: list(map(to_lonlat, x, y)), repeat)),
+        ('numpy', _best(lambda: to_lonlat_np(x, y), repeat)),
+        ('numpy out=', _best(lambda: to_lonlat_np(x, y, out=out), repeat)),
+    ])
+
+
+def benchmark_spatial_index(n_points=10**5, n_queries=10**3, k=5, radius_km=1.0, repeat=3):
+    """Brute force :func:`distanceCalculator.haversine_np` against
+    :class:`spatialIndex.SpatialIndex` for kNN and radius queries over points
+    clustered in a city-sized box."""
+    from .distanceCalculator import haversine_np
+    from .spatialIndex import SpatialIndex
+    rs = np.random.RandomState(0)
+    lon, lat = rs.uniform(36.6, 37.1, n_points), rs.uniform(-1.5, -1.1, n_points)
+    qlon, qlat = rs.uniform(36.6, 37.1, n_queries), rs.uniform(-1.5, -1.1, n_queries)
+
+    def brute_knn():
+        for q in range(n_queries):
+            d = haversine_np(qlon[q], qlat[q], lon, lat)
+            np.sort(d[np.argpartition(d, k)[:k]])
+
+    def brute_radius():
+        for q in range(n_queries):
+            np.nonzero(haversine_np(qlon[q], qlat[q], lon, lat) <= radius_km)
+
+    index = SpatialIndex(lon, lat)
+    _report('SpatialIndex build', n_points, [
+        ('build', _best(lambda: SpatialIndex(lon, lat), repeat)),
+    ])
+    _report('kNN (k={})'.format(k), n_queries, [
+        ('brute', _best(brute_knn, repeat)),
+        ('index', _best(lambda: index.query(qlon, qlat, k=k), repeat)),
+    ])
+    _report('radius ({} km)'.format(radius_km), n_queries, [
+        ('brute', _best(brute_radius, repeat)),
+        ('index', _best(lambda: index.query_radius(qlon, qlat, radius_km), repeat)),
+    ])
+
+
+def benchmark_pairwise(n=4000, m=4000, repeat=3):
+    """Broadcasting :func:`distanceCalculator.haversine_np` to an N x M matrix
+    against the tiled :func:`distanceCalculator.haversine_pairwise`."""
+    from .distanceCalculator import haversine_np, haversine_pairwise
+    rs = np.random.RandomState(0)
+    lon1, lat1 = rs.uniform(-180, 180, n), rs.uniform(-85, 85, n)
+    lon2, lat2 = rs.uniform(-180, 180, m), rs.uniform(-85, 85, m)
+    out = np.empty((n, m))
+    _report('pairwise haversine', n * m, [
+        ('broadcast', _best(lambda: haversine_np(lon1[:, None], lat1[:, None], lon2[None, :], lat2[None, :]), repeat)),
+        ('tiled', _best(lambda: haversine_pairwise(lon1, lat1, lon2, lat2, out=out), repeat)),
+        ('tiled f32', _best(lambda: haversine_pairwise(lon1, lat1, lon2, lat2, dtype=np.float32), repeat)),
+    ])
+
+
+def benchmark_extent_array(n=10**5, repeat=3):
+    """A list of :class:`mapping.Extent` against one
+    :class:`mapping.ExtentArray`: add a margin, square up and find the tiles
+    at zoom 14."""
+    from .mapping import Extent, ExtentArray
+    rs = np.random.RandomState(0)
+    lon, lat = rs.uniform(-170, 170, n), rs.uniform(-60, 60, n)
+    size = rs.uniform(0.01, 1, n)
+    extents = [Extent.from_lonlat(*b) for b in zip(lon, lon + size, lat, lat + size)]
+    array = ExtentArray.from_lonlat(lon, lon + size, lat, lat + size)
+
+    def objects():
+        for e in extents:
+            e = e.with_margin_km(1).to_square()
+            int(2 ** 14 * e.xmin), int(2 ** 14 * e.xmax), int(2 ** 14 * e.ymin), int(2 ** 14 * e.ymax)
+
+    _report('extent margin/square/tiles', n, [
+        ('Extent', _best(objects, repeat)),
+        ('ExtentArray', _best(lambda: array.with_margin_km(1).to_square().tile_ranges(14), repeat)),
+    ])
+
+
+def benchmark_merge(n=10**6, k=16, repeat=3):
+    """k-way merge of sorted runs: :func:`heapq.merge` element by element
+    against the block-wise :func:`extsort.merge_sorted`."""
+    import heapq
+    from .extsort import merge_sorted
+    rs = np.random.RandomState(0)
+    runs = [np.sort(run) for run in np.array_split(rs.normal(size=n), k)]
+    _report('{}-way merge'.format(k), n, [
+        ('heapq.merge', _best(lambda: np.fromiter(heapq.merge(*runs), dtype=float, count=n), repeat)),
+        ('merge_sorted', _best(lambda: np.concatenate(list(merge_sorted(runs))), repeat)),
+    ])
+
+
+def benchmark_cdf(n=10**6, points=2000, repeat=3):
+    """The points of a CDF plot: a full `sorted` with a rank per element (the
+    old :func:`common.cdfPlot`) against exact ranks by `np.partition` and a
+    :class:`quantilesketch.KLLSketch` fed in batches."""
+    from .quantilesketch import KLLSketch
+    x = np.random.RandomState(0).lognormal(size=n)
+    ranks = np.linspace(0, n - 1, points).round().astype(np.int64)
+
+    def sketch():
+        s = KLLSketch()
+        for batch in np.array_split(x, 100):
+            s.update(batch)
+        return s.ecdf(points)
+
+    _report('cdf points', n, [
+        ('sorted', _best(lambda: (sorted(x), [float(i + 1) / n for i in range(n)]), repeat)),
+        ('np.partition', _best(lambda: np.partition(x, ranks)[ranks], repeat)),
+        ('KLLSketch', _best(sketch, repeat)),
+    ])
+
+
+def main():
+    benchmark_projection()
+    benchmark_spatial_index()
+    benchmark_pairwise()
+    benchmark_extent_array()
+    benchmark_merge()
+    benchmark_cdf()
+
+
+if __name__ == '__main__':
+    main()
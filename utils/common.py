@@ -3,7 +3,7 @@
 Created on Wed May  6 09:28:22 2015
 """
 
-import sys, time
+import sys, time, os, io
 import numpy as np
 import matplotlib.pyplot as plt
 #import cPickle as pickle
@@ -43,24 +43,162 @@ def unix_time_secs(dt):
 def unix_time_millis(dt):
     return (dt-datetime(1970,1,1)).total_seconds()
 
-def savePickle(fname,dataVar):
+def savePickle(fname,dataVar,protocol=2):
     with open(fname,'wb') as fp:
-        pickle.dump(dataVar,fp,protocol=2)
+        pickle.dump(dataVar,fp,protocol=protocol)
         
 def loadPickle(fname):
     with open(fname,'rb') as file:
         dataVar = pickle.load(file)
     return dataVar
 
-def saveJSON(fname, dataVar):
-    with open(fname, 'w') as fp:
-        json.dump(dataVar, fp,sort_keys=True, indent=4)
+_ARRAYS_MAGIC = b'UTILSARR'
+_ARRAYS_ALIGN = 64
+
+def _align(n, alignment=_ARRAYS_ALIGN):
+    return -(-n // alignment) * alignment
+
+def saveArrays(fname, dataVar, min_bytes=2**16):
+    """
+    Save nested dicts/lists/tuples of numpy arrays (or any picklable object)
+    so that loadArrays can memory-map the arrays back without copying them.
+
+    The object is pickled with protocol 5. Every contiguous buffer of at least
+    min_bytes is taken out-of-band and written raw, 64-byte aligned, after the
+    pickle; everything else stays in the pickle. The file starts with a magic
+    string, the length of a JSON header, and the header, which holds the
+    offset and length of the pickle and of every buffer.
+    """
+    buffers = []
+    def buffer_callback(buf):
+        # Returning a false value takes the buffer out-of-band
+        if buf.raw().nbytes < min_bytes:
+            return True
+        buffers.append(buf)
+        return False
+    payload = pickle.dumps(dataVar, protocol=5, buffer_callback=buffer_callback)
+    raws = [buf.raw() for buf in buffers]
+    # Offsets are relative to the (aligned) end of the header
+    offset = len(payload)
+    layout = []
+    for raw in raws:
+        offset = _align(offset)
+        layout.append([offset, raw.nbytes])
+        offset += raw.nbytes
+    header = json.dumps({'version': 1, 'pickle': [0, len(payload)], 'buffers': layout}).encode('utf-8')
+    start = _align(len(_ARRAYS_MAGIC) + 8 + len(header))
+    with open(fname, 'wb') as fp:
+        fp.write(_ARRAYS_MAGIC)
+        fp.write(np.uint64(len(header)).tobytes())
+        fp.write(header)
+        fp.write(b'\0' * (start - fp.tell()))
+        fp.write(payload)
+        for (offset, nbytes), raw in zip(layout, raws):
+            fp.write(b'\0' * (start + offset - fp.tell()))
+            fp.write(raw)
+
+def loadArrays(fname, mmap_mode='r'):
+    """
+    Load a file written by saveArrays.
+
+    mmap_mode follows np.load: 'r' maps the arrays read-only, 'c' maps them
+    copy-on-write, and None reads the whole file into memory. When mapped,
+    only the pages of the arrays that are actually touched are read from disk.
+    """
+    import mmap
+    with open(fname, 'rb') as fp:
+        if fp.read(len(_ARRAYS_MAGIC)) != _ARRAYS_MAGIC:
+            raise ValueError('{} was not written by saveArrays'.format(fname))
+        header_len = int(np.frombuffer(fp.read(8), dtype=np.uint64)[0])
+        header = json.loads(fp.read(header_len).decode('utf-8'))
+        start = _align(len(_ARRAYS_MAGIC) + 8 + header_len)
+        if mmap_mode is None:
+            fp.seek(0)
+            data = memoryview(bytearray(fp.read()))
+        else:
+            access = {'r': mmap.ACCESS_READ, 'c': mmap.ACCESS_COPY}[mmap_mode]
+            data = memoryview(mmap.mmap(fp.fileno(), 0, access=access))
+    offset, nbytes = header['pickle']
+    payload = data[start + offset:start + offset + nbytes]
+    buffers = [data[start + offset:start + offset + nbytes] for offset, nbytes in header['buffers']]
+    return pickle.loads(payload, buffers=buffers)
+
+_COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.lzma': 'xz', '.zst': 'zstd'}
 
-def loadJSON(fname):
-    with open(fname, 'r') as fp:
+def _open_binary(fname, mode, compression):
+    if compression is None:
+        return io.open(fname, mode + 'b')
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(fname, mode + 'b', compresslevel=6)
+    if compression == 'bz2':
+        import bz2
+        return bz2.open(fname, mode + 'b')
+    if compression == 'xz':
+        import lzma
+        return lzma.open(fname, mode + 'b')
+    if compression == 'zstd':
+        try:
+            from compression import zstd
+        except ImportError:
+            import zstandard as zstd
+        return zstd.open(fname, mode + 'b')
+    raise ValueError('Unknown compression: {}'.format(compression))
+
+def openText(fname, mode='r', compression='infer'):
+    """
+    Open a (possibly compressed) utf-8 text file for reading ('r'),
+    writing ('w') or appending ('a'). compression is one of None, 'gzip',
+    'bz2', 'xz' or 'zstd' (needs Python 3.14 or the zstandard package), or
+    'infer' to pick it from the file extension.
+    """
+    if compression == 'infer':
+        compression = _COMPRESSION_EXTENSIONS.get(os.path.splitext(fname)[1].lower())
+    return io.TextIOWrapper(_open_binary(fname, mode, compression), encoding='utf-8')
+
+def saveJSON(fname, dataVar, compact=False, compression='infer'):
+    """
+    compact skips the indentation and key sorting, which is much faster for
+    large documents.
+    """
+    with openText(fname, 'w', compression) as fp:
+        if compact:
+            json.dump(dataVar, fp, separators=(',', ':'))
+        else:
+            json.dump(dataVar, fp,sort_keys=True, indent=4)
+
+def loadJSON(fname, compression='infer'):
+    with openText(fname, 'r', compression) as fp:
         data = json.load(fp)
     return data
 
+def saveJSONLines(fname, records, compression='infer', batch_size=1000, append=False):
+    """
+    Stream an iterable of JSON serialisable records to fname, one compact
+    document per line. Records are encoded and written batch_size at a time.
+    Returns the number of records written.
+    """
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    count = 0
+    with openText(fname, 'a' if append else 'w', compression) as fp:
+        for btch in batch(records, batch_size):
+            lines = [encode(record) for record in btch]
+            fp.write('\n'.join(lines))
+            fp.write('\n')
+            count += len(lines)
+    return count
+
+def iterJSONLines(fname, compression='infer'):
+    """
+    Generator over the records of a JSON-lines file, read one line at a time,
+    e.g. batch(iterJSONLines(fname), 1000) or gimap(fun, iterJSONLines(fname)).
+    """
+    decode = json.JSONDecoder().decode
+    with openText(fname, 'r', compression) as fp:
+        for line in fp:
+            if line.strip():
+                yield decode(line)
+
 """
 def saveDill(fname, dataVar):
     with open(fname, 'w') as fp:
@@ -72,17 +210,28 @@ def loadDill(fname):
     return dataVar
 """
 
-def cdfPlot(x,normalize=True,label='',col=None,lw=3,zorder=0,alpha=1, ls='solid'):
-    if col==None:
-        if normalize:
-            h = plt.plot(sorted(x),[float(ii+1)/len(x) for ii in range(len(x))],ls = ls, lw=lw,label=label,zorder=zorder,alpha=alpha)
-        else:
-            h = plt.plot(sorted(x),[float(ii+1) for ii in range(len(x))],ls = ls, lw=lw,label=label,zorder=zorder,alpha=alpha)
+def cdfPlot(x,normalize=True,label='',col=None,lw=3,zorder=0,alpha=1, ls='solid', max_points=2000):
+    # Only max_points points of the CDF are drawn, so the cost does not grow with the input:
+    # - a KLLSketch (see quantilesketch) is plotted from its items
+    # - a SortedRuns (see extsort), or a memory mapped array sorted into one on disk, at exact ranks
+    # - other data at exact evenly spaced ranks picked with np.partition, without a full sort
+    from .extsort import SortedRuns, sort_runs
+    from .quantilesketch import KLLSketch
+    if isinstance(x, np.memmap):
+        with sort_runs(x) as runs:
+            return cdfPlot(runs,normalize,label,col,lw,zorder,alpha,ls,max_points)
+    if isinstance(x, (SortedRuns, KLLSketch)):
+        values, ranks = x.ecdf(max_points)
+        n = x.n
     else:
-        if normalize:
-            h = plt.plot(sorted(x),[float(ii+1)/len(x) for ii in range(len(x))],ls=ls, c=col,lw=lw,label=label,zorder=zorder,alpha=alpha)
-        else:
-            h = plt.plot(sorted(x),[float(ii+1) for ii in range(len(x))],ls=ls, c=col,lw=lw,label=label,zorder=zorder,alpha=alpha)
+        x = np.asarray(x).ravel()
+        n = len(x)
+        ranks = np.unique(np.linspace(0, n-1, min(max_points, n)).round().astype(np.int64))
+        values = np.partition(x, ranks)[ranks] if len(ranks) < n else np.sort(x)
+        ranks = ranks+1
+    y = ranks/float(n) if normalize else ranks
+    colour = {} if col is None else {'c': col}
+    return plt.plot(values,y,ls=ls,lw=lw,label=label,zorder=zorder,alpha=alpha,**colour)
 
 
 # convert a number to a string with commas
@@ -143,6 +292,13 @@ def render_gallery(images, batch_size=10):
 import numpy
 
 def mode(ndarray, axis=0):
+    # Inputs larger than RAM: count runs of equal values while merging sorted runs on disk (see extsort)
+    from .extsort import SortedRuns, sort_runs
+    if isinstance(ndarray, SortedRuns):
+        return ndarray.mode()
+    if isinstance(ndarray, numpy.memmap) and ndarray.ndim == 1:
+        with sort_runs(ndarray) as runs:
+            return runs.mode()
     # Check inputs
     ndarray = numpy.asarray(ndarray)
     ndim = ndarray.ndim
@@ -156,9 +312,7 @@ def mode(ndarray, axis=0):
         raise Exception('Axis "{}" incompatible with the {}-dimension array'.format(axis, ndim))
 
     # If array is 1-D and numpy version is > 1.9 numpy.unique will suffice
-    if all([ndim == 1,
-            int(numpy.__version__.split('.')[0]) >= 1,
-            int(numpy.__version__.split('.')[1]) >= 9]):
+    if ndim == 1 and tuple(int(v) for v in numpy.__version__.split('.')[:2]) >= (1, 9):
         modals, counts = numpy.unique(ndarray, return_counts=True)
         index = numpy.argmax(counts)
         return modals[index], counts[index]
@@ -185,11 +339,11 @@ def mode(ndarray, axis=0):
     slices = [slice(None)] * ndim
     slices[axis] = slice(1, None)
     # Reshape and compute final counts
-    counts = counts.reshape(shape).transpose(transpose)[slices] + 1
+    counts = counts.reshape(shape).transpose(transpose)[tuple(slices)] + 1
 
     # Find maximum counts and return modals/counts
     slices = [slice(None, i) for i in sort.shape]
     del slices[axis]
-    index = numpy.ogrid[slices]
+    index = list(numpy.ogrid[tuple(slices)])
     index.insert(axis, numpy.argmax(counts, axis=axis))
-    return sort[index], counts[index]
+    return sort[tuple(index)], counts[tuple(index)]
@@ -9,7 +9,7 @@ def translate_lonlat(longitude, latitude, x_km, y_km=None):
     if y_km is None:
         y_km = x_km
     new_latitude = latitude + ((y_km/r_earth) * (180./np.pi))
-    new_longitude = longitude + ((x_km/r_earth) * (180./np.pi) / cos(latitude*np.pi/180.))
+    new_longitude = longitude + ((x_km/r_earth) * (180./np.pi) / np.cos(latitude*np.pi/180.))
     return new_longitude, new_latitude
 
 
@@ -30,4 +30,95 @@ def haversine_np(lon1, lat1, lon2, lat2):
 
     c = 2 * np.arcsin(np.sqrt(a))
     km = 6367 * c
-    return km
\ No newline at end of file
+    return km
+
+def _half_angles(lon, lat, dtype):
+    lon, lat = np.radians(np.asarray(lon, dtype=np.float64).ravel()), np.radians(np.asarray(lat, dtype=np.float64).ravel())
+    return [a.astype(dtype) for a in (np.sin(lat/2.0), np.cos(lat/2.0), np.sin(lon/2.0), np.cos(lon/2.0), np.cos(lat))]
+
+
+def _haversine_tile(p1, p2, tile, scratch):
+    """
+    Distances between two blocks of points, written into tile. Uses
+    sin((b-a)/2) = sin(b/2)cos(a/2) - cos(b/2)sin(a/2) on the precomputed
+    half angles, so there are no trig calls per pair except the arcsin.
+    """
+    slat1, clat1, slon1, clon1, coslat1 = p1
+    slat2, clat2, slon2, clon2, coslat2 = p2
+    np.multiply.outer(clat1, slat2, out=tile)
+    np.multiply.outer(slat1, clat2, out=scratch[0])
+    tile -= scratch[0]
+    tile *= tile
+    np.multiply.outer(clon1, slon2, out=scratch[0])
+    np.multiply.outer(slon1, clon2, out=scratch[1])
+    scratch[0] -= scratch[1]
+    scratch[0] *= scratch[0]
+    scratch[0] *= coslat1[:, None]
+    scratch[0] *= coslat2[None, :]
+    tile += scratch[0]
+    np.sqrt(tile, out=tile)
+    np.minimum(tile, 1.0, out=tile)
+    np.arcsin(tile, out=tile)
+    tile *= 2 * 6367
+
+
+def haversine_pairwise(lon1, lat1, lon2, lat2, out=None, dtype=np.float64, block_size=256, threshold=None, n_jobs=1):
+    """
+    Calculate the great circle distance (km) between every point of the
+    first set and every point of the second set, as haversine_np would.
+
+    The N x M result is built in block_size x block_size tiles so that the
+    temporaries stay cache sized, instead of broadcasting several N x M
+    arrays.
+
+    out: Optional preallocated N x M array to fill, e.g. a np.memmap for
+      results larger than memory.
+    dtype: np.float32 halves the memory. It is accurate to about a metre
+      up to a few thousand km, degrading to about a km for nearly antipodal
+      pairs.
+    threshold: If given, only pairs at most this many km apart are kept
+      and a sparse (rows, cols, distances) triple is returned instead of
+      the dense matrix. Pass it to scipy.sparse.coo_matrix if needed.
+    n_jobs: Number of threads working on separate rows of tiles. NumPy
+      releases the GIL, so this scales with cores.
+    """
+    p1 = _half_angles(lon1, lat1, dtype)
+    p2 = _half_angles(lon2, lat2, dtype)
+    n, m = len(p1[0]), len(p2[0])
+    if threshold is None:
+        if out is None:
+            out = np.empty((n, m), dtype=dtype)
+        elif out.shape != (n, m):
+            raise ValueError("out must have shape {}, got {}".format((n, m), out.shape))
+
+    def row_block(i):
+        rows = slice(i, min(i + block_size, n))
+        tile = np.empty((rows.stop - i, block_size), dtype=dtype)
+        scratch = np.empty((2,) + tile.shape, dtype=dtype)
+        a = [v[rows] for v in p1]
+        found = []
+        for j in range(0, m, block_size):
+            cols = slice(j, min(j + block_size, m))
+            width = cols.stop - j
+            t = tile[:, :width]
+            _haversine_tile(a, [v[cols] for v in p2], t, scratch[:, :, :width])
+            if threshold is None:
+                out[rows, cols] = t
+            else:
+                r, c = np.nonzero(t <= threshold)
+                found.append((r + i, c + j, t[r, c]))
+        return found
+
+    starts = range(0, n, block_size)
+    if n_jobs == 1:
+        blocks = [row_block(i) for i in starts]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            blocks = list(pool.map(row_block, starts))
+    if threshold is None:
+        return out
+    found = [f for block in blocks for f in block]
+    if not found:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=dtype)
+    return tuple(np.concatenate(part) for part in zip(*found))
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+extsort
+~~~~~~~
+
+External-memory sorting of 1-D numeric data that does not fit in RAM.
+
+The input (an array, possibly memory mapped, a `.npy` path or an iterable of
+chunks) is cut into runs that are sorted in parallel worker processes and
+written to `.npy` files.  The result, :class:`SortedRuns`, answers order
+statistics straight from the memory mapped runs:
+
+- :meth:`SortedRuns.rank` is one binary search per run, no merging needed.
+- :meth:`SortedRuns.select` and :meth:`SortedRuns.quantile` find exact
+  order statistics by narrowing a window in every run about a weighted
+  median pivot, reading a few pages per run.
+- :meth:`SortedRuns.blocks` k-way merges the runs into sorted blocks,
+  vectorised a block at a time, for one streaming pass (e.g.
+  :meth:`SortedRuns.ecdf`, :meth:`SortedRuns.mode` or :func:`external_sort`).
+
+NaNs are dropped from the runs and only counted (`n_nan`), so statistics
+ignore them as :func:`numpy.nanquantile` does, and a full sort puts them last
+as :func:`numpy.sort` does.
+"""
+from __future__ import print_function, absolute_import
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice, chain
+import numpy as np
+
+RUN_SIZE = 2**23
+BLOCK_SIZE = 2**16
+
+
+def _sort_run(chunk, path):
+    # Runs in the worker: sort one run to disk, dropping NaNs
+    if isinstance(chunk, tuple):
+        source, start, stop = chunk
+        chunk = np.load(source, mmap_mode='r')[start:stop]
+    chunk = np.asarray(chunk).ravel()
+    n_nan = 0
+    if chunk.dtype.kind in 'fc':
+        nan = np.isnan(chunk)
+        n_nan = int(nan.sum())
+        if n_nan:
+            chunk = chunk[~nan]
+    np.save(path, np.sort(chunk))
+    return path, len(chunk), n_nan
+
+
+def _chunks(source, run_size):
+    """Cut a source into runs: `(path, start, stop)` for `.npy` files, which
+    the workers read themselves, else arrays."""
+    if isinstance(source, str):
+        n = len(np.load(source, mmap_mode='r'))
+        for start in range(0, n, run_size):
+            yield source, start, min(start + run_size, n)
+        return
+    if isinstance(source, np.ndarray):
+        source = source.ravel() if source.ndim != 1 else source
+        for start in range(0, len(source), run_size):
+            yield source[start:start + run_size]
+        return
+    iterator = iter(source)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return
+    iterator = chain([first], iterator)
+    if np.ndim(first) == 0:
+        while True:
+            run = np.array(list(islice(iterator, run_size)))
+            if not len(run):
+                return
+            yield run
+    pieces, size = [], 0
+    for piece in iterator:
+        piece = np.asarray(piece).ravel()
+        while size + len(piece) >= run_size:
+            cut = run_size - size
+            yield np.concatenate(pieces + [piece[:cut]])
+            pieces, size, piece = [], 0, piece[cut:]
+        if len(piece):
+            pieces.append(piece)
+            size += len(piece)
+    if pieces:
+        yield np.concatenate(pieces)
+
+
+def sort_runs(source, run_size=RUN_SIZE, n_jobs=1, tmp_dir=None):
+    """Sort a large input into runs on disk.
+
+    :param source: A 1-D array (a `numpy.memmap` is read a run at a time),
+      the path of a `.npy` file (read by the workers directly), or an
+      iterable of arrays or of scalars.
+    :param run_size: Elements per run; a worker holds about two runs.
+    :param n_jobs: Number of worker processes sorting runs.
+    :param tmp_dir: Where to make the directory of runs, defaults to the
+      system temporary directory.
+
+    :return: A :class:`SortedRuns`.  Close it to delete the runs.
+    """
+    directory = tempfile.mkdtemp(prefix='extsort-', dir=tmp_dir)
+    results = {}
+    pool = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        pending = {}
+        for i, chunk in enumerate(_chunks(source, run_size)):
+            path = os.path.join(directory, 'run{:06d}.npy'.format(i))
+            if pool is None:
+                results[i] = _sort_run(chunk, path)
+                continue
+            pending[pool.submit(_sort_run, chunk, path)] = i
+            if len(pending) >= 2 * n_jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+        for future in pending:
+            results[pending[future]] = future.result()
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    results = [results[i] for i in sorted(results)]
+    return SortedRuns(directory, [path for path, _, _ in results], [n for _, n, _ in results],
+                      sum(n_nan for _, _, n_nan in results))
+
+
+def merge_sorted(arrays, block_size=BLOCK_SIZE):
+    """K-way merge of sorted 1-D arrays (e.g. memory mapped runs).
+
+    Each step looks at the next `block_size` elements of every array, emits
+    all of them up to the smallest of their last values, which no unread
+    element can precede, and sorts those together.
+
+    :return: Generator of sorted blocks, which concatenate to the merge.
+    """
+    arrays = [a for a in arrays if len(a)]
+    positions = [0] * len(arrays)
+    while arrays:
+        windows = [a[p:p + block_size] for a, p in zip(arrays, positions)]
+        bound = min(w[-1] for w in windows)
+        taken = [np.searchsorted(w, bound, side='right') for w in windows]
+        block = np.concatenate([w[:t] for w, t in zip(windows, taken)])
+        block.sort(kind='mergesort')
+        yield block
+        positions = [p + t for p, t in zip(positions, taken)]
+        active = [i for i, a in enumerate(arrays) if positions[i] < len(a)]
+        arrays = [arrays[i] for i in active]
+        positions = [positions[i] for i in active]
+
+
+class SortedRuns(object):
+    """Sorted runs of a large input, memory mapped from `.npy` files.
+
+    :ivar n: Number of (non NaN) elements.
+    :ivar n_nan: Number of NaNs in the input.
+    """
+    def __init__(self, directory, paths, counts, n_nan=0):
+        self.directory = directory
+        self.paths = paths
+        self.counts = counts
+        self.n = int(sum(counts))
+        self.n_nan = n_nan
+        self._runs = None
+
+    @property
+    def runs(self):
+        if self._runs is None:
+            self._runs = [np.load(path, mmap_mode='r') for path in self.paths]
+        return self._runs
+
+    @property
+    def dtype(self):
+        return self.runs[0].dtype if self.runs else np.dtype(float)
+
+    def __len__(self):
+        return self.n
+
+    def close(self):
+        """Delete the runs."""
+        self._runs = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def blocks(self, block_size=BLOCK_SIZE, nan=False):
+        """The elements in sorted order, as a generator of blocks.
+
+        :param nan: Also yield the NaNs, as a last block.
+        """
+        for block in merge_sorted(self.runs, block_size):
+            yield block
+        if nan and self.n_nan:
+            yield np.full(self.n_nan, np.nan, dtype=self.dtype)
+
+    def rank(self, values):
+        """The number of elements less than or equal to each of `values`."""
+        values = np.asarray(values)
+        ranks = np.zeros(values.shape, dtype=np.int64)
+        for run in self.runs:
+            ranks += np.searchsorted(run, values, side='right')
+        return ranks
+
+    def cdf(self, values):
+        """The fraction of elements less than or equal to each of `values`."""
+        return self.rank(values) / float(max(self.n, 1))
+
+    def select(self, k):
+        """The `k`-th smallest element (from 0), exactly.
+
+        Every run keeps a window in which the answer may lie.  The pivot is
+        the median of the window midpoints weighted by window size, so at
+        least a quarter of the candidates are dropped each round.
+        """
+        k = int(k)
+        if not 0 <= k < self.n:
+            raise IndexError('Rank {} out of range for {} elements'.format(k, self.n))
+        runs = self.runs
+        lo = np.zeros(len(runs), dtype=np.int64)
+        hi = np.array(self.counts, dtype=np.int64)
+        while True:
+            active = np.flatnonzero(hi > lo)
+            mids = np.array([runs[i][(lo[i] + hi[i]) // 2] for i in active])
+            order = np.argsort(mids, kind='mergesort')
+            weights = np.cumsum((hi - lo)[active][order])
+            pivot = mids[order][np.searchsorted(weights, weights[-1] / 2.0)]
+            left = np.array([np.searchsorted(run, pivot, side='left') for run in runs])
+            right = np.array([np.searchsorted(run, pivot, side='right') for run in runs])
+            if left.sum() <= k < right.sum():
+                return pivot
+            if k < left.sum():
+                hi = np.minimum(hi, left)
+            else:
+                lo = np.maximum(lo, right)
+
+    def at_ranks(self, ranks, block_size=BLOCK_SIZE):
+        """The elements at many sorted ranks (from 0) in one merging pass,
+        or by :meth:`select` if there are only a few."""
+        ranks = np.asarray(ranks, dtype=np.int64)
+        if len(ranks) <= 16:
+            return np.array([self.select(k) for k in ranks], dtype=self.dtype)
+        if len(ranks) and (ranks.min() < 0 or ranks.max() >= self.n):
+            raise IndexError('Ranks out of range for {} elements'.format(self.n))
+        order = np.argsort(ranks, kind='mergesort')
+        wanted = ranks[order]
+        out = np.empty(len(ranks), dtype=self.dtype)
+        start, i = 0, 0
+        for block in self.blocks(block_size):
+            j = np.searchsorted(wanted, start + len(block), side='left')
+            out[order[i:j]] = block[wanted[i:j] - start]
+            start, i = start + len(block), j
+            if i == len(wanted):
+                break
+        return out
+
+    def quantile(self, q):
+        """Exact quantiles, interpolated linearly as :func:`numpy.quantile`."""
+        q = np.asarray(q, dtype=float)
+        h = (self.n - 1) * np.atleast_1d(q)
+        below, above = np.floor(h).astype(np.int64), np.ceil(h).astype(np.int64)
+        values = self.at_ranks(np.concatenate([below, above])).astype(float)
+        low, high = values[:len(h)], values[len(h):]
+        out = low + (h - below) * (high - low)
+        return out.reshape(q.shape) if q.ndim else out[0]
+
+    def ecdf(self, n_points=2000):
+        """Points on the empirical CDF at up to `n_points` evenly spaced
+        ranks, first and last included.
+
+        :return: `(values, ranks)` where `ranks` counts from 1.
+        """
+        ranks = np.unique(np.linspace(0, self.n - 1, min(n_points, self.n)).round().astype(np.int64))
+        return self.at_ranks(ranks), ranks + 1
+
+    def mode(self, block_size=BLOCK_SIZE):
+        """The most common element and its count, smallest first on ties,
+        counted over merged blocks so equal values may span blocks.  NaNs
+        count as one value, as in :func:`numpy.unique`."""
+        best, best_count = None, 0
+        current, current_count = None, 0
+        for block in self.blocks(block_size):
+            starts = np.flatnonzero(np.r_[True, block[1:] != block[:-1]])
+            counts = np.diff(np.r_[starts, len(block)])
+            values = block[starts]
+            if current_count and values[0] == current:
+                counts[0] += current_count
+            elif current_count > best_count:
+                best, best_count = current, current_count
+            i = np.argmax(counts[:-1]) if len(counts) > 1 else None
+            if i is not None and counts[i] > best_count:
+                best, best_count = values[i], counts[i]
+            current, current_count = values[-1], counts[-1]
+        if current_count > best_count:
+            best, best_count = current, current_count
+        if self.n_nan > best_count:
+            best, best_count = np.nan, self.n_nan
+        return best, best_count
+
+
+def external_sort(source, output, run_size=RUN_SIZE, n_jobs=1, tmp_dir=None, block_size=BLOCK_SIZE):
+    """Sort a large input into a `.npy` file, NaNs last.
+
+    :param output: Path of the `.npy` file to write.
+
+    :return: The sorted array, memory mapped read-only from `output`.
+    """
+    with sort_runs(source, run_size, n_jobs, tmp_dir) as runs:
+        out = np.lib.format.open_memmap(output, mode='w+', dtype=runs.dtype, shape=(runs.n + runs.n_nan,))
+        start = 0
+        for block in runs.blocks(block_size, nan=True):
+            out[start:start + len(block)] = block
+            start += len(block)
+        out.flush()
+        del out
+    return np.load(output, mmap_mode='r')
+
+
+def quantile(source, q, **kwargs):
+    """Exact quantiles of a large input, NaNs ignored.
+
+    :param kwargs: Passed on to :func:`sort_runs`.
+    """
+    with sort_runs(source, **kwargs) as runs:
+        return runs.quantile(q)
+
+
+def rank(source, values, **kwargs):
+    """The number of elements of a large input less than or equal to each of
+    `values`.
+
+    :param kwargs: Passed on to :func:`sort_runs`.
+    """
+    with sort_runs(source, **kwargs) as runs:
+        return runs.rank(values)
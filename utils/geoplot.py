@@ -8,22 +8,45 @@ map tiles.
 
 """
 from __future__ import print_function, absolute_import
-import requests as _requests
-import io as _io
-import PIL.Image as _Image
 import matplotlib.pyplot as plt
-from .mapping import Extent, to_web_mercator
-from collections import Iterable, defaultdict
+from .mapping import Extent, to_web_mercator_np, optimal_zoom, _as_traces
+from .tilecache import TileCache, MosaicCache
+from .tilefetch import TileFetcher
 import numpy as np
+import time
 from functools import partial
 
 MAPBOX_SATELLITE = "https://api.mapbox.com/v4/mapbox.streets-satellite/{z}/{x}/{y}.png?access_token=pk.eyJ1IjoiZ3VpbHR5c3BhcmsiLCJhIjoiM2NPR0l4dyJ9.H3VmL6yY8xt7ZpyqeavnSw"
 MAPBOX_STREETS = "https://api.mapbox.com/v4/mapbox.streets/{z}/{x}/{y}.png?access_token=pk.eyJ1IjoiZ3VpbHR5c3BhcmsiLCJhIjoiM2NPR0l4dyJ9.H3VmL6yY8xt7ZpyqeavnSw"
 STAMEN = "http://b.tile.stamen.com/terrain/{z}/{x}/{y}.jpg"
 
-tile_cache = defaultdict(defaultdict)
+#: Two tier (memory, then disk) cache used by :func:`get_tile`.  Replace it
+#: with another :class:`tilecache.TileCache` to change its location or size.
+tile_cache = TileCache()
 
-def get_tile(tile_source, x, y, zoom):
+#: Stitched mosaics, reused whole or in part by :func:`as_one_image`.
+mosaic_cache = MosaicCache()
+
+#: Pooled, concurrent downloader used on cache misses.
+tile_fetcher = TileFetcher()
+
+#: Traces longer than this are downsampled by :func:`plot`.  That is still
+#: several points per pixel column of the largest figures.
+MAX_PLOT_POINTS = 100000
+
+#: Largest mosaic, in pixels, :func:`as_one_image` builds by default (200
+#: full size tiles).  Larger requests raise, or are downsampled if asked to.
+MAX_MOSAIC_PIXELS = 200 * 256 * 256
+
+def fetch_tile(tile_source, x, y, zoom):
+    """Download the encoded bytes of the tile at the specified coords and
+    zoom level, bypassing the cache.
+
+    :return: The raw (e.g. PNG) bytes of the tile.
+    """
+    return tile_fetcher.fetch(tile_source, x, y, zoom)
+
+def get_tile(tile_source, x, y, zoom, cache=None):
     """Attempt to fetch the tile at the specified coords and zoom level.
 
     :param x: X coord of the tile; must be between 0 (inclusive) and
@@ -31,52 +54,102 @@ def get_tile(tile_source, x, y, zoom):
     :param y: Y coord of the tile.
     :param zoom: Integer, greater than or equal to 0.  19 is the commonly
       supported maximum zoom.
+    :param cache: The :class:`tilecache.TileCache` to look the tile up in,
+      defaults to the module level `tile_cache`.
 
-    :return: `None` for (cache related) failure, or a :package:`Pillow`
-      image object of the tile.
+    :return: The tile as a read-only `(256, 256, 3)` RGB `uint8` array.
     """
-    url = tile_source.format(x=x, y=y, z=zoom)
-    response = _requests.get(url)
-    if not response.ok:
-        raise IOError("Failed to download {}.  Got {}".format(url, response))
-        return None
-    try:
-        fp = _io.BytesIO(response.content)
-        return _Image.open(fp)
-    except:
-        raise RuntimeError("Failed to decode data for {} - {}x{} @ {} zoom".format(tile_source, x, y, zoom))
-        return None
+    if cache is None:
+        cache = tile_cache
+    return cache.get(tile_source, x, y, zoom, fetch_tile)
+
+
+def _shrink(tile, factor):
+    """Downsample a tile by an integer factor, averaging blocks of pixels.
+
+    The blocks are summed in integers, one axis at a time, and rounded by
+    integer division, which is several times faster than a float mean."""
+    h, w = tile.shape[0] // factor, tile.shape[1] // factor
+    n = factor * factor
+    dtype = np.uint16 if n <= 256 else np.uint32
+    rows = tile[:h * factor, :w * factor].reshape(h, factor, w * factor, -1).sum(axis=1, dtype=dtype)
+    blocks = rows.reshape(h, w, factor, -1).sum(axis=2, dtype=dtype)
+    return ((blocks + n // 2) // n).astype(np.uint8)
 
+def as_one_image(tile_source, xtilemax, xtilemin, ytilemax, ytilemin, zoom, max_pixels=None, downsample=False, timings=None):
+    """Stitch the tiles in the inclusive index ranges into one read-only
+    `(height, width, 3)` RGB `uint8` array.
 
-def as_one_image(tile_source, xtilemax, xtilemin, ytilemax, ytilemin, zoom):
+    Each decoded tile is copied once, straight into its slice of the
+    preallocated mosaic.  Mosaics are kept in `mosaic_cache`.  The same range
+    is returned straight from it, and when a cached mosaic overlaps the
+    range its shared tiles are copied across, so only the missing rows and
+    columns are fetched.
+
+    :param max_pixels: Pixel budget of the mosaic, defaults to
+      `MAX_MOSAIC_PIXELS`.
+    :param downsample: If the full resolution mosaic is over budget, shrink
+      the tiles by the smallest power of 2 that fits instead of raising
+      `RuntimeError`.
+    :param timings: Optional dict.  Seconds spent waiting on tiles (from the
+      caches or the network) are added to its `'fetch'` entry, and seconds
+      spent assembling the mosaic to its `'stitch'` entry.
+    """
+    start = time.perf_counter()
+    stitching = 0.0
+    if max_pixels is None:
+        max_pixels = MAX_MOSAIC_PIXELS
+    nx = xtilemax + 1 - xtilemin
+    ny = ytilemax + 1 - ytilemin
     size = 256
-    xs = size * (xtilemax + 1 - xtilemin)
-    ys = size * (ytilemax + 1 - ytilemin)
-    out = _Image.new("RGB", (xs, ys))
-    #print(range(xtilemin, xtilemax + 1))
-    #print(range(ytilemin, ytilemax + 1))
-    if (xtilemax+1-xtilemin)*(ytilemax+1-ytilemin) > 200:
-        raise RuntimeError("Too many tiles")
-    for x in range(xtilemin, xtilemax + 1):
-        for y in range(ytilemin, ytilemax + 1):
-            #check cache:
-            if (x,y,zoom) in tile_cache[tile_source]:
-                tile =  tile_cache[tile_source][(x,y,zoom)]
-            else:
-                tile = get_tile(tile_source, x, y, zoom)
-                tile_cache[tile_source][(x,y,zoom)] = tile
-            xo = (x - xtilemin) * size
-            yo = (y - ytilemin) * size
-            out.paste(tile, (xo, yo))
+    while nx * ny * size * size > max_pixels:
+        if not downsample or size == 1:
+            raise RuntimeError("Too many tiles: {} tiles of {}px is over the budget of {} pixels".format(nx * ny, size, max_pixels))
+        size //= 2
+    tile_box = (xtilemin, xtilemax, ytilemin, ytilemax)
+    mosaic = mosaic_cache.get(tile_source, zoom, tile_box, size)
+    if mosaic is not None:
+        _add_timings(timings, stitch=time.perf_counter() - start)
+        return mosaic
+    t = time.perf_counter()
+    out = np.zeros((ny * size, nx * size, 3), dtype=np.uint8)
+    tiles = [(x, y) for x in range(xtilemin, xtilemax + 1) for y in range(ytilemin, ytilemax + 1)]
+    reuse = mosaic_cache.best_overlap(tile_source, zoom, tile_box, size)
+    if reuse is not None:
+        cached_box, (oxmin, oxmax, oymin, oymax), cached = reuse
+        out[(oymin - ytilemin) * size:(oymax + 1 - ytilemin) * size,
+            (oxmin - xtilemin) * size:(oxmax + 1 - xtilemin) * size] = \
+            cached[(oymin - cached_box[2]) * size:(oymax + 1 - cached_box[2]) * size,
+                   (oxmin - cached_box[0]) * size:(oxmax + 1 - cached_box[0]) * size]
+        tiles = [(x, y) for x, y in tiles if not (oxmin <= x <= oxmax and oymin <= y <= oymax)]
+    stitching += time.perf_counter() - t
+    # Tiles are fetched concurrently and copied in the order they arrive
+    for (x, y), tile in tile_fetcher.get_tiles(tile_source, tiles, zoom, get_tile):
+        t = time.perf_counter()
+        if tile.shape[0] != size:
+            tile = _shrink(tile, tile.shape[0] // size)
+        xo = (x - xtilemin) * size
+        yo = (y - ytilemin) * size
+        out[yo:yo + size, xo:xo + size] = tile
+        stitching += time.perf_counter() - t
+    out.flags.writeable = False
+    mosaic_cache.put(tile_source, zoom, tile_box, out, size)
+    _add_timings(timings, fetch=time.perf_counter() - start - stitching, stitch=stitching)
     return out
 
-def getTile(extent, tile_source, zoom=12):
+def _add_timings(timings, **seconds):
+    if timings is not None:
+        for stage, secs in seconds.items():
+            timings[stage] = timings.get(stage, 0.0) + secs
+
+def getTile(extent, tile_source, zoom=12, max_pixels=None, downsample=False):
     """ 
     Constructs the best available image covering the extent 
-    at the specified zoom level. 
+    at the specified zoom level, as an RGB uint8 array. 
     
     The tile may be larger than the extent requested, but is 
-    guaranteed to cover the entire extent.
+    guaranteed to cover the entire extent. See :func:`as_one_image`
+    for `max_pixels` and `downsample`.
     """   
     
     ## Handle Extent
@@ -93,15 +166,12 @@ def getTile(extent, tile_source, zoom=12):
         print("Unrecognized Extent Type")
         return None
     
-    xtilemax = int(2 ** zoom * extent.xmax)
-    xtilemin = int(2 ** zoom * extent.xmin)
-    ytilemin = int(2 ** zoom * extent.ymin)
-    ytilemax = int(2 ** zoom * extent.ymax)
+    xtilemin, xtilemax, ytilemin, ytilemax = extent.tile_range(zoom)
     
-    tile = as_one_image(tile_source, xtilemax, xtilemin, ytilemax, ytilemin, zoom)
+    tile = as_one_image(tile_source, xtilemax, xtilemin, ytilemax, ytilemin, zoom, max_pixels, downsample)
     return tile   
     
-def plotMap(extent, tile_source, figure=None, zoom=None, auto_render=False, hide_axis=True):
+def plotMap(extent, tile_source, figure=None, zoom=None, auto_render=False, hide_axis=True, max_pixels=None, downsample=False):
     """ 
     extent is in lon_lat format
     """
@@ -113,12 +183,9 @@ def plotMap(extent, tile_source, figure=None, zoom=None, auto_render=False, hide
         zoom = calculate_optimal_zoom(extent, figure)
         #print("Zoom is: ", zoom)
 
-    xtilemax = int(2 ** zoom * extent.xmax)
-    xtilemin = int(2 ** zoom * extent.xmin)
-    ytilemin = int(2 ** zoom * extent.ymin)
-    ytilemax = int(2 ** zoom * extent.ymax)
+    xtilemin, xtilemax, ytilemin, ytilemax = extent.tile_range(zoom)
     
-    tile = getTile(extent, tile_source, zoom)
+    tile = getTile(extent, tile_source, zoom, max_pixels, downsample)
 
     if tile is not None:
         scale = float(2 ** zoom)
@@ -155,12 +222,71 @@ def button_press_callback(event, figure, tile_source):
     myExtent = extent(ax)
     plotMap(myExtent, tile_source)
         
+def decimate(longitudes, latitudes, max_points):
+    """Level of detail downsampling of a trace for plotting.
+
+    The trace is cut into runs of consecutive points and each run keeps its
+    first and last points and those with the smallest and largest longitude
+    and latitude, in their original order.  This is min/max per pixel
+    column, applied along the path in both axes, so the drawn line keeps its
+    outline and every excursion.  Projection to web mercator preserves the
+    extremes, so it can be done after decimating.
+
+    :param max_points: Rough upper bound on the points kept.
+
+    :return: The indices of the kept points, increasing.
+    """
+    n = len(longitudes)
+    if n <= max_points:
+        return np.arange(n)
+    n_runs = max(max_points // 6, 1)
+    run = -(-n // n_runs)
+    full = n // run
+    keep = [np.arange(0, n, run), np.arange(run - 1, full * run, run), [n - 1]]
+    if full:
+        offsets = np.arange(full) * run
+        for values in (longitudes, latitudes):
+            # The runs are rows of a view, so the reductions need no copies
+            runs = values[:full * run].reshape(full, run)
+            keep.append(offsets + np.argmin(runs, axis=1))
+            keep.append(offsets + np.argmax(runs, axis=1))
+    if full * run < n:
+        for values in (longitudes, latitudes):
+            tail = values[full * run:]
+            keep.append([full * run + np.argmin(tail), full * run + np.argmax(tail)])
+    return np.unique(np.concatenate([np.asarray(k, dtype=np.int64) for k in keep]))
+
 def plot(longitudes, latitudes, *args, **kwargs):
-    if isinstance(longitudes, Iterable) and isinstance(latitudes, Iterable):
-        xpts, ypts = zip(*map(to_web_mercator, longitudes, latitudes))
+    """Plot a trajectory in web mercator coordinates with `plt.plot`.
+
+    :param longitudes:
+    :param latitudes: Arrays, pandas Series, or lists of these (one per
+      trace).  Several traces are drawn as one line broken by NaNs, which
+      matplotlib handles far faster than many lines.
+    :param max_points: Keyword only.  Traces longer than this are thinned
+      with :func:`decimate` before projecting, defaults to `MAX_PLOT_POINTS`.
+      `None` plots every point.
+
+    An empty list of traces draws an empty line.  Other arguments are passed to `plt.plot`, whose lines are returned.
+    """
+    max_points = kwargs.pop('max_points', MAX_PLOT_POINTS)
+    traces = _as_traces(longitudes, latitudes)
+    if not traces:
+        return plt.plot([], [], *args, **kwargs)
+    if max_points is not None:
+        budget = max(max_points // len(traces), 1)
+        for i, (lon, lat) in enumerate(traces):
+            if len(lon) > budget:
+                keep = decimate(lon, lat, budget)
+                traces[i] = lon[keep], lat[keep]
+    if len(traces) == 1:
+        lon, lat = traces[0]
     else:
-        xpts, ypts = to_web_mercator(longitudes, latitudes)
-    plt.plot(xpts, ypts, *args, **kwargs)
+        gap = [np.nan]
+        lon = np.concatenate([part for trace, _ in traces for part in (trace, gap)][:-1])
+        lat = np.concatenate([part for _, trace in traces for part in (trace, gap)][:-1])
+    xpts, ypts = to_web_mercator_np(lon, lat)
+    return plt.plot(xpts, ypts, *args, **kwargs)
     
 def extent(ax=None):
     if ax is None:
@@ -170,25 +296,8 @@ def extent(ax=None):
     return Extent(axis[0],axis[1], axis[3], axis[2])
 
 def calculate_optimal_zoom(myExtent, figure):
-    lle = myExtent.get_lonlat_extent()
-    
-    ry1 = np.log( (np.sin(np.deg2rad(lle[2]))+1) / np.cos(np.deg2rad(lle[2])) )
-    ry2 = np.log( (np.sin(np.deg2rad(lle[3]))+1) / np.cos(np.deg2rad(lle[3])) )
-    ryc = (ry1+ry2) / 2
-    centerY = np.rad2deg(np.arctan(np.sinh(ryc)))
-
+    """The zoom level whose tiles best match the resolution of `figure`
+    showing `myExtent`.  See :func:`mapping.optimal_zoom`, which needs no
+    figure and works on many extents at once."""
     width, height = figure.get_size_inches() * figure.dpi
-    resolutionHorizontal = (lle[1]-lle[0]) / width
-    vy0 = np.log(np.tan(np.pi * (0.25 + centerY/360.)))
-    vy1 = np.log(np.tan(np.pi * (0.25 + lle[3]/360.)))
-
-    viewHeightHalf = height/2.0
-    zoomFactorPowered = viewHeightHalf / (40.7436654315252*(vy1 - vy0))
-    resolutionVertical = 360.0 / (zoomFactorPowered * 256)
-
-    resolution = max(resolutionHorizontal, resolutionVertical)
-    
-    zoom = np.round(np.log2(360 / (resolution * 256)))
-    return int(zoom)-1
-
-
+    return optimal_zoom(myExtent, width, height)
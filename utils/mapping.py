@@ -72,6 +72,110 @@ def to_lonlat(x, y):
     latitude = _math.atan(_math.sinh(_math.pi * (1 - y * 2))) * 180 / _math.pi
     return (longitude, latitude)
 
+def _to_3857_np(x, y, out=None):
+    """Vectorised :func:`_to_3857`.
+
+    :param out: Optional float array of shape `(2,) + shape` to write the
+      result into.
+
+    :return: Arrays `(x, y)` in EPSG:3857 metres, views of `out` if given.
+    """
+    x, y, out = _prepare_np(x, y, out)
+    xx, yy = out[0, ...], out[1, ...]
+    np.subtract(x, 0.5, out=xx)
+    np.multiply(xx, 2 * _EPSG_RESCALE, out=xx)
+    np.subtract(0.5, y, out=yy)
+    np.multiply(yy, 2 * _EPSG_RESCALE, out=yy)
+    return xx, yy
+
+def _from_3857_np(x, y, out=None):
+    """Vectorised :func:`_from_3857`.  See :func:`_to_3857_np` for `out`."""
+    x, y, out = _prepare_np(x, y, out)
+    xx, yy = out[0, ...], out[1, ...]
+    np.multiply(x, 0.5 / _EPSG_RESCALE, out=xx)
+    np.add(xx, 0.5, out=xx)
+    np.multiply(y, -0.5 / _EPSG_RESCALE, out=yy)
+    np.add(yy, 0.5, out=yy)
+    return xx, yy
+
+def to_web_mercator_np(longitude, latitude, out=None):
+    """Vectorised :func:`to_web_mercator` for arrays of coordinates.
+
+    :param longitude: Array-like, in degrees, between -180 and 180
+    :param latitude: Array-like, in degrees, between -85 and 85
+    :param out: Optional float array of shape `(2,) + shape` to write the
+      result into, e.g. to reuse one buffer across many trajectories.
+
+    :return: Arrays `(x, y)` in the "Web Mercator" projection, normalised to
+      be in the range [0,1].  These are views of `out` if it was given.
+    """
+    longitude, latitude, out = _prepare_np(longitude, latitude, out)
+    x, y = out[0, ...], out[1, ...]
+    np.add(longitude, 180.0, out=x)
+    np.divide(x, 360.0, out=x)
+    # log(tan(lat) + sec(lat)) == arcsinh(tan(lat)), with one fewer temporary
+    np.radians(latitude, out=y)
+    np.tan(y, out=y)
+    np.arcsinh(y, out=y)
+    np.multiply(y, -0.5 / _math.pi, out=y)
+    np.add(y, 0.5, out=y)
+    return x, y
+
+def to_lonlat_np(x, y, out=None):
+    """Vectorised :func:`to_lonlat`, the inverse of
+    :func:`to_web_mercator_np`.
+
+    :param x: Array-like x coordinates, between 0 and 1.
+    :param y: Array-like y coordinates, between 0 and 1.
+    :param out: Optional float array of shape `(2,) + shape` to write the
+      result into.
+
+    :return: Arrays `(longitude, latitude)` in degrees.
+    """
+    x, y, out = _prepare_np(x, y, out)
+    longitude, latitude = out[0, ...], out[1, ...]
+    np.multiply(x, 360.0, out=longitude)
+    np.subtract(longitude, 180.0, out=longitude)
+    np.multiply(y, -2.0 * _math.pi, out=latitude)
+    np.add(latitude, _math.pi, out=latitude)
+    np.sinh(latitude, out=latitude)
+    np.arctan(latitude, out=latitude)
+    np.degrees(latitude, out=latitude)
+    return longitude, latitude
+
+def _prepare_np(a, b, out):
+    """Internal helper method.  Coerce a pair of coordinate arrays and
+    allocate (or check) the `(2,) + shape` output buffer."""
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    shape = np.broadcast(a, b).shape
+    if out is None:
+        out = np.empty((2,) + shape)
+    elif out.shape != (2,) + shape:
+        raise ValueError("out must have shape {}, got {}".format((2,) + shape, out.shape))
+    return a, b, out
+
+def _as_traces(longitudes, latitudes):
+    """Internal helper method.  Coerce one trace (arrays, pandas Series,
+    lists of numbers) or a list of traces of any lengths to a list of pairs of
+    float arrays, without copying float64 arrays."""
+    def is_trace_list(a):
+        return isinstance(a, (list, tuple)) and len(a) > 0 and np.ndim(a[0]) > 0
+    if is_trace_list(longitudes) and is_trace_list(latitudes):
+        if len(longitudes) != len(latitudes):
+            raise ValueError("Got {} longitude traces but {} latitude traces".format(len(longitudes), len(latitudes)))
+        pairs = zip(longitudes, latitudes)
+    else:
+        pairs = [(longitudes, latitudes)]
+    traces = []
+    for lon, lat in pairs:
+        lon = np.asarray(lon, dtype=float).ravel()
+        lat = np.asarray(lat, dtype=float).ravel()
+        if lon.shape != lat.shape:
+            raise ValueError("longitudes and latitudes must have the same length")
+        traces.append((lon, lat))
+    return traces
+
 class _BaseExtent(object):
     """A simple "rectangular region" class."""
     def __init__(self, xmin, xmax, ymin, ymax):
@@ -245,11 +349,33 @@ class Extent(_BaseExtent):
     
     @staticmethod
     def from_trajectory(longitudes, latitudes):
-        coordinates_web_mercator = np.array(list(map(to_web_mercator, longitudes, latitudes)))
-        xmin, ymin = np.min(coordinates_web_mercator, axis=0)
-        xmax, ymax = np.max(coordinates_web_mercator, axis=0)
+        """Construct the smallest instance containing every point of the
+        trajectory.
+
+        :param longitudes:
+        :param latitudes: Arrays, pandas Series, or lists of these (one per
+          trace) of any lengths.  NaNs are ignored.
+        """
+        # The projection is monotonic in each coordinate, so only the
+        # extremes need projecting
+        bounds = np.array([(np.nanmin(lon), np.nanmax(lon), np.nanmin(lat), np.nanmax(lat))
+                           for lon, lat in _as_traces(longitudes, latitudes) if lon.size])
+        if not len(bounds):
+            raise ValueError("Cannot take the extent of an empty trajectory")
+        (xmin, xmax), (ymax, ymin) = to_web_mercator_np([bounds[:, 0].min(), bounds[:, 1].max()],
+                                                        [bounds[:, 2].min(), bounds[:, 3].max()])
         return Extent(xmin, xmax, ymin, ymax)
 
+    def tile_range(self, zoom):
+        """The inclusive index ranges of the tiles covering the rectangle at
+        this zoom level.
+
+        :return: `(xtilemin, xtilemax, ytilemin, ytilemax)`
+        """
+        scale = 2 ** zoom
+        return (int(_math.floor(scale * self._xmin)), int(_math.floor(scale * self._xmax)),
+                int(_math.floor(scale * self._ymin)), int(_math.floor(scale * self._ymax)))
+
     def get_lonlat_extent(self):
         min_lon, max_lat = to_lonlat(self._xmin, self._ymin)
         max_lon, min_lat = to_lonlat(self._xmax, self._ymax)
@@ -377,3 +503,319 @@ class Extent(_BaseExtent):
         return Extent(output[0],output[1],output[2],output[3], self._project_str)
     
 
+
+class ExtentArray(object):
+    """Many :class:`Extent` rectangles at once, stored as columns of
+    `xmin`, `xmax`, `ymin` and `ymax` in the unit square.  Every operation is
+    vectorised over the rectangles and mirrors the :class:`Extent` method of
+    the same name.
+
+    Indexing with an integer gives an :class:`Extent`; with a slice, mask or
+    index array, another :class:`ExtentArray`.
+
+    :param xmin:
+    :param xmax:
+    :param ymin:
+    :param ymax: Arrays (or scalars, broadcast) of the ranges in web mercator.
+    :param projection_type: As for :class:`Extent`; applies to all of them.
+    """
+    def __init__(self, xmin, xmax, ymin, ymax, projection_type="normal"):
+        xmin, xmax, ymin, ymax = np.broadcast_arrays(*(np.atleast_1d(np.asarray(a, dtype=float))
+                                                     for a in (xmin, xmax, ymin, ymax)))
+        if xmin.ndim != 1:
+            raise ValueError("Need one dimensional arrays of bounds.")
+        if not np.all(xmin < xmax):
+            raise ValueError("xmin < xmax.")
+        if not np.all(ymin < ymax):
+            raise ValueError("ymin < ymax.")
+        if np.any(ymin < 0) or np.any(ymax > 1):
+            raise ValueError("Need 0 < ymin < ymax < 1.")
+        self._xmin, self._xmax, self._ymin, self._ymax = xmin, xmax, ymin, ymax
+        if projection_type == "normal":
+            self.project = self._normal_project
+        elif projection_type == "epsg:3857":
+            self.project = self._3857_project
+        else:
+            raise ValueError()
+        self._project_str = projection_type
+
+    @staticmethod
+    def from_extents(extents):
+        """Construct a new instance from a sequence of :class:`Extent`, which
+        must share one projection."""
+        extents = list(extents)
+        projections = set(e._project_str for e in extents)
+        if len(projections) > 1:
+            raise ValueError("Extents are projected differently: {}".format(sorted(projections)))
+        bounds = np.array([(e._xmin, e._xmax, e._ymin, e._ymax) for e in extents], dtype=float).reshape(-1, 4)
+        return ExtentArray(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3],
+                           projections.pop() if projections else "normal")
+
+    @staticmethod
+    def from_lonlat(longitude_min, longitude_max, latitude_min, latitude_max):
+        """Construct a new instance from arrays of longitude/latitude bounds."""
+        xmin, ymax = to_web_mercator_np(longitude_min, latitude_min)
+        xmax, ymin = to_web_mercator_np(longitude_max, latitude_max)
+        return ExtentArray(xmin, xmax, ymin, ymax)
+
+    @staticmethod
+    def from_3857(xmin, xmax, ymin, ymax):
+        """Construct a new instance from arrays of EPSG:3857 bounds."""
+        xmin, ymin = _from_3857_np(xmin, ymin)
+        xmax, ymax = _from_3857_np(xmax, ymax)
+        return ExtentArray(xmin, xmax, ymin, ymax).to_project_3857()
+
+    @staticmethod
+    def from_trajectories(longitudes, latitudes, groups=None):
+        """Construct the smallest rectangle around each of many trajectories.
+
+        :param longitudes:
+        :param latitudes: A list of traces, one per rectangle, as for
+          :meth:`Extent.from_trajectory`.  Or, with `groups`, flat arrays of
+          the points of every trajectory.
+        :param groups: Optional array of trajectory labels, one per point.
+          The rectangles are then in the order of `np.unique(groups)`.
+        """
+        if groups is None:
+            bounds = np.array([(np.nanmin(lon), np.nanmax(lon), np.nanmin(lat), np.nanmax(lat))
+                               for lon, lat in _as_traces(longitudes, latitudes)]).reshape(-1, 4)
+            return ExtentArray.from_lonlat(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3])
+        lon = np.asarray(longitudes, dtype=float).ravel()
+        lat = np.asarray(latitudes, dtype=float).ravel()
+        _, inverse = np.unique(np.asarray(groups).ravel(), return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+        lon, lat = lon[order], lat[order]
+        # fmin / fmax skip NaNs
+        return ExtentArray.from_lonlat(np.fmin.reduceat(lon, starts), np.fmax.reduceat(lon, starts),
+                                       np.fmin.reduceat(lat, starts), np.fmax.reduceat(lat, starts))
+
+    def __len__(self):
+        return len(self._xmin)
+
+    def __getitem__(self, index):
+        if np.ndim(index) == 0 and not isinstance(index, slice):
+            return Extent(float(self._xmin[index]), float(self._xmax[index]),
+                          float(self._ymin[index]), float(self._ymax[index]), self._project_str)
+        return ExtentArray(self._xmin[index], self._xmax[index], self._ymin[index], self._ymax[index],
+                           self._project_str)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_extents(self):
+        """A list of :class:`Extent`, one per rectangle."""
+        return list(self)
+
+    def __repr__(self):
+        return "ExtentArray({} extents projected as {})".format(len(self), self._project_str)
+
+    def clone(self, projection_type=None):
+        """A copy."""
+        if projection_type is None:
+            projection_type = self._project_str
+        return ExtentArray(self._xmin.copy(), self._xmax.copy(), self._ymin.copy(), self._ymax.copy(),
+                           projection_type)
+
+    def _normal_project(self, x, y):
+        return x, y
+
+    def _3857_project(self, x, y):
+        return _to_3857(x, y)
+
+    def to_project_3857(self):
+        """Change the coordinate system to conform to EPSG:3857 / EPSG:3785."""
+        return self.clone("epsg:3857")
+
+    def to_project_web_mercator(self):
+        """Change the coordinate system back to the default, the unit square."""
+        return self.clone("normal")
+
+    @property
+    def xmin(self):
+        """Array of the minimum x values."""
+        return self.project(self._xmin, self._ymin)[0]
+
+    @property
+    def xmax(self):
+        """Array of the maximum x values."""
+        return self.project(self._xmax, self._ymax)[0]
+
+    @property
+    def ymin(self):
+        """Array of the minimum y values."""
+        return self.project(self._xmin, self._ymin)[1]
+
+    @property
+    def ymax(self):
+        """Array of the maximum y values."""
+        return self.project(self._xmax, self._ymax)[1]
+
+    @property
+    def width(self):
+        """Array of the widths."""
+        return self.xmax - self.xmin
+
+    @property
+    def height(self):
+        """Array of the heights."""
+        return self.ymax - self.ymin
+
+    @property
+    def xrange(self):
+        """A pair of arrays (xmin, xmax)."""
+        return (self.xmin, self.xmax)
+
+    @property
+    def yrange(self):
+        """A pair of arrays (ymax, ymin).  Inverted as for :class:`Extent`."""
+        return (self.ymax, self.ymin)
+
+    def get_lonlat_extent(self):
+        """Arrays `(min_lon, max_lon, min_lat, max_lat)`."""
+        min_lon, max_lat = to_lonlat_np(self._xmin, self._ymin)
+        max_lon, min_lat = to_lonlat_np(self._xmax, self._ymax)
+        return (min_lon, max_lon, min_lat, max_lat)
+
+    def _new(self, xmin, xmax, ymin, ymax):
+        return ExtentArray(xmin, xmax, ymin, ymax, self._project_str)
+
+    def to_square(self):
+        """Grow the shorter side of each rectangle to make it square."""
+        x_margin = np.maximum((self._ymax - self._ymin) - (self._xmax - self._xmin), 0) / 2.
+        y_margin = np.maximum((self._xmax - self._xmin) - (self._ymax - self._ymin), 0) / 2.
+        return self._new(self._xmin - x_margin, self._xmax + x_margin,
+                         self._ymin - y_margin, self._ymax + y_margin)
+
+    def to_aspect(self, aspect):
+        """Return new rectangles with the given aspect ratio (scalar or one
+        per rectangle).  Shrinks them as necessary."""
+        aspect = np.asarray(aspect, dtype=float)
+        width = self._xmax - self._xmin
+        height = self._ymax - self._ymin
+        too_wide = height * aspect > width
+        new_xrange = np.where(too_wide, width, height * aspect)
+        new_yrange = np.where(too_wide, width / aspect, height)
+        midx = (self._xmin + self._xmax) / 2
+        midy = (self._ymin + self._ymax) / 2
+        return self._new(midx - new_xrange / 2, midx + new_xrange / 2,
+                         midy - new_yrange / 2, midy + new_yrange / 2)
+
+    def with_scaling(self, scale):
+        """Return new rectangles with the same midpoints, but with the width/
+        height divided by `scale` (scalar or one per rectangle)."""
+        midx = (self._xmin + self._xmax) / 2
+        midy = (self._ymin + self._ymax) / 2
+        xs = (self._xmax - self._xmin) / scale / 2
+        ys = (self._ymax - self._ymin) / scale / 2
+        return self._new(midx - xs, midx + xs, midy - ys, midy + ys)
+
+    def with_absolute_translation(self, dx, dy):
+        """Return new rectangles translated by these amounts (on the 0 to 1
+        scale).  Clips `y` to the allowed region of [0,1]."""
+        ymin, ymax = self._ymin + dy, self._ymax + dy
+        ymax = ymax - np.minimum(ymin, 0)
+        ymin = np.maximum(ymin, 0)
+        ymin = ymin - np.maximum(ymax - 1, 0)
+        ymax = np.minimum(ymax, 1)
+        return self._new(self._xmin + dx, self._xmax + dx, ymin, ymax)
+
+    def with_translation(self, dx, dy):
+        """Return new rectangles translated by these amounts relative to their
+        sizes, so `dx==1` means translate one whole rectangle to the right."""
+        return self.with_absolute_translation(dx * (self._xmax - self._xmin), dy * (self._ymax - self._ymin))
+
+    def with_margin_km(self, margin):
+        """Return new rectangles with an additional margin in km (scalar or
+        one per rectangle)."""
+        longitude_min, longitude_max, latitude_min, latitude_max = self.get_lonlat_extent()
+        new_longitude_min, new_latitude_min = translate_lonlat(longitude_min, latitude_min, -1 * np.asarray(margin))
+        new_longitude_max, new_latitude_max = translate_lonlat(longitude_max, latitude_max, margin)
+        return ExtentArray.from_lonlat(new_longitude_min, new_longitude_max, new_latitude_min, new_latitude_max)
+
+    def tile_ranges(self, zoom):
+        """The inclusive index ranges of the tiles covering each rectangle.
+
+        :param zoom: Integer zoom level, scalar or one per rectangle.
+
+        :return: Integer arrays `(xtilemin, xtilemax, ytilemin, ytilemax)`.
+        """
+        scale = 2.0 ** np.asarray(zoom)
+        return (np.floor(scale * self._xmin).astype(np.int64), np.floor(scale * self._xmax).astype(np.int64),
+                np.floor(scale * self._ymin).astype(np.int64), np.floor(scale * self._ymax).astype(np.int64))
+
+
+def optimal_zoom(extents, width, height):
+    """The zoom level whose tiles best match the resolution of an image of
+    `width` x `height` pixels showing each extent.  The same rule as
+    :func:`geoplot.calculate_optimal_zoom`, without a figure.
+
+    :param extents: An :class:`Extent` or an :class:`ExtentArray`.
+    :param width:
+    :param height: Image size in pixels, scalars or one per extent.
+
+    :return: An int for an :class:`Extent`, else an integer array.
+    """
+    min_lon, max_lon, min_lat, max_lat = (np.asarray(a, dtype=float) for a in extents.get_lonlat_extent())
+    # Mercator y, in radians, of the vertical centre of the extent
+    ry1 = np.log((np.sin(np.deg2rad(min_lat)) + 1) / np.cos(np.deg2rad(min_lat)))
+    ry2 = np.log((np.sin(np.deg2rad(max_lat)) + 1) / np.cos(np.deg2rad(max_lat)))
+    center_lat = np.rad2deg(np.arctan(np.sinh((ry1 + ry2) / 2)))
+
+    resolution_horizontal = (max_lon - min_lon) / np.asarray(width, dtype=float)
+    vy0 = np.log(np.tan(np.pi * (0.25 + center_lat / 360.)))
+    vy1 = np.log(np.tan(np.pi * (0.25 + max_lat / 360.)))
+    zoom_factor_powered = (np.asarray(height, dtype=float) / 2.0) / (40.7436654315252 * (vy1 - vy0))
+    resolution_vertical = 360.0 / (zoom_factor_powered * 256)
+
+    resolution = np.maximum(resolution_horizontal, resolution_vertical)
+    zoom = np.round(np.log2(360 / (resolution * 256))).astype(np.int64) - 1
+    return int(zoom) if isinstance(extents, Extent) else zoom
+
+def tiles_in_ranges(zoom, xtilemin, xtilemax, ytilemin, ytilemax):
+    """Every distinct tile in a batch of inclusive index ranges, so each is
+    fetched once however many ranges share it.  The x index wraps around
+    the antimeridian and y is clipped to the map.
+
+    :param zoom: Zoom level, scalar or one per range.
+
+    :return: An `(N, 3)` integer array of `(zoom, x, y)`, sorted.
+    """
+    zoom, xmin, xmax, ymin, ymax = (np.atleast_1d(a).astype(np.int64) for a in
+                                    np.broadcast_arrays(zoom, xtilemin, xtilemax, ytilemin, ytilemax))
+    n = np.int64(1) << zoom
+    ymin, ymax = np.clip(ymin, 0, n - 1), np.clip(ymax, 0, n - 1)
+    xmax = np.minimum(xmax, xmin + n - 1)
+    width = np.maximum(xmax + 1 - xmin, 0)
+    counts = width * np.maximum(ymax + 1 - ymin, 0)
+    first = np.cumsum(counts) - counts
+    within = np.arange(counts.sum()) - np.repeat(first, counts)
+    width = np.repeat(width, counts)
+    n = np.repeat(n, counts)
+    zoom = np.repeat(zoom, counts)
+    x = (np.repeat(xmin, counts) + within % width) % n
+    y = np.repeat(ymin, counts) + within // width
+    # One int64 key per tile: zoom in the top bits, then x and y
+    keys = np.unique((zoom << 58) | (x << 29) | y)
+    mask = (np.int64(1) << 29) - 1
+    return np.stack([keys >> 58, (keys >> 29) & mask, keys & mask], axis=1)
+
+def tile_cover(extents, width, height, zoom=None):
+    """Zoom levels, tile ranges and the distinct tiles needed to draw many
+    extents as `width` x `height` pixel images, in one vectorised pass.
+
+    :param extents: An :class:`ExtentArray`, or a sequence of :class:`Extent`.
+    :param zoom: Fixed zoom level(s), or `None` for :func:`optimal_zoom`.
+
+    :return: `(zoom, (xtilemin, xtilemax, ytilemin, ytilemax), tiles)` where
+      the first two hold one entry per extent and `tiles` is the
+      `(N, 3)` array of distinct `(zoom, x, y)` from :func:`tiles_in_ranges`.
+    """
+    if not isinstance(extents, ExtentArray):
+        extents = ExtentArray.from_extents(extents)
+    if zoom is None:
+        zoom = optimal_zoom(extents, width, height)
+    zoom = np.broadcast_to(np.asarray(zoom, dtype=np.int64), (len(extents),))
+    ranges = extents.tile_ranges(zoom)
+    return zoom, ranges, tiles_in_ranges(zoom, *ranges)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+quantilesketch
+~~~~~~~~~~~~~~
+
+A mergeable streaming quantile sketch (KLL, Karnin, Lang & Liberty 2016)
+for data too large, or too unbounded, to sort.
+
+A :class:`KLLSketch` keeps a few thousand items of the data, stored at
+levels where an item at level `h` stands for `2 ** h` inputs.  When the
+sketch outgrows its budget, a level is sorted and every other item (from a
+random offset) moves up a level.  Ranks and quantiles are then accurate to
+about `1.7 / k` of `n`, with `k = 200` by default, whatever the size of the
+input.
+
+Sketches are fed whole batches (:meth:`KLLSketch.update` is vectorised),
+merge with each other, so :mod:`PARTools` workers can each sketch part of the
+data (see :func:`sketch_batches`), and serialize to a few kB with
+:meth:`KLLSketch.to_bytes`.  :func:`common.cdfPlot` plots them directly.
+"""
+from __future__ import print_function, absolute_import
+import io as _io
+import numpy as np
+from .PARTools import gparallel_stream
+
+
+class KLLSketch(object):
+    """Approximate ranks and quantiles of a stream of numbers.
+
+    :param k: Size of the top level; the rank error is about `1.7 / k` and
+      the sketch holds about `3 k` items.
+    :param seed: Seed of the random compaction offsets.
+
+    :ivar n: Number of (non NaN) values seen; NaNs are counted in `n_nan`.
+    :ivar min: Exact smallest value seen.
+    :ivar max: Exact largest value seen.
+    """
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.n_nan = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._random = np.random.RandomState(seed)
+        self._sorted = None
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return 'KLLSketch(k={}, n={}, items={})'.format(self.k, self.n, self.size)
+
+    @property
+    def size(self):
+        """Number of items held."""
+        return sum(len(level) for level in self.levels)
+
+    def _capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3.) ** (len(self.levels) - 1 - h))))
+
+    def _compress(self):
+        while self.size > sum(self._capacity(h) for h in range(len(self.levels))):
+            h = next(h for h in range(len(self.levels)) if len(self.levels[h]) > self._capacity(h))
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            level = np.sort(self.levels[h])
+            # An odd item out stays behind, so the total weight is unchanged
+            odd = len(level) % 2
+            self.levels[h] = level[:odd]
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], level[odd + self._random.randint(2)::2]])
+        self._sorted = None
+
+    def update(self, values):
+        """Add a batch of values (any array-like, or one number).
+
+        :return: The sketch.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        nan = np.isnan(values)
+        if nan.any():
+            self.n_nan += int(nan.sum())
+            values = values[~nan]
+        if not len(values):
+            return self
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add the data summarised by another sketch to this one.
+
+        :return: The sketch.
+        """
+        self.k = min(self.k, other.k)
+        self.n += other.n
+        self.n_nan += other.n_nan
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self._compress()
+        return self
+
+    def copy(self):
+        other = KLLSketch(self.k)
+        other.n, other.n_nan, other.min, other.max = self.n, self.n_nan, self.min, self.max
+        other.levels = [level.copy() for level in self.levels]
+        other._random.set_state(self._random.get_state())
+        return other
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def _items(self):
+        """The items in order, with their cumulative weights."""
+        if self._sorted is None:
+            items = np.concatenate(self.levels)
+            weights = np.concatenate([np.full(len(level), 2 ** h, dtype=np.int64) for h, level in enumerate(self.levels)])
+            order = np.argsort(items, kind='mergesort')
+            self._sorted = items[order], np.cumsum(weights[order])
+        return self._sorted
+
+    def rank(self, values):
+        """The approximate number of values less than or equal to each of
+        `values`."""
+        items, cumulative = self._items()
+        i = np.searchsorted(items, values, side='right')
+        if not len(items):
+            return np.zeros(np.shape(i), dtype=np.int64)
+        return np.where(i > 0, cumulative[np.maximum(i - 1, 0)], 0)
+
+    def cdf(self, values):
+        """The approximate fraction of values less than or equal to each of
+        `values`."""
+        return self.rank(values) / float(max(self.n, 1))
+
+    def quantile(self, q):
+        """Approximate quantiles; `0` and `1` give the exact extremes."""
+        if not self.n:
+            raise ValueError('Cannot compute quantiles of an empty sketch')
+        q = np.asarray(q, dtype=float)
+        items, cumulative = self._items()
+        i = np.minimum(np.searchsorted(cumulative, q * self.n, side='left'), len(items) - 1)
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, items[i]))[()]
+
+    def ecdf(self, n_points=2000):
+        """Points on the approximate CDF, at most `n_points` of them.
+
+        :return: `(values, ranks)` where `ranks` count from 1 up to `n`.
+        """
+        items, cumulative = self._items()
+        if len(items) > n_points:
+            i = np.unique(np.searchsorted(cumulative, np.linspace(cumulative[0], self.n, n_points), side='left'))
+            items, cumulative = items[i], cumulative[i]
+        return items, cumulative
+
+    def to_bytes(self):
+        """Serialize the sketch (the random state is not kept)."""
+        buf = _io.BytesIO()
+        np.savez(buf, header=np.array([self.k, self.n, self.n_nan], dtype=np.int64),
+                 extremes=np.array([self.min, self.max]),
+                 sizes=np.array([len(level) for level in self.levels], dtype=np.int64),
+                 items=np.concatenate(self.levels))
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, seed=None):
+        """Load a sketch written by :meth:`to_bytes`."""
+        with np.load(_io.BytesIO(data), allow_pickle=False) as arrays:
+            k, n, n_nan = arrays['header'].tolist()
+            sketch = cls(k, seed)
+            sketch.n, sketch.n_nan = n, n_nan
+            sketch.min, sketch.max = arrays['extremes'].tolist()
+            sketch.levels = np.split(arrays['items'], np.cumsum(arrays['sizes'])[:-1])
+        return sketch
+
+
+def _sketch_batch(batch, k):
+    # Runs in the worker
+    return KLLSketch(k).update(batch)
+
+
+def sketch_batches(batches, k=200, n_jobs=1, pbar=False):
+    """Sketch an iterable of batches (arrays), each one in a worker process
+    if `n_jobs > 1`, and merge the sketches.
+
+    :return: A :class:`KLLSketch` of all the values.
+    """
+    sketch = KLLSketch(k)
+    if n_jobs == 1:
+        for batch in batches:
+            sketch.update(batch)
+        return sketch
+    with gparallel_stream(_sketch_batch, batches, n_jobs=n_jobs, ordered=False, pbar=pbar, k=k) as sketches:
+        for part in sketches:
+            sketch.merge(part)
+    return sketch
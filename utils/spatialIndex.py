@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+spatialIndex
+~~~~~~~~~~~~
+
+Nearest neighbour and radius queries over lon/lat points.
+
+Points are placed on the unit sphere and bucketed into a uniform 3D grid of
+cubes.  A query only visits the cubes that can intersect its search ball,
+which is tested exactly on the chord distance (monotonic in great circle
+distance), and the surviving candidates are measured with
+:func:`distanceCalculator.haversine_np`.  Returned distances are therefore
+exactly those of `haversine_np`.
+
+All queries take arrays of query points and are vectorised over them.
+"""
+from __future__ import print_function, absolute_import
+import numpy as np
+from .distanceCalculator import haversine_np
+
+# Earth radius used by haversine_np
+_R_KM = 6367.
+
+# The most (query, offset) or (query, point) candidate pairs made at once
+_PAIR_BUDGET = 2**22
+
+
+def _to_xyz(longitudes, latitudes):
+    lon = np.radians(longitudes)
+    lat = np.radians(latitudes)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def km_to_chord(km):
+    """Straight line distance through the unit sphere for a great circle
+    distance in km."""
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=float) / _R_KM, np.pi) / 2)
+
+
+def chord_to_km(chord):
+    """Inverse of :func:`km_to_chord`."""
+    return _R_KM * 2 * np.arcsin(np.minimum(np.asarray(chord, dtype=float), 2.0) / 2)
+
+
+class SpatialIndex(object):
+    """Grid index over lon/lat points for vectorised kNN and radius queries.
+
+    :param longitudes:
+    :param latitudes: Arrays of the points to index, in degrees.
+    :param cell_km: Edge of the grid cells.  By default the cells are halved
+      until a point shares its cell with about `leaf_size` others on average,
+      which adapts to clustered data (e.g. one city).  Something close to the
+      typical query radius also works well.
+    :param leaf_size: See `cell_km`.
+    """
+    def __init__(self, longitudes, latitudes, cell_km=None, leaf_size=32):
+        self.longitudes = np.asarray(longitudes, dtype=float).ravel()
+        self.latitudes = np.asarray(latitudes, dtype=float).ravel()
+        if self.longitudes.shape != self.latitudes.shape:
+            raise ValueError("longitudes and latitudes must have the same length")
+        n = len(self.longitudes)
+        xyz = _to_xyz(self.longitudes, self.latitudes)
+        if cell_km is None:
+            cell = np.sqrt(4 * np.pi * leaf_size / max(n, 1))
+        else:
+            cell = float(km_to_chord(cell_km))
+        while True:
+            self._grid(xyz, cell)
+            # Shrink the cells until a point shares its cell with about
+            # leaf_size others on average, however clustered the data is
+            crowding = np.dot(self._counts, self._counts) / max(n, 1)
+            if cell_km is not None or crowding <= 4 * leaf_size or self.cell <= 1e-6:
+                break
+            cell = self.cell / 2
+
+    def _grid(self, xyz, cell):
+        # Keys are packed into an int64, which needs fewer than 2**21 cells a side
+        self.cell = float(np.clip(cell, 1e-6, 2.0))
+        self._side = int(2.0 / self.cell) + 1
+        keys = self._keys(np.floor((xyz + 1.0) / self.cell).astype(np.int64))
+        self._order = np.argsort(keys, kind='stable')
+        self._cells, self._starts, self._counts = np.unique(keys[self._order], return_index=True, return_counts=True)
+
+    def __len__(self):
+        return len(self.longitudes)
+
+    def __repr__(self):
+        return "SpatialIndex({} points in {} cells of {:.3f} km)".format(
+            len(self), len(self._cells), float(chord_to_km(self.cell)))
+
+    def _keys(self, ijk):
+        return (ijk[..., 0] * self._side + ijk[..., 1]) * self._side + ijk[..., 2]
+
+    def _candidates(self, xyz, chord):
+        """All `(query, point)` index pairs whose grid cell can hold points
+        within `chord` of the query, as a generator over blocks of queries.
+
+        Each block yields `(query, point, everything)`: the pairs sorted by
+        query (indexing `xyz`), and whether every point was returned for
+        every query of the block.  Blocks are sized so that no more than
+        `_PAIR_BUDGET` (query, offset) or (query, point) pairs are made at
+        once."""
+        reach = int(np.ceil(np.max(chord) / self.cell))
+        n_offsets = (2 * reach + 1) ** 3
+        if n_offsets > max(len(self._cells), 27):
+            # Visiting every cell is cheaper than walking the offsets
+            block = max(1, _PAIR_BUDGET // max(len(self), 1))
+            for s in range(0, len(xyz), block):
+                n = min(block, len(xyz) - s)
+                yield s + np.repeat(np.arange(n), len(self)), np.tile(np.arange(len(self)), n), True
+            return
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+        block = max(1, _PAIR_BUDGET // n_offsets)
+        for s in range(0, len(xyz), block):
+            q, c = xyz[s:s + block], chord[s:s + block]
+            home = np.floor((q + 1.0) / self.cell).astype(np.int64)
+            cells = home[:, None, :] + offsets[None, :, :]
+            # Exact distance from each query to each neighbouring cube
+            lo = cells * self.cell - 1.0
+            gap = np.maximum(np.maximum(lo - q[:, None, :], q[:, None, :] - (lo + self.cell)), 0)
+            near = np.einsum('qoi,qoi->qo', gap, gap) <= (c ** 2)[:, None]
+            near &= np.all((cells >= 0) & (cells < self._side), axis=-1)
+            qi, oi = np.nonzero(near)
+            keys = self._keys(cells[qi, oi])
+            pos = np.minimum(np.searchsorted(self._cells, keys), len(self._cells) - 1)
+            hit = self._cells[pos] == keys
+            qi, pos = qi[hit], pos[hit]
+            counts = self._counts[pos]
+            first = np.cumsum(counts) - counts
+            idx = np.repeat(self._starts[pos] - first, counts) + np.arange(counts.sum())
+            yield s + np.repeat(qi, counts), self._order[idx], False
+
+    def _prepare(self, longitudes, latitudes):
+        lon, lat = np.broadcast_arrays(np.atleast_1d(np.asarray(longitudes, dtype=float)),
+                                       np.atleast_1d(np.asarray(latitudes, dtype=float)))
+        return lon.ravel(), lat.ravel()
+
+    def query_radius_pairs(self, longitudes, latitudes, radius_km, batch_size=1024):
+        """Every `(query, point)` pair within `radius_km` of each other, as
+        flat arrays.  This is the cheapest form for large batches.
+
+        :param radius_km: Scalar, or one radius per query.
+
+        :return: `(query_indices, point_indices, distances_km)`, sorted by
+          query index.
+        """
+        lon, lat = self._prepare(longitudes, latitudes)
+        radius = np.broadcast_to(np.asarray(radius_km, dtype=float), lon.shape)
+        # Pad the chord a little so rounding never drops a boundary point;
+        # the haversine test below is the exact one.
+        chord = km_to_chord(radius) * (1 + 1e-9) + 1e-12
+        xyz = _to_xyz(lon, lat)
+        out_q, out_p, out_d = [], [], []
+        for s in range(0, len(lon), batch_size):
+            e = s + batch_size
+            for qi, pi, _ in self._candidates(xyz[s:e], chord[s:e]):
+                qi += s
+                d = haversine_np(lon[qi], lat[qi], self.longitudes[pi], self.latitudes[pi])
+                keep = d <= radius[qi]
+                out_q.append(qi[keep])
+                out_p.append(pi[keep])
+                out_d.append(d[keep])
+        if not out_q:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(out_q), np.concatenate(out_p), np.concatenate(out_d)
+
+    def query_radius(self, longitudes, latitudes, radius_km, return_distance=False, sort_results=False, batch_size=1024):
+        """Indices of the points within `radius_km` of each query point.
+
+        :param radius_km: Scalar, or one radius per query.
+        :param return_distance: Also return the haversine distances.
+        :param sort_results: Sort each result by distance.
+
+        :return: A list with an array of point indices per query, and a
+          matching list of distance arrays if `return_distance`.
+        """
+        qi, pi, d = self.query_radius_pairs(longitudes, latitudes, radius_km, batch_size)
+        n_queries = len(self._prepare(longitudes, latitudes)[0])
+        if sort_results:
+            order = np.lexsort((d, qi))
+            qi, pi, d = qi[order], pi[order], d[order]
+        splits = np.cumsum(np.bincount(qi, minlength=n_queries))[:-1]
+        if return_distance:
+            return np.split(pi, splits), np.split(d, splits)
+        return np.split(pi, splits)
+
+    def query(self, longitudes, latitudes, k=1, batch_size=1024):
+        """The `k` nearest indexed points to each query point.
+
+        The search ball starts at one grid cell and doubles for the queries
+        that have not yet found `k` points inside it.
+
+        :return: `(distances_km, indices)`, both of shape `(n_queries, k)`
+          and sorted by distance.  Missing neighbours (fewer than `k` points
+          indexed) are `inf` and `-1`.
+        """
+        lon, lat = self._prepare(longitudes, latitudes)
+        xyz = _to_xyz(lon, lat)
+        distances = np.full((len(lon), k), np.inf)
+        indices = np.full((len(lon), k), -1, dtype=np.int64)
+        kk = min(k, len(self))
+        if kk == 0:
+            return distances, indices
+        for s in range(0, len(lon), batch_size):
+            remaining = np.arange(s, min(s + batch_size, len(lon)))
+            chord = self.cell
+            while remaining.size:
+                finished = np.zeros(len(remaining), dtype=bool)
+                for qi, pi, everything in self._candidates(xyz[remaining], np.full(len(remaining), min(chord, 2.0))):
+                    d = haversine_np(lon[remaining[qi]], lat[remaining[qi]], self.longitudes[pi], self.latitudes[pi])
+                    if everything:
+                        # Brute force: pick the k smallest of each row directly
+                        block = qi[::len(self)]
+                        d = d.reshape(len(block), len(self))
+                        nearest = np.argpartition(d, kk - 1, axis=1)[:, :kk]
+                        nearest_d = np.take_along_axis(d, nearest, axis=1)
+                        order = np.argsort(nearest_d, axis=1)
+                        distances[remaining[block], :kk] = np.take_along_axis(nearest_d, order, axis=1)
+                        indices[remaining[block], :kk] = np.take_along_axis(nearest, order, axis=1)
+                        finished[block] = True
+                        continue
+                    # Only points inside the ball are guaranteed to be the closest
+                    inside = d <= chord_to_km(chord)
+                    done = np.bincount(qi[inside], minlength=len(remaining)) >= kk
+                    take = inside & done[qi]
+                    qi, pi, d = qi[take], pi[take], d[take]
+                    order = np.lexsort((d, qi))
+                    qi, pi, d = qi[order], pi[order], d[order]
+                    rank = np.arange(len(qi)) - np.searchsorted(qi, qi)
+                    top = rank < kk
+                    rows = remaining[qi[top]]
+                    distances[rows, rank[top]] = d[top]
+                    indices[rows, rank[top]] = pi[top]
+                    finished |= done
+                remaining = remaining[~finished]
+                chord *= 2
+        return distances, indices
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+tilecache
+~~~~~~~~~
+
+Two tier cache for web-mercator map tiles.  Decoded tiles, as read-only RGB
+`uint8` arrays, are held in a bounded in-memory LRU, measured in bytes, which sits on top of a persistent
+on-disk store of the raw encoded tile bytes keyed by
+`(tile_source, zoom, x, y)`.
+
+The disk tier is a single sqlite database, so it survives restarts and can be
+shared between processes (e.g. the workers of a :mod:`PARTools` pool).  It is
+capped in size and evicts the least recently used tiles first.
+
+Stitched mosaics are cached separately by :class:`MosaicCache`, so that
+re-rendering the same or an overlapping area only stitches the new tiles.
+"""
+from __future__ import print_function, absolute_import
+import os
+import io as _io
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import PIL.Image as _Image
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    'UTILS_TILE_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'utils', 'tiles.sqlite'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    source TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (source, z, x, y)
+);
+CREATE INDEX IF NOT EXISTS tiles_atime ON tiles (atime);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    nbytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO usage VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS tiles_insert AFTER INSERT ON tiles BEGIN
+    UPDATE usage SET nbytes = nbytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS tiles_delete AFTER DELETE ON tiles BEGIN
+    UPDATE usage SET nbytes = nbytes - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS tiles_update AFTER UPDATE OF size ON tiles BEGIN
+    UPDATE usage SET nbytes = nbytes - OLD.size + NEW.size;
+END;
+"""
+
+
+def decode_tile(data):
+    """Decode the raw bytes of a tile into a read-only `(height, width, 3)`
+    RGB `uint8` array, converting palette / alpha / greyscale tiles once here
+    rather than every time they are drawn.  Raises whatever
+    :package:`Pillow` raises on bad data."""
+    image = _Image.open(_io.BytesIO(data))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    tile = np.asarray(image)
+    tile.flags.writeable = False
+    return tile
+
+
+class MemoryLRU(object):
+    """A thread safe least-recently-used mapping bounded by the total size
+    of its values.
+
+    :param max_bytes: Capacity of the cache in bytes.
+    :param sizeof: Function returning the size in bytes of a value.
+    """
+    def __init__(self, max_bytes=256 * 2**20, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value for `key` and mark it as most recently used."""
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Insert `value`, evicting least recently used entries until the
+        cache fits in `max_bytes`.  Values larger than the whole cache are
+        not stored."""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.nbytes -= old_size
+                self.evictions += 1
+
+    def items(self):
+        """Snapshot of the `(key, value)` pairs, least recently used first."""
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+
+class DiskTileStore(object):
+    """Persistent store of encoded tile bytes keyed by
+    `(tile_source, zoom, x, y)`.
+
+    Each process (and thread) opens its own connection to the database, so an
+    instance can be handed to forked or pickled workers.  Writes are done in
+    `IMMEDIATE` transactions and the database runs in WAL mode, so readers
+    and writers in different processes do not block each other for long.
+
+    :param path: Location of the sqlite database.  Parent directories are
+      created on first use.
+    :param max_bytes: Cap on the total size of the stored tiles.  Least
+      recently used tiles are deleted once this is exceeded.  `None` for no
+      cap.
+    :param timeout: Seconds to wait on a lock held by another process.
+    :param touch_interval: A read only records the access time of a tile
+      that was last accessed more than this many seconds ago, so that repeated
+      reads are not all writes.  Eviction order is approximate to within it.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=2 * 2**30, timeout=60.0, touch_interval=60.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+        self.evictions = 0
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def __repr__(self):
+        return "DiskTileStore({!r}, max_bytes={})".format(self.path, self.max_bytes)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """Return the encoded bytes stored under `key`, or `None`."""
+        source, z, x, y = key
+        conn = self._connect()
+        row = conn.execute("SELECT data, atime FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                           (source, z, x, y)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.touch_interval:
+            conn.execute("UPDATE tiles SET atime=? WHERE source=? AND z=? AND x=? AND y=?",
+                         (now, source, z, x, y))
+        return bytes(row[0])
+
+    def __contains__(self, key):
+        source, z, x, y = key
+        row = self._connect().execute("SELECT 1 FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                                      (source, z, x, y)).fetchone()
+        return row is not None
+
+    def put(self, key, data):
+        """Store the encoded bytes `data` under `key`, then evict the least
+        recently used tiles if the store is over its size cap."""
+        source, z, x, y = key
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO tiles (source, z, x, y, data, size, atime) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                         "ON CONFLICT (source, z, x, y) DO UPDATE SET "
+                         "data=excluded.data, size=excluded.size, atime=excluded.atime",
+                         (source, z, x, y, sqlite3.Binary(data), len(data), time.time()))
+            if self.max_bytes is not None:
+                while conn.execute("SELECT nbytes FROM usage").fetchone()[0] > self.max_bytes:
+                    cursor = conn.execute("DELETE FROM tiles WHERE rowid IN "
+                                          "(SELECT rowid FROM tiles ORDER BY atime LIMIT 16)")
+                    if cursor.rowcount <= 0:
+                        break
+                    self.evictions += cursor.rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        """Remove the tile stored under `key`, if any."""
+        source, z, x, y = key
+        self._connect().execute("DELETE FROM tiles WHERE source=? AND z=? AND x=? AND y=?",
+                                (source, z, x, y))
+
+    @property
+    def nbytes(self):
+        """Total size of the stored tiles in bytes."""
+        return self._connect().execute("SELECT nbytes FROM usage").fetchone()[0]
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def clear(self):
+        self._connect().execute("DELETE FROM tiles")
+
+
+class TileCache(object):
+    """Two tier tile cache: a :class:`MemoryLRU` of decoded tiles over an
+    optional :class:`DiskTileStore` of encoded bytes.
+
+    :param memory_bytes: Capacity of the in-memory tier in bytes of decoded
+      pixels.
+    :param disk: A :class:`DiskTileStore`, a path to create one at, or `None`
+      to keep tiles in memory only.
+    """
+    def __init__(self, memory_bytes=256 * 2**20, disk=DEFAULT_CACHE_PATH):
+        self.memory = MemoryLRU(memory_bytes, sizeof=lambda tile: tile.nbytes)
+        if disk is not None and not isinstance(disk, DiskTileStore):
+            disk = DiskTileStore(disk)
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'corrupt': 0}
+
+    def __getstate__(self):
+        # Workers get the disk tier and a fresh, empty memory tier.
+        return {'memory_bytes': self.memory.max_bytes, 'disk': self.disk}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def get(self, tile_source, x, y, zoom, fetch):
+        """Return the decoded tile, calling `fetch(tile_source, x, y, zoom)`
+        for its encoded bytes when neither tier has it.  A disk entry that
+        does not decode is deleted and the tile fetched again."""
+        key = (tile_source, zoom, x, y)
+        tile = self.memory.get(key)
+        if tile is not None:
+            self._count('memory_hits')
+            return tile
+        data = self.disk.get(key) if self.disk is not None else None
+        fetched = data is None
+        if fetched:
+            self._count('misses')
+            data = fetch(tile_source, x, y, zoom)
+        else:
+            self._count('disk_hits')
+        try:
+            tile = decode_tile(data)
+        except Exception:
+            tile = None
+        if tile is None and not fetched:
+            self.disk.delete(key)
+            self._count('corrupt')
+            data = fetch(tile_source, x, y, zoom)
+            fetched = True
+            try:
+                tile = decode_tile(data)
+            except Exception:
+                pass
+        if tile is None:
+            raise RuntimeError("Failed to decode data for {} - {}x{} @ {} zoom".format(tile_source, x, y, zoom))
+        if fetched and self.disk is not None:
+            self.disk.put(key, data)
+        self.memory.put(key, tile)
+        return tile
+
+    def stats(self):
+        """Hit, miss and eviction counters for both tiers."""
+        with self._lock:
+            out = dict(self._counts)
+        out['memory_evictions'] = self.memory.evictions
+        out['memory_bytes'] = self.memory.nbytes
+        out['memory_tiles'] = len(self.memory)
+        out['disk_evictions'] = self.disk.evictions if self.disk is not None else 0
+        return out
+
+    def clear(self, disk=False):
+        """Empty the memory tier, and the disk tier too if `disk` is set."""
+        self.memory.clear()
+        if disk and self.disk is not None:
+            self.disk.clear()
+
+
+def _overlap(a, b):
+    """Intersection of two inclusive tile boxes `(xmin, xmax, ymin, ymax)`,
+    or `None`."""
+    xmin, xmax = max(a[0], b[0]), min(a[1], b[1])
+    ymin, ymax = max(a[2], b[2]), min(a[3], b[3])
+    if xmin > xmax or ymin > ymax:
+        return None
+    return (xmin, xmax, ymin, ymax)
+
+
+class MosaicCache(object):
+    """Bounded cache of stitched mosaics (`(height, width, 3)` arrays) keyed
+    by `(tile_source, zoom, tile_box, tile_size)`, where `tile_box` is the
+    inclusive range of tile indices `(xmin, xmax, ymin, ymax)` the mosaic
+    covers and `tile_size` the pixels per tile edge, which is less than 256
+    for downsampled mosaics.
+
+    :param max_pixels: Capacity of the cache in pixels.  Least recently used
+      mosaics are dropped first.
+    """
+    def __init__(self, max_pixels=32 * 2**20):
+        self.mosaics = MemoryLRU(max_pixels, sizeof=lambda mosaic: mosaic.shape[0] * mosaic.shape[1])
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'partial_hits': 0, 'misses': 0, 'reused_tiles': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def get(self, tile_source, zoom, tile_box, tile_size=256):
+        """The mosaic covering exactly `tile_box`, or `None`."""
+        mosaic = self.mosaics.get((tile_source, zoom, tuple(tile_box), tile_size))
+        if mosaic is not None:
+            self._count('hits')
+        return mosaic
+
+    def best_overlap(self, tile_source, zoom, tile_box, tile_size=256):
+        """The cached mosaic sharing the most tiles with `tile_box`.
+
+        :return: `(cached_box, overlap_box, mosaic)` or `None`.
+        """
+        best, best_tiles = None, 0
+        for (source, z, box, size), mosaic in self.mosaics.items():
+            if source != tile_source or z != zoom or size != tile_size:
+                continue
+            overlap = _overlap(box, tile_box)
+            if overlap is None:
+                continue
+            tiles = (overlap[1] + 1 - overlap[0]) * (overlap[3] + 1 - overlap[2])
+            if tiles > best_tiles:
+                best, best_tiles = (box, overlap, mosaic), tiles
+        if best is None:
+            self._count('misses')
+        else:
+            self._count('partial_hits')
+            self._count('reused_tiles', best_tiles)
+        return best
+
+    def put(self, tile_source, zoom, tile_box, mosaic, tile_size=256):
+        self.mosaics.put((tile_source, zoom, tuple(tile_box), tile_size), mosaic)
+
+    def stats(self):
+        """Hit counters, the number of tiles copied from overlapping
+        mosaics, and the pixels held."""
+        with self._lock:
+            out = dict(self._counts)
+        out['evictions'] = self.mosaics.evictions
+        out['pixels'] = self.mosaics.nbytes
+        out['mosaics'] = len(self.mosaics)
+        return out
+
+    def clear(self):
+        self.mosaics.clear()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+tilefetch
+~~~~~~~~~
+
+Concurrent tile downloading.  A :class:`TileFetcher` owns one keep-alive
+:class:`requests.Session`, whose connection pool is shared by a bounded thread
+pool, limits the number of simultaneous requests made to any one host and
+retries transient failures with exponential backoff.
+
+Tiles are handed back as they arrive, so callers (e.g.
+:func:`geoplot.as_one_image`) can paste each one without waiting for the
+slowest download.
+"""
+from __future__ import print_function, absolute_import
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from itertools import islice
+import requests as _requests
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlsplit
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TileFetcher(object):
+    """Download tiles concurrently over pooled HTTP connections.
+
+    :param max_workers: Size of the thread pool, i.e. the most tiles fetched
+      at once in total.
+    :param per_host: The most requests in flight to a single host.
+    :param retries: How many times a failed request is retried.  Connection
+      errors, timeouts and the statuses in `RETRY_STATUSES` are retried, other
+      failures are raised immediately.
+    :param backoff: Seconds to wait before the first retry; doubled (with
+      jitter) on each subsequent retry.
+    :param timeout: Per request timeout in seconds.
+    """
+    def __init__(self, max_workers=16, per_host=8, retries=3, backoff=0.25, timeout=30.0):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'max_workers': self.max_workers, 'per_host': self.per_host,
+                'retries': self.retries, 'backoff': self.backoff, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _setup(self):
+        """(Re)create the session and thread pool, once per process."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            session = _requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._host_limits = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+            self._pid = os.getpid()
+
+    def close(self):
+        """Shut down the thread pool and close pooled connections."""
+        if self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+            self._session.close()
+        self._pid = None
+
+    def fetch(self, tile_source, x, y, zoom):
+        """Download the encoded bytes of one tile, retrying transient
+        failures.
+
+        :return: The raw (e.g. PNG) bytes of the tile.
+        """
+        self._setup()
+        url = tile_source.format(x=x, y=y, z=zoom)
+        with self._lock:
+            limit = self._host_limits[urlsplit(url).netloc]
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                with limit:
+                    response = self._session.get(url, timeout=self.timeout)
+            except (_requests.ConnectionError, _requests.Timeout) as e:
+                if last:
+                    raise IOError("Failed to download {}.  Got {}".format(url, e))
+            else:
+                if response.ok:
+                    return response.content
+                if last or response.status_code not in RETRY_STATUSES:
+                    raise IOError("Failed to download {}.  Got {}".format(url, response))
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def get_tiles(self, tile_source, tiles, zoom, get):
+        """Fetch many tiles concurrently, yielding them in completion order.
+
+        :param tiles: Iterable of `(x, y)` tile coordinates.
+        :param get: Function `get(tile_source, x, y, zoom)` returning a tile,
+          e.g. :func:`geoplot.get_tile`, so that the cache is consulted
+          before :meth:`fetch` is.
+
+        :return: Generator of `((x, y), tile)` pairs.  If any tile fails, the
+          outstanding ones are cancelled and the error is raised.
+        """
+        self._setup()
+        futures = {self._executor.submit(get, tile_source, x, y, zoom): (x, y) for x, y in tiles}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def fetch_many(self, tiles, max_inflight=None):
+        """Download many tiles concurrently, yielding them in completion
+        order.  Unlike :meth:`get_tiles` a failed tile does not stop the
+        others, and the input is read lazily so it can be very long.
+
+        :param tiles: Iterable of `(tile_source, x, y, zoom)`.
+        :param max_inflight: The most downloads queued at once, defaults to
+          four per thread.
+
+        :return: Generator of `(tile, data, error)`, where `data` is the
+          encoded bytes or `None` and `error` the exception raised, if any.
+        """
+        self._setup()
+        if max_inflight is None:
+            max_inflight = 4 * self.max_workers
+        tiles = iter(tiles)
+        pending = {}
+        try:
+            while True:
+                for tile in islice(tiles, max_inflight - len(pending)):
+                    pending[self._executor.submit(self.fetch, *tile)] = tile
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile = pending.pop(future)
+                    error = future.exception()
+                    yield tile, None if error else future.result(), error
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+tileprefetch
+~~~~~~~~~~~~
+
+Seed the persistent tile store ahead of time, so that rendering jobs never
+wait on (or fail because of) live tile downloads.
+
+Tiles can be chosen to cover an :class:`mapping.Extent`, or a corridor of a
+given width around a trajectory, over a range of zoom levels.  They are
+downloaded concurrently straight into the disk tier of
+:data:`geoplot.tile_cache`.  Tiles already in the store are skipped, so an
+interrupted run is resumed by running it again.  Runs that would not fit
+in a capped store are refused rather than left to evict their own tiles.
+
+From the command line::
+
+    python -m utils.tileprefetch SOURCE --extent 36.6 37.1 -1.5 -1.1 --zoom 10 15
+    python -m utils.tileprefetch SOURCE --trajectory trace.csv --buffer-km 0.5 --zoom 12 17
+"""
+from __future__ import print_function, absolute_import
+import argparse
+import io as _io
+import time
+import numpy as np
+import PIL.Image as _Image
+from tqdm import tqdm
+from .mapping import Extent, to_web_mercator_np, tiles_in_ranges
+from .distanceCalculator import r_earth
+
+
+def _expand_ranges(zoom, xmin, xmax, ymin, ymax):
+    """All distinct tiles in a set of inclusive index ranges at one zoom
+    level, as an `(N, 2)` array of `(x, y)`."""
+    return tiles_in_ranges(zoom, xmin, xmax, ymin, ymax)[:, 1:]
+
+
+def tiles_for_extent(extent, zoom):
+    """The tiles covering `extent` at `zoom`, as an `(N, 2)` array of
+    `(x, y)`.
+
+    :param extent: An :class:`mapping.Extent`, or a list
+      `[min_lon, max_lon, min_lat, max_lat]` as for :func:`geoplot.getTile`.
+    """
+    if not isinstance(extent, Extent):
+        extent = Extent.from_lonlat(*extent)
+    return _expand_ranges(zoom, *extent.tile_range(zoom))
+
+
+def tiles_for_trajectory(longitudes, latitudes, zoom, buffer_km=0.0):
+    """The tiles within `buffer_km` of a trajectory at `zoom`, as an
+    `(N, 2)` array of `(x, y)`.
+
+    Segments are densified first, so long jumps between fixes do not skip
+    the tiles in between.
+    """
+    x, y = to_web_mercator_np(longitudes, latitudes)
+    scale = 2 ** zoom
+    x, y = x * scale, y * scale
+    if len(x) > 1:
+        # At most half a tile between consecutive points
+        steps = np.maximum(np.ceil(2 * np.hypot(np.diff(x), np.diff(y))), 1).astype(np.int64)
+        start = np.repeat(np.arange(len(steps)), steps)
+        frac = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+        frac = frac / np.repeat(steps, steps)
+        x = np.append(x[start] + frac * np.diff(x)[start], x[-1])
+        y = np.append(y[start] + frac * np.diff(y)[start], y[-1])
+    # Buffer in tile units: the y (and, by conformality, x) scale of web
+    # mercator grows as 1 / cos(latitude)
+    latitude = np.arctan(np.sinh(np.pi * (1 - 2 * y / scale)))
+    buffer = buffer_km / (2 * np.pi * r_earth * np.cos(latitude)) * scale
+    return _expand_ranges(zoom, np.floor(x - buffer), np.floor(x + buffer),
+                          np.floor(y - buffer), np.floor(y + buffer))
+
+
+def _is_image(data):
+    try:
+        _Image.open(_io.BytesIO(data))
+        return True
+    except Exception:
+        return False
+
+
+#: Assumed size in bytes of an encoded tile when the store is still empty.
+TYPICAL_TILE_BYTES = 20 * 2**10
+
+
+def estimate_bytes(tiles_by_zoom, store):
+    """Rough size of a set of tiles once stored, from the average size of
+    the tiles already in `store` (or :data:`TYPICAL_TILE_BYTES`)."""
+    count = sum(len(tiles) for tiles in tiles_by_zoom.values())
+    stored = len(store)
+    average = store.nbytes / float(stored) if stored else TYPICAL_TILE_BYTES
+    return int(count * average)
+
+
+def prefetch(tile_source, tiles_by_zoom, store=None, fetcher=None, pbar=True, allow_eviction=False):
+    """Download tiles into the persistent store, skipping those it already
+    has.
+
+    A capped store evicts its least recently used tiles, which would be the
+    ones fetched earliest in the same run once the run outgrows the cap.  So
+    unless `allow_eviction` is set, a run whose :func:`estimate_bytes` is over
+    the cap is refused up front, and one that turns out bigger than its
+    estimate is stopped as soon as it has downloaded more than the cap.  Use
+    a larger store, or one with `max_bytes=None`.
+
+    :param tiles_by_zoom: Dict of `zoom -> (N, 2)` array of `(x, y)`, e.g.
+      from :func:`tiles_for_extent` or :func:`tiles_for_trajectory`.
+    :param store: The :class:`tilecache.DiskTileStore` to fill, defaults to
+      the disk tier of :data:`geoplot.tile_cache`.
+    :param fetcher: The :class:`tilefetch.TileFetcher` to download with,
+      defaults to :data:`geoplot.tile_fetcher`.
+    :param pbar: Show a progress bar with the download rate.
+    :param allow_eviction: Fill a capped store even if the tiles cannot all
+      fit in it.
+
+    :return: Dict of counts (`requested`, `cached`, `fetched`, `failed`),
+      `bytes` downloaded, `seconds` taken and the resulting `tiles_per_second`
+      and `bytes_per_second`.  Up to 10 of the errors are kept in `errors`.
+    """
+    if store is None or fetcher is None:
+        from . import geoplot
+        store = geoplot.tile_cache.disk if store is None else store
+        fetcher = geoplot.tile_fetcher if fetcher is None else fetcher
+    if store is None:
+        raise ValueError("prefetch needs a DiskTileStore to fill")
+    capped = store.max_bytes is not None and not allow_eviction
+    if capped:
+        estimate = estimate_bytes(tiles_by_zoom, store)
+        if estimate > store.max_bytes:
+            raise ValueError("About {} bytes of tiles would not fit in {!r}, so later tiles would evict "
+                             "earlier ones: use a larger or uncapped store, or pass allow_eviction=True"
+                             .format(estimate, store))
+    stats = {'requested': 0, 'cached': 0, 'fetched': 0, 'failed': 0, 'bytes': 0, 'errors': []}
+    start = time.time()
+    total = sum(len(tiles) for tiles in tiles_by_zoom.values())
+    bar = tqdm(total=total, unit='tile', unit_scale=True, disable=not pbar)
+
+    def missing():
+        for zoom in sorted(tiles_by_zoom):
+            for x, y in tiles_by_zoom[zoom]:
+                stats['requested'] += 1
+                if (tile_source, zoom, int(x), int(y)) in store:
+                    stats['cached'] += 1
+                    bar.update(1)
+                else:
+                    yield tile_source, int(x), int(y), zoom
+
+    try:
+        for (source, x, y, zoom), data, error in fetcher.fetch_many(missing()):
+            if error is None and not _is_image(data):
+                error = IOError("Not an image: {} - {}x{} @ {} zoom".format(source, x, y, zoom))
+            if error is None:
+                if capped and stats['bytes'] + len(data) > store.max_bytes:
+                    raise ValueError("Fetched more than the {} byte cap of {!r} in tiles: use a larger "
+                                     "or uncapped store, or pass allow_eviction=True".format(store.max_bytes, store))
+                store.put((source, zoom, x, y), data)
+                stats['fetched'] += 1
+                stats['bytes'] += len(data)
+            else:
+                stats['failed'] += 1
+                if len(stats['errors']) < 10:
+                    stats['errors'].append(error)
+            bar.update(1)
+            bar.set_postfix(fetched=stats['fetched'], failed=stats['failed'],
+                            MBps='{:.2f}'.format(stats['bytes'] / 2**20 / max(time.time() - start, 1e-9)))
+    finally:
+        bar.close()
+    stats['seconds'] = time.time() - start
+    stats['tiles_per_second'] = stats['fetched'] / max(stats['seconds'], 1e-9)
+    stats['bytes_per_second'] = stats['bytes'] / max(stats['seconds'], 1e-9)
+    return stats
+
+
+def prefetch_extent(tile_source, extent, zooms, **kwargs):
+    """:func:`prefetch` every tile covering `extent` for each zoom level in
+    `zooms`."""
+    return prefetch(tile_source, {z: tiles_for_extent(extent, z) for z in zooms}, **kwargs)
+
+
+def prefetch_trajectory(tile_source, longitudes, latitudes, zooms, buffer_km=0.0, **kwargs):
+    """:func:`prefetch` every tile within `buffer_km` of the trajectory for
+    each zoom level in `zooms`."""
+    return prefetch(tile_source, {z: tiles_for_trajectory(longitudes, latitudes, z, buffer_km) for z in zooms}, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the persistent tile store for an extent or a trajectory corridor.")
+    parser.add_argument('tile_source', help="Tile URL template with {z}, {x} and {y}")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--extent', nargs=4, type=float, metavar=('MIN_LON', 'MAX_LON', 'MIN_LAT', 'MAX_LAT'))
+    where.add_argument('--trajectory', metavar='CSV', help="File of longitude,latitude rows; a header line is skipped")
+    parser.add_argument('--buffer-km', type=float, default=0.0, help="Corridor half-width around the trajectory")
+    parser.add_argument('--zoom', nargs=2, type=int, required=True, metavar=('MIN', 'MAX'), help="Inclusive zoom range")
+    parser.add_argument('--cache', help="sqlite tile store to fill, defaults to the geoplot tile cache")
+    parser.add_argument('--max-bytes', type=float, default=None, help="Size cap of the store; none by default")
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=8)
+    parser.add_argument('--allow-eviction', action='store_true',
+                        help="Fill a capped store even if the tiles do not all fit")
+    args = parser.parse_args(argv)
+
+    from .tilecache import DiskTileStore, DEFAULT_CACHE_PATH
+    from .tilefetch import TileFetcher
+    store = DiskTileStore(args.cache or DEFAULT_CACHE_PATH,
+                          max_bytes=None if args.max_bytes is None else int(args.max_bytes))
+    fetcher = TileFetcher(max_workers=args.workers, per_host=args.per_host)
+    zooms = range(args.zoom[0], args.zoom[1] + 1)
+    if args.extent is not None:
+        stats = prefetch_extent(args.tile_source, args.extent, zooms, store=store, fetcher=fetcher,
+                                allow_eviction=args.allow_eviction)
+    else:
+        points = np.genfromtxt(args.trajectory, delimiter=',', usecols=(0, 1))
+        points = points[~np.isnan(points).any(axis=1)]
+        stats = prefetch_trajectory(args.tile_source, points[:, 0], points[:, 1], zooms,
+                                    buffer_km=args.buffer_km, store=store, fetcher=fetcher,
+                                    allow_eviction=args.allow_eviction)
+    fetcher.close()
+    for error in stats.pop('errors'):
+        print(error)
+    print("requested {requested}, already cached {cached}, fetched {fetched}, failed {failed}: "
+          "{bytes} bytes in {seconds:.1f}s ({tiles_per_second:.1f} tiles/s, {bytes_per_second:.0f} B/s)".format(**stats))
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())